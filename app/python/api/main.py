@@ -3,41 +3,53 @@
 API para registo de despesas por foto.
 POST /api/registar-despesa: foto + centro_custo_codigo → OCR → gravar custos
 """
+import base64
+import json
 import os
-import re
+import sqlite3
 import sys
 from pathlib import Path
 
+import numpy as np
+
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-from utils.taxas_iva import parse_taxa_iva
+from utils.cache_excel import CACHE
+from utils.custos_colunar import ConsultaColunar, CustosColunar
+from utils.fila_jobs import ERRO, FILA
+from utils.indice_texto import LinhasComIndice, indice_para
+from utils import (
+    cache_documentos, custos_sqlite, diario_custos, duplicados_facturas, escrita_excel, ocr, rollup_custos,
+)
 
 BASE_PATH = Path(os.getenv("GESTAO_BASE_PATH", "/home/bailan/empresa-gestao/GESTAO_EMPRESA"))
 DADOS_PATH = BASE_PATH / "03_CONTABILIDADE_ANALITICA" / "dados"
 CUSTOS_LINHAS = DADOS_PATH / "custos_linhas.xlsx"
 CUSTOS_REGISTO = DADOS_PATH / "custos_registo.xlsx"
+CUSTOS_DB = DADOS_PATH / custos_sqlite.NOME_DB
+DOCUMENTOS = cache_documentos.CacheDocumentos(DADOS_PATH / cache_documentos.NOME_DB)
+# Motor das consultas de custos: "sqlite" (espelho indexado) ou "colunar" (NumPy em memória)
+MOTOR_CUSTOS = os.getenv("GESTAO_MOTOR_CUSTOS", "sqlite")
 OBRAS_PATH = BASE_PATH / "03_CONTABILIDADE_ANALITICA" / "obras"
 UPLOADS_PATH = DADOS_PATH / "uploads"
 FACTURAS_EXTRAIDAS = DADOS_PATH / "facturas_extraidas"
 UPLOADS_PATH.mkdir(parents=True, exist_ok=True)
 FACTURAS_EXTRAIDAS.mkdir(parents=True, exist_ok=True)
+INDICE_DUPLICADOS = duplicados_facturas.IndiceDuplicados(
+    DADOS_PATH / cache_documentos.NOME_DB, FACTURAS_EXTRAIDAS, CUSTOS_REGISTO
+)
 
 try:
-    from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Query
+    from fastapi import FastAPI, File, Form, UploadFile, HTTPException, Query, Request
+    from fastapi.encoders import jsonable_encoder
     from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.concurrency import run_in_threadpool
+    from fastapi.responses import JSONResponse, StreamingResponse
 except ImportError:
     print("Instale: pip install fastapi uvicorn python-multipart")
     sys.exit(1)
 
 try:
-    import pytesseract
-    from PIL import Image
-    OCR_AVAILABLE = True
-except ImportError:
-    OCR_AVAILABLE = False
-
-try:
-    from openpyxl import load_workbook
-    from openpyxl.utils import get_column_letter
+    from utils.leitor_excel import ler_cabecalho, ler_linhas, ler_tabela
     XL_AVAILABLE = True
 except ImportError:
     XL_AVAILABLE = False
@@ -52,85 +64,59 @@ app.add_middleware(
 
 
 def _ocr_image(img_path: Path) -> str:
-    if not OCR_AVAILABLE:
-        return ""
-    try:
-        img = Image.open(img_path)
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-        return pytesseract.image_to_string(img, lang="por+eng")
-    except Exception as e:
-        return f"[OCR erro: {e}]"
+    return ocr.ocr_imagem(img_path)
 
 
 def _extrair_dados_ocr(texto: str) -> dict:
-    """Extrai fornecedor, data, valores e IVA do texto OCR."""
-    out = {"supplier": "", "date": "", "net_amount": None, "tax_pct": None, "description": ""}
-    lines = [l.strip() for l in texto.splitlines() if l.strip()]
-    for i, line in enumerate(lines):
-        # Data (dd-mm-yyyy, dd/mm/yyyy, yyyy-mm-dd)
-        m = re.search(r"(\d{1,2})[-/](\d{1,2})[-/](\d{2,4})", line)
-        if m and not out["date"]:
-            d, mo, y = m.groups()
-            out["date"] = f"20{y[-2:]}-{mo.zfill(2)}-{d.zfill(2)}" if len(y) == 2 else f"{y}-{mo.zfill(2)}-{d.zfill(2)}"
-        # Valores: Total, IVA
-        for p in [r"total[:\s]*(\d+[,.]\d{2})", r"(\d+[,.]\d{2})\s*€", r"iva[:\s]*(\d+[,.]?\d*)%?"]:
-            m = re.search(p, line.lower())
-            if m:
-                v = m.group(1).replace(",", ".")
-                try:
-                    n = float(v)
-                    if "iva" in line.lower() or "%" in line:
-                        out["tax_pct"] = parse_taxa_iva(v)
-                    elif out["net_amount"] is None and n > 0:
-                        out["net_amount"] = n
-                except ValueError:
-                    pass
-    # Primeira linha costuma ser fornecedor
-    if lines and not out["supplier"]:
-        out["supplier"] = lines[0][:100]
-    return out
+    """Fornecedor, data, valor e IVA do texto OCR (mesmo motor que extrair_factura)."""
+    from custos.extrair_factura import extrair_dados_despesa
+    return extrair_dados_despesa(texto)
 
 
-def _append_custo(centro: str, dados: dict, origem: str = "foto") -> None:
-    if not XL_AVAILABLE:
+def _append_custos(centro: str, itens: list[tuple[dict, str]]) -> None:
+    """
+    Acrescenta despesas (dados, origem) ao diário de custos_linhas numa única escrita
+    (compactado para o .xlsx mais tarde).
+    """
+    if not XL_AVAILABLE or not itens:
         return
-    if not CUSTOS_LINHAS.exists():
-        DADOS_PATH.mkdir(parents=True, exist_ok=True)
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "custos_linhas"
-        headers = ["line_id", "document_id", "document_no", "date", "supplier", "description",
-                   "quantity", "unit_price", "net_amount", "tax_pct", "tipo_linha", "centro_custo_codigo"]
-        for c, h in enumerate(headers, 1):
-            cell = ws.cell(1, c, h)
-            cell.fill = PatternFill("solid", fgColor="1F2937")
-            cell.font = Font(bold=True, color="FFFFFF")
-        wb.save(CUSTOS_LINHAS)
-    wb = load_workbook(CUSTOS_LINHAS)
-    ws = wb.active
-    next_row = ws.max_row + 1
-    row_data = {
-        "line_id": f"foto_{next_row}",
-        "document_id": "",
-        "document_no": origem,
-        "date": dados.get("date"),
-        "supplier": dados.get("supplier"),
-        "description": dados.get("description") or f"Registo por {origem}",
-        "quantity": 1,
-        "unit_price": dados.get("net_amount"),
-        "net_amount": dados.get("net_amount"),
-        "tax_pct": dados.get("tax_pct"),
-        "tipo_linha": "materiais",
-        "centro_custo_codigo": centro,
-    }
-    headers = [c.value for c in ws[1]]
-    for col, h in enumerate(headers, 1):
-        if h in row_data:
-            ws.cell(row=next_row, column=col, value=row_data[h])
-    wb.save(CUSTOS_LINHAS)
+    DADOS_PATH.mkdir(parents=True, exist_ok=True)
+    n = escrita_excel.proximo_id(
+        CUSTOS_LINHAS, lambda: diario_custos.ler_linhas(CUSTOS_LINHAS), quantidade=len(itens)
+    )
+    diario_custos.acrescentar(CUSTOS_LINHAS, [
+        {
+            "line_id": f"foto_{n + i}",
+            "document_id": "",
+            "document_no": origem,
+            "date": dados.get("date"),
+            "supplier": dados.get("supplier"),
+            "description": dados.get("description") or f"Registo por {origem}",
+            "quantity": 1,
+            "unit_price": dados.get("net_amount"),
+            "net_amount": dados.get("net_amount"),
+            "tax_pct": dados.get("tax_pct"),
+            "tipo_linha": "materiais",
+            "centro_custo_codigo": centro,
+        }
+        for i, (dados, origem) in enumerate(itens)
+    ])
+
+
+def _append_custo(centro: str, dados: dict, origem: str = "foto") -> None:
+    _append_custos(centro, [(dados, origem)])
+
+
+def _ler_centros(path: Path) -> list[dict]:
+    if "centro_custo_codigo" not in ler_cabecalho(path):
+        return []
+    out = []
+    for r in ler_linhas(path, colunas=["centro_custo_codigo", "centro_custo_nome"]):
+        cod = r.get("centro_custo_codigo")
+        nome = r.get("centro_custo_nome") or ""
+        if cod:
+            out.append({"codigo": str(cod), "nome": str(nome or cod)})
+    return out
 
 
 @app.get("/api/centros-custo")
@@ -139,193 +125,473 @@ def listar_centros():
     path = BASE_PATH / "00_CONFIG" / "centros_custo.xlsx"
     if not path.exists():
         return []
-    wb = load_workbook(path, data_only=True)
-    ws = wb.active
-    idx_cod = next((i for i, c in enumerate(ws[1], 1) if c.value == "centro_custo_codigo"), None)
-    idx_nome = next((i for i, c in enumerate(ws[1], 1) if c.value == "centro_custo_nome"), None)
-    if not idx_cod:
-        return []
-    out = []
-    for r in range(2, ws.max_row + 1):
-        cod = ws.cell(r, idx_cod).value
-        nome = ws.cell(r, idx_nome).value if idx_nome else ""
-        if cod:
-            out.append({"codigo": str(cod), "nome": str(nome or cod)})
-    return out
+    return list(CACHE.obter(path, _ler_centros, tipo="centros"))
 
 
 ORCAMENTOS_CABECALHO = BASE_PATH / "02_OBRAS" / "ORCAMENTOS" / "orcamentos_cabecalho.xlsx"
 
 
+def _ler_orcamentos(path: Path) -> list[dict]:
+    cabecalho, rows = ler_tabela(path, folha=["orcamentos", "orcamentos_cabecalho", "cabecalho"])
+    headers = [str(h or "").strip() for h in cabecalho]
+    col_id = next((c for c, h in zip(cabecalho, headers) if "orcamento_id" in h.lower() or h == "orcamento_id"), None)
+    col_obra = next((c for c, h in zip(cabecalho, headers) if "nome_obra" in h.lower() or "obra" in h.lower()), None)
+    col_cliente = next((c for c, h in zip(cabecalho, headers) if "cliente" in h.lower()), None)
+    col_data = next((c for c, h in zip(cabecalho, headers) if "data" in h.lower()), None)
+    col_estado = next((c for c, h in zip(cabecalho, headers) if "estado" in h.lower()), None)
+    col_total = next((c for c, h in zip(cabecalho, headers) if "total" in h.lower()), None)
+    if not col_id:
+        return []
+    out = []
+    for r in rows:
+        oid = r.get(col_id)
+        if not oid:
+            continue
+        out.append({
+            "orcamento_id": str(oid),
+            "nome_obra": str(r.get(col_obra) or "") if col_obra else "",
+            "cliente": str(r.get(col_cliente) or "") if col_cliente else "",
+            "data_orcamento": str(r.get(col_data) or "") if col_data else "",
+            "estado": str(r.get(col_estado) or "") if col_estado else "",
+            "total_previsto": r.get(col_total) if col_total else None,
+        })
+    return out
+
+
 @app.get("/api/orcamentos")
 def listar_orcamentos():
     """Lista orçamentos do ficheiro Excel."""
     if not XL_AVAILABLE or not ORCAMENTOS_CABECALHO.exists():
         return []
     try:
-        wb = load_workbook(ORCAMENTOS_CABECALHO, data_only=True)
-        ws = None
-        for name in ["orcamentos", "orcamentos_cabecalho", "cabecalho"]:
-            if name in wb.sheetnames:
-                ws = wb[name]
-                break
-        if ws is None:
-            ws = wb.active
-        headers = [str(c.value or "").strip() for c in ws[1]]
-        idx_id = next((i for i, h in enumerate(headers, 1) if "orcamento_id" in h.lower() or h == "orcamento_id"), None)
-        idx_obra = next((i for i, h in enumerate(headers, 1) if "nome_obra" in h.lower() or "obra" in h.lower()), None)
-        idx_cliente = next((i for i, h in enumerate(headers, 1) if "cliente" in h.lower()), None)
-        idx_data = next((i for i, h in enumerate(headers, 1) if "data" in h.lower()), None)
-        idx_estado = next((i for i, h in enumerate(headers, 1) if "estado" in h.lower()), None)
-        idx_total = next((i for i, h in enumerate(headers, 1) if "total" in h.lower()), None)
-        if not idx_id:
-            return []
-        out = []
-        for r in range(2, ws.max_row + 1):
-            oid = ws.cell(r, idx_id).value
-            if not oid:
-                continue
-            out.append({
-                "orcamento_id": str(oid),
-                "nome_obra": str(ws.cell(r, idx_obra).value or "") if idx_obra else "",
-                "cliente": str(ws.cell(r, idx_cliente).value or "") if idx_cliente else "",
-                "data_orcamento": str(ws.cell(r, idx_data).value or "") if idx_data else "",
-                "estado": str(ws.cell(r, idx_estado).value or "") if idx_estado else "",
-                "total_previsto": ws.cell(r, idx_total).value if idx_total else None,
-            })
-        return out
+        return list(CACHE.obter(ORCAMENTOS_CABECALHO, _ler_orcamentos, tipo="orcamentos"))
     except Exception:
         return []
 
 
+EXT_FOTO = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+
+def _texto_documento(sha: str, save_path: Path) -> str:
+    """Texto do OCR da foto, da cache de documentos se este conteúdo já foi reconhecido."""
+    doc = DOCUMENTOS.obter(sha)
+    if doc and doc["texto"]:
+        return doc["texto"]
+    texto = _ocr_image(save_path)
+    DOCUMENTOS.guardar_texto(sha, texto)
+    return texto
+
+
+def _factura_do_centro(factura: dict | None, centro: str) -> dict | None:
+    """Factura em cache com a origem apontada para o centro deste registo (origem "...|centro:X")."""
+    if factura is None:
+        return None
+    factura = dict(factura)
+    origem = (factura.get("origem") or "").split("|centro:")[0]
+    factura["origem"] = f"{origem}|centro:{centro}"
+    factura["centro_custo_sugerido"] = centro
+    return factura
+
+
+def _extrair_despesa(
+    texto: str, centro: str, save_path: Path, nome_original: str, sha: str | None = None
+) -> tuple[dict, dict | None, str | None]:
+    """
+    (dados para custos_linhas, factura estruturada, ficheiro em facturas_extraidas se já gravada),
+    da cache de documentos quando este conteúdo já foi extraído.
+    """
+    doc = DOCUMENTOS.obter(sha) if sha else None
+    if doc and doc["extracao"] and doc["extracao"].get("dados") is not None:
+        dados = dict(doc["extracao"]["dados"])
+        factura = _factura_do_centro(doc["extracao"].get("factura"), centro)
+        # O ficheiro em facturas_extraidas só serve se foi gravado para este centro
+        # (forcar=true com outro centro grava uma extração nova)
+        ficheiro_extraido = doc["ficheiro_extraido"] if doc["centro_custo_codigo"] == centro else None
+    else:
+        dados = _extrair_dados_ocr(texto)
+        factura = None
+        ficheiro_extraido = None
+        try:
+            from custos.extrair_factura import extrair_factura
+            origem = nome_original or save_path.name
+            factura = extrair_factura(texto, origem=f"foto:{origem}|centro:{centro}").to_dict()
+        except Exception:
+            pass  # continua e grava custos_linhas mesmo que extrair_factura falhe
+        if sha and cache_documentos.texto_valido(texto):
+            DOCUMENTOS.guardar_extracao(sha, {"dados": dict(dados), "factura": factura})
+    dados["description"] = dados.get("description") or nome_original or "Foto"
+    return dados, factura, ficheiro_extraido
+
+
+def _guardar_factura_extraida(factura: dict | None, save_path: Path) -> str | None:
+    """Grava a factura em facturas_extraidas (igual ao fluxo email); devolve o nome do .xlsx."""
+    if factura is None:
+        return None
+    base_name = save_path.stem + "_extraida"
+    n = 2
+    while (FACTURAS_EXTRAIDAS / f"{base_name}.json").exists():
+        # Mesmo conteúdo gravado outra vez (forcar=true, ex: noutro centro): não substitui o anterior
+        base_name = f"{save_path.stem}_extraida_{n}"
+        n += 1
+    try:
+        from custos.extrair_factura import factura_de_dict, guardar_factura_json, guardar_factura_excel
+        f = factura_de_dict(factura)
+        guardar_factura_json(f, FACTURAS_EXTRAIDAS / f"{base_name}.json")
+        guardar_factura_excel(f, FACTURAS_EXTRAIDAS / f"{base_name}.xlsx")
+    except Exception:
+        return None
+    return f"{base_name}.xlsx"
+
+
+def _marcar_registado(
+    sha: str, origem: str, centro: str, factura: dict | None, ficheiro_extraido: str | None, novo: bool
+) -> None:
+    """
+    Depois de a despesa estar gravada em custos_linhas: documento registado e, se a factura foi
+    gravada agora em facturas_extraidas, o ficheiro e a entrada no índice de duplicados.
+    Antes disso uma falha na gravação deixaria a própria factura a parecer duplicada.
+    """
+    DOCUMENTOS.marcar_registado(sha, origem, centro)
+    if novo and ficheiro_extraido:
+        DOCUMENTOS.guardar_ficheiro_extraido(sha, ficheiro_extraido)
+        INDICE_DUPLICADOS.registar(factura, Path(ficheiro_extraido).stem, centro)
+
+
+def _resultado_despesa(centro: str, texto: str, dados: dict, ficheiro_extraido: str | None) -> dict:
+    return {
+        "ok": True,
+        "centro_custo_codigo": centro,
+        "duplicado_provavel": False,
+        "ocr_texto": texto[:500] if texto else "(OCR não disponível)",
+        "dados_extraidos": dados,
+        "ficheiro_extraido": ficheiro_extraido,
+    }
+
+
+def _resultado_duplicado(
+    centro: str,
+    registo_anterior: dict,
+    texto: str = "",
+    dados: dict | None = None,
+    ficheiro_extraido: str | None = None,
+) -> dict:
+    """Despesa que parece já registada: nada é gravado (reenviar com forcar=true para gravar)."""
+    return {
+        "ok": True,
+        "centro_custo_codigo": centro,
+        "duplicado_provavel": True,
+        "registo_anterior": registo_anterior,
+        "ocr_texto": (texto or "")[:500],
+        "dados_extraidos": dados,
+        "ficheiro_extraido": ficheiro_extraido,
+    }
+
+
+def _resultado_documento_repetido(centro: str, doc: dict) -> dict:
+    """Duplicado pelo conteúdo (SHA-256): responde com o OCR/extração em cache."""
+    DOCUMENTOS.contar_repeticao(doc["sha256"])
+    extracao = doc.get("extracao") or {}
+    return _resultado_duplicado(
+        centro,
+        {"criterio": "conteudo", **cache_documentos.registo_anterior(doc)},
+        doc.get("texto") or "",
+        extracao.get("dados"),
+        doc.get("ficheiro_extraido"),
+    )
+
+
+def _processar_despesa(
+    job, centro: str, save_path: Path, nome_original: str, sha: str, forcar: bool = False
+) -> dict:
+    """OCR, extração e gravação de uma foto já guardada em uploads (corre num worker)."""
+    with job.etapa("ocr"):
+        texto = _texto_documento(sha, save_path)
+    with job.etapa("extracao"):
+        dados, factura, ficheiro_extraido = _extrair_despesa(texto, centro, save_path, nome_original, sha)
+        igual = None if forcar or factura is None else INDICE_DUPLICADOS.procurar(factura)
+    if igual is not None:
+        return _resultado_duplicado(centro, igual, texto, dados, ficheiro_extraido)
+    with job.etapa("gravacao"):
+        _append_custo(centro, dados, origem=nome_original or "foto")
+        novo = ficheiro_extraido is None
+        if novo:
+            ficheiro_extraido = _guardar_factura_extraida(factura, save_path)
+        _marcar_registado(
+            sha, f"foto:{nome_original or save_path.name}", centro, factura, ficheiro_extraido, novo
+        )
+    return _resultado_despesa(centro, texto, dados, ficheiro_extraido)
+
+
+def _processar_lote(
+    job, centro: str, ficheiros: list[tuple[str, Path | None, str | None, dict | None]], forcar: bool = False
+) -> dict:
+    """
+    Lote de fotos (nome, caminho guardado, sha256, resultado já decidido — formato inválido
+    ou conteúdo repetido): OCR em paralelo das que não estão em cache, extração de cada uma,
+    deteção de faturas repetidas (no índice ou no próprio lote) e uma única escrita em
+    custos_linhas para as restantes.
+    """
+    validos = [(nome, path, sha) for nome, path, sha, pronto in ficheiros if pronto is None]
+    with job.etapa("ocr"):
+        docs = [DOCUMENTOS.obter(sha) for _, _, sha in validos]
+        em_falta = [i for i, doc in enumerate(docs) if not (doc and doc["texto"])]
+        reconhecidos = iter(ocr.ocr_imagens([validos[i][1] for i in em_falta]))
+        textos = [doc["texto"] if doc and doc["texto"] else "" for doc in docs]
+        for i in em_falta:
+            textos[i] = next(reconhecidos)
+            DOCUMENTOS.guardar_texto(validos[i][2], textos[i])
+    with job.etapa("extracao"):
+        extraidos = [
+            _extrair_despesa(texto, centro, path, nome, sha) for (nome, path, sha), texto in zip(validos, textos)
+        ]
+        repetidos: list[dict | None] = []
+        vistas: dict[str, str] = {}
+        for (nome, _, _), texto, (dados, factura, ficheiro_extraido) in zip(validos, textos, extraidos):
+            igual = None
+            if not forcar and factura is not None:
+                ch = [c for c, _ in duplicados_facturas.chaves(factura)]
+                no_lote = next((vistas[c] for c in ch if c in vistas), None)
+                if no_lote is not None:
+                    igual = {"criterio": "lote", "origem": f"lote:{no_lote}"}
+                else:
+                    igual = INDICE_DUPLICADOS.procurar(factura)
+                if igual is None:
+                    vistas.update(dict.fromkeys(ch, nome))
+            repetidos.append(
+                None if igual is None else _resultado_duplicado(centro, igual, texto, dados, ficheiro_extraido)
+            )
+    gravar = [i for i, rep in enumerate(repetidos) if rep is None]
+    with job.etapa("gravacao"):
+        _append_custos(centro, [(extraidos[i][0], validos[i][0] or "foto") for i in gravar])
+        extraidos_gravados = {}
+        for i in gravar:
+            nome, path, sha = validos[i]
+            _, factura, ficheiro_extraido = extraidos[i]
+            novo = ficheiro_extraido is None
+            if novo:
+                ficheiro_extraido = _guardar_factura_extraida(factura, path)
+            extraidos_gravados[i] = ficheiro_extraido
+            _marcar_registado(sha, f"foto:{nome or path.name}", centro, factura, ficheiro_extraido, novo)
+
+    resultados = []
+    i = 0
+    for nome, _, _, pronto in ficheiros:
+        if pronto is None:
+            pronto = repetidos[i] or _resultado_despesa(centro, textos[i], extraidos[i][0], extraidos_gravados[i])
+            i += 1
+        resultados.append({"ficheiro": nome, **pronto})
+    return {
+        "ok": any(r["ok"] for r in resultados),
+        "centro_custo_codigo": centro,
+        "total": len(ficheiros),
+        "registados": len(gravar),
+        "duplicados": sum(1 for r in resultados if r.get("duplicado_provavel")),
+        "resultados": resultados,
+    }
+
+
+def _guardar_upload(content: bytes, ext: str, sha: str) -> Path:
+    """Grava a foto em uploads (uma só cópia por conteúdo)."""
+    existente = DOCUMENTOS.ficheiro(sha)
+    if existente is not None:
+        return existente
+    save_path = UPLOADS_PATH / f"{os.urandom(8).hex()}{ext}"
+    save_path.write_bytes(content)
+    DOCUMENTOS.guardar_ficheiro(sha, save_path)
+    return save_path
+
+
 @app.post("/api/registar-despesa")
 async def registar_despesa(
     centro_custo_codigo: str = Form(...),
     file: UploadFile = File(...),
+    fila: bool = Form(False),
+    forcar: bool = Form(False),
 ):
     """
     Recebe foto de fatura/recibo + centro de custo.
     Faz OCR, extrai dados e grava em custos_linhas.
+    Uma foto com o mesmo conteúdo (SHA-256) de outra já registada, ou cuja fatura já está no
+    índice de duplicados (NIF + número, ou NIF + data + total), não é gravada: a resposta traz
+    duplicado_provavel=true e o registo anterior (forcar=true grava na mesma, sem repetir o OCR).
+    Com fila=true responde logo 202 com o id do job (ver /api/despesas/jobs/{id});
+    caso contrário espera pelo processamento, fora do event loop.
     """
     centro = centro_custo_codigo.strip()
     if not centro:
         raise HTTPException(400, "centro_custo_codigo obrigatório")
 
     ext = Path(file.filename or "").suffix.lower() or ".jpg"
-    if ext not in (".jpg", ".jpeg", ".png", ".gif", ".webp"):
+    if ext not in EXT_FOTO:
         raise HTTPException(400, "Formato inválido. Use jpg, png ou webp.")
 
     content = await file.read()
-    save_path = UPLOADS_PATH / f"{os.urandom(8).hex()}{ext}"
-    save_path.write_bytes(content)
+    sha = await run_in_threadpool(cache_documentos.sha256_bytes, content)
+    if not forcar:
+        anterior = await run_in_threadpool(DOCUMENTOS.registado, sha)
+        if anterior is not None:
+            return await run_in_threadpool(_resultado_documento_repetido, centro, anterior)
+    save_path = await run_in_threadpool(_guardar_upload, content, ext, sha)
+
+    args = (centro, save_path, file.filename or "", sha, forcar)
+    if fila:
+        job = FILA.submeter("despesa", _processar_despesa, *args)
+        return JSONResponse(job.to_dict(), status_code=202)
+
+    job = await run_in_threadpool(FILA.executar, "despesa", _processar_despesa, *args)
+    if job.estado == ERRO:
+        raise HTTPException(500, job.erro)
+    return job.resultado
+
+
+@app.post("/api/registar-despesas/lote")
+async def registar_despesas_lote(
+    centro_custo_codigo: str = Form(...),
+    files: list[UploadFile] = File(...),
+    fila: bool = Form(False),
+    forcar: bool = Form(False),
+):
+    """
+    Várias fotos de faturas/recibos para o mesmo centro de custo.
+    OCR em paralelo e uma única escrita em custos_linhas; resultado por ficheiro
+    (ficheiros com formato inválido vêm com ok=false e não impedem os restantes;
+    duplicados — mesmo conteúdo ou mesma fatura, já registados ou repetidos no lote — vêm com
+    duplicado_provavel=true e não são gravados).
+    Com fila=true responde logo 202 com o id do job.
+    """
+    centro = centro_custo_codigo.strip()
+    if not centro:
+        raise HTTPException(400, "centro_custo_codigo obrigatório")
+    if not files:
+        raise HTTPException(400, "Nenhum ficheiro enviado")
+
+    ficheiros: list[tuple[str, Path | None, str | None, dict | None]] = []
+    no_lote: dict[str, str] = {}
+    for f in files:
+        nome = f.filename or ""
+        ext = Path(nome).suffix.lower() or ".jpg"
+        if ext not in EXT_FOTO:
+            ficheiros.append((nome, None, None, {"ok": False, "erro": "Formato inválido. Use jpg, png ou webp."}))
+            continue
+        content = await f.read()
+        sha = await run_in_threadpool(cache_documentos.sha256_bytes, content)
+        if sha in no_lote:
+            anterior = {"criterio": "conteudo", "origem": f"lote:{no_lote[sha]}"}
+            ficheiros.append((nome, None, sha, _resultado_duplicado(centro, anterior)))
+            continue
+        no_lote[sha] = nome
+        anterior = None if forcar else await run_in_threadpool(DOCUMENTOS.registado, sha)
+        if anterior is not None:
+            ficheiros.append((nome, None, sha, await run_in_threadpool(_resultado_documento_repetido, centro, anterior)))
+            continue
+        save_path = await run_in_threadpool(_guardar_upload, content, ext, sha)
+        ficheiros.append((nome, save_path, sha, None))
 
-    texto = _ocr_image(save_path)
-    dados = _extrair_dados_ocr(texto)
-    dados["description"] = dados.get("description") or file.filename or "Foto"
+    if fila:
+        job = FILA.submeter("lote", _processar_lote, centro, ficheiros, forcar)
+        return JSONResponse(job.to_dict(), status_code=202)
 
-    # Extrair factura estruturada e guardar em facturas_extraidas (igual ao fluxo email)
-    ficheiro_extraido = None
-    try:
-        from custos.extrair_factura import (
-            extrair_factura,
-            guardar_factura_json,
-            guardar_factura_excel,
-        )
-        origem = file.filename or save_path.name
-        factura = extrair_factura(texto, origem=f"foto:{origem}|centro:{centro}")
-        base_name = save_path.stem + "_extraida"
-        guardar_factura_json(factura, FACTURAS_EXTRAIDAS / f"{base_name}.json")
-        guardar_factura_excel(factura, FACTURAS_EXTRAIDAS / f"{base_name}.xlsx")
-        ficheiro_extraido = f"{base_name}.xlsx"
-    except Exception:
-        pass  # continua e grava custos_linhas mesmo que extrair_factura falhe
+    job = await run_in_threadpool(FILA.executar, "lote", _processar_lote, centro, ficheiros, forcar)
+    if job.estado == ERRO:
+        raise HTTPException(500, job.erro)
+    return job.resultado
 
-    _append_custo(centro, dados, origem=file.filename or "foto")
 
-    return {
-        "ok": True,
-        "centro_custo_codigo": centro,
-        "ocr_texto": texto[:500] if texto else "(OCR não disponível)",
-        "dados_extraidos": dados,
-        "ficheiro_extraido": ficheiro_extraido,
-    }
+@app.get("/api/despesas/jobs/{job_id}")
+def estado_job_despesa(job_id: str):
+    """Estado, tempos por etapa e (quando concluído) resultado de um job de registo."""
+    job = FILA.obter(job_id)
+    if job is None:
+        raise HTTPException(404, "job não encontrado")
+    return job.to_dict()
 
 
-def _load_custos_registo() -> list[dict]:
-    """Carrega custos_registo.xlsx."""
-    if not XL_AVAILABLE or not CUSTOS_REGISTO.exists():
-        return []
-    wb = load_workbook(CUSTOS_REGISTO, data_only=True)
-    ws = wb.active
-    headers = [c.value for c in ws[1]]
-    return [
-        {h: ws.cell(r, i + 1).value for i, h in enumerate(headers) if h}
-        for r in range(2, ws.max_row + 1)
-    ]
+@app.get("/api/despesas/fila")
+def estatisticas_fila():
+    """Profundidade da fila, jobs em curso e tempos médios por etapa."""
+    return FILA.estatisticas()
+
+
+def _linhas_registo() -> list[dict]:
+    """Linhas de custos_registo (.xlsx + diário), em cache até algum dos dois mudar."""
+    return CACHE.obter(
+        CUSTOS_REGISTO, diario_custos.ler_linhas, tipo="registo",
+        dependencias=(diario_custos.caminho_diario(CUSTOS_REGISTO),),
+    )
+
+
+def _custos_colunar() -> CustosColunar:
+    """Store colunar de custos_registo (reconstruído só quando o ficheiro ou o diário mudam)."""
+    if not XL_AVAILABLE or not diario_custos.existe(CUSTOS_REGISTO):
+        return CustosColunar([])
+    return CACHE.obter(
+        CUSTOS_REGISTO, _carregar_custos_colunar, tipo="colunar",
+        dependencias=(diario_custos.caminho_diario(CUSTOS_REGISTO),),
+    )
+
+
+TEXTO_MATERIAIS = ("supplier", "description", "document_no")
+TEXTO_CUSTOS = TEXTO_MATERIAIS + ("centro_custo_codigo",)
+
+
+def _carregar_custos_colunar(path: Path) -> CustosColunar:
+    store = CustosColunar(_linhas_registo())
+    for cols in (TEXTO_MATERIAIS, TEXTO_CUSTOS):
+        store.indices_texto[cols] = indice_para(str(path), cols, store.linhas)
+    return store
 
 
 @app.get("/api/custos/obras")
 def listar_obras_com_custos():
-    """Lista obras (centros de custo) com totais de custos por tipo."""
-    rows = _load_custos_registo()
-    por_obra: dict[str, dict] = {}
-    tipos = ("subempreitadas", "materiais", "mao_obra", "equipamentos_maquinaria", "custos_sede")
-    for r in rows:
-        cc = str(r.get("centro_custo_codigo") or "").strip()
-        if not cc:
-            continue
-        if cc not in por_obra:
-            por_obra[cc] = {"centro_custo_codigo": cc, "total": 0, **{t: 0 for t in tipos}}
-        t = (r.get("tipo_linha") or "materiais").strip().lower()
-        if t == "subempreitada":
-            t = "subempreitadas"
-        if t not in tipos:
-            t = "materiais"
-        val = r.get("net_amount") or r.get("unit_price") or 0
+    """Lista obras (centros de custo) com totais de custos por tipo (agregado persistido)."""
+    if not XL_AVAILABLE or not diario_custos.existe(CUSTOS_REGISTO):
+        return []
+    obras = rollup_custos.carregar(CUSTOS_REGISTO)
+    if obras is None:
+        obras = rollup_custos.calcular(_linhas_registo())
         try:
-            val = float(val) if val is not None else 0
-        except (TypeError, ValueError):
-            val = 0
-        por_obra[cc][t] = por_obra[cc][t] + val
-        por_obra[cc]["total"] = por_obra[cc]["total"] + val
-    return list(por_obra.values())
+            rollup_custos.guardar(CUSTOS_REGISTO, obras)
+        except OSError:
+            pass
+    return rollup_custos.listar_obras(obras)
 
 
 @app.get("/api/custos/obras/{centro}")
 def custos_por_obra(centro: str, tipo: str | None = None, capitulo: str | None = None):
     """Lista custos de uma obra, opcionalmente filtrados por tipo e capítulo."""
-    rows = _load_custos_registo()
-    filtrado = [r for r in rows if str(r.get("centro_custo_codigo") or "").strip() == centro]
+    tipos = None
     if tipo:
         t = tipo.strip().lower()
         if t == "subempreitada":
             t = "subempreitadas"
-        filtrado = [r for r in filtrado if (r.get("tipo_linha") or "").strip().lower() in (t, "subempreitada" if t == "subempreitadas" else t)]
-    if capitulo:
-        filtrado = [r for r in filtrado if (r.get("capitulo_orcamento") or "").strip() == capitulo]
+        tipos = (t, "subempreitada" if t == "subempreitadas" else t)
+    consulta = _consultar_custos(tipos=tipos, centro=centro, capitulo=capitulo or None)
+    filtrado = [r for _, r in consulta.linhas()]
     return {"centro_custo_codigo": centro, "linhas": filtrado, "total_linhas": len(filtrado)}
 
 
+def _ler_capitulos(path: Path) -> list[dict]:
+    cabecalho, rows = ler_tabela(path)
+    col_id = next((h for h in cabecalho if "id" in str(h).lower()), None)
+    col_nome = next((h for h in cabecalho if "nome" in str(h).lower()), None)
+    if not col_id:
+        return []
+    out = []
+    for r in rows:
+        cid = r.get(col_id)
+        nome = r.get(col_nome) if col_nome else ""
+        if cid:
+            out.append({"id": str(cid), "nome": str(nome or cid)})
+    return out
+
+
 @app.get("/api/custos/capitulos")
 def listar_capitulos_orcamento():
     """Lista capítulos do orçamento para filtro/dropdown."""
     path = BASE_PATH / "00_CONFIG" / "capitulos_orcamento.xlsx"
     if not XL_AVAILABLE or not path.exists():
         return []
-    wb = load_workbook(path, data_only=True)
-    ws = wb.active
-    headers = [c.value for c in ws[1]]
-    idx_id = next((i for i, h in enumerate(headers, 1) if "id" in str(h).lower()), None)
-    idx_nome = next((i for i, h in enumerate(headers, 1) if "nome" in str(h).lower()), None)
-    if not idx_id:
-        return []
-    out = []
-    for r in range(2, ws.max_row + 1):
-        cid = ws.cell(r, idx_id).value
-        nome = ws.cell(r, idx_nome).value if idx_nome else ""
-        if cid:
-            out.append({"id": str(cid), "nome": str(nome or cid)})
-    return out
+    return list(CACHE.obter(path, _ler_capitulos, tipo="capitulos"))
 
 
 # --- Base de Dados endpoints ---
@@ -336,17 +602,29 @@ CONTAB_PATH = BASE_PATH / "03_CONTABILIDADE_ANALITICA"
 CLASSIFICACAO_PATH = CONTAB_PATH / "config" / "classificacao_fornecedores.csv"
 
 
-def _load_excel_as_dicts(path: Path) -> list[dict]:
+def _ler_excel_as_dicts(path: Path) -> list[dict]:
     """Carrega ficheiro Excel e devolve lista de dicionários (1ª linha = headers)."""
+    return ler_linhas(path)
+
+
+def _linhas_indexadas(path: Path, colunas: tuple) -> LinhasComIndice:
+    """Linhas em cache de path, com o índice de trigramas (re)construído no carregamento."""
+    def carregar(p: Path) -> LinhasComIndice:
+        linhas = _ler_excel_as_dicts(p)
+        return LinhasComIndice(linhas, indice_para(str(p), colunas, linhas))
+    return CACHE.obter(path, carregar, tipo="dicts:" + ",".join(colunas))
+
+
+def _pesquisa_indexada(path: Path, q, colunas: tuple) -> list[dict]:
+    """Equivalente a _apply_text_filter(_load_excel_as_dicts(path), q, colunas), via índice."""
     if not XL_AVAILABLE or not path.exists():
         return []
-    wb = load_workbook(path, data_only=True)
-    ws = wb.active
-    headers = [h for h in (c.value for c in ws[1]) if h]
-    return [
-        {h: ws.cell(r, i + 1).value for i, h in enumerate(headers) if i < len(headers)}
-        for r in range(2, ws.max_row + 1)
-    ]
+    dados = _linhas_indexadas(path, colunas)
+    linhas = dados.linhas
+    ql = (q.strip().lower()) if isinstance(q, str) and q.strip() else ""
+    if ql:
+        linhas = [linhas[i] for i in dados.indice.procurar(ql)]
+    return [dict(r) for r in linhas]
 
 
 def _load_classificacao_fornecedores() -> dict[str, str]:
@@ -388,39 +666,6 @@ def _opt_float(v):
         return None
 
 
-def _to_float(v) -> float:
-    if v is None:
-        return 0.0
-    try:
-        return float(str(v).replace(",", "."))
-    except (TypeError, ValueError):
-        return 0.0
-
-
-def _apply_value_filters(rows: list[dict], valor_min, valor_max, col: str = "net_amount") -> list[dict]:
-    """Filtra por valor_min e valor_max na coluna indicada."""
-    out = rows
-    vmin = _opt_float(valor_min)
-    vmax = _opt_float(valor_max)
-    if vmin is not None:
-        out = [r for r in out if _to_float(r.get(col)) >= vmin]
-    if vmax is not None:
-        out = [r for r in out if _to_float(r.get(col)) <= vmax]
-    return out
-
-
-def _apply_date_filters(rows: list[dict], data_inicio, data_fim, col: str = "date") -> list[dict]:
-    """Filtra por intervalo de datas (strings yyyy-mm-dd)."""
-    out = rows
-    di = _opt_str(data_inicio)
-    df = _opt_str(data_fim)
-    if di:
-        out = [r for r in out if str(r.get(col) or "") >= di]
-    if df:
-        out = [r for r in out if str(r.get(col) or "") <= df]
-    return out
-
-
 @app.get("/api/base-dados/entidades")
 def listar_entidades():
     """Lista metadata das entidades disponíveis na base de dados."""
@@ -446,65 +691,183 @@ def base_dados_centros_custo(q: str | None = Query(None, description="Pesquisa t
 
 @app.get("/api/base-dados/fornecedores")
 def base_dados_fornecedores(q: str | None = Query(None, description="Pesquisa textual")):
-    path = EMPRESA_PATH / "fornecedores.xlsx"
-    rows = _load_excel_as_dicts(path)
-    rows = _apply_text_filter(rows, q, ["business_name", "id", "internal_observations"])
+    rows = _pesquisa_indexada(EMPRESA_PATH / "fornecedores.xlsx", q, ("business_name", "id", "internal_observations"))
     return {"dados": rows, "total": len(rows)}
 
 
 @app.get("/api/base-dados/clientes")
 def base_dados_clientes(q: str | None = Query(None, description="Pesquisa textual")):
-    path = EMPRESA_PATH / "clientes.xlsx"
-    rows = _load_excel_as_dicts(path)
-    rows = _apply_text_filter(rows, q, ["business_name", "id", "contact_name"])
+    rows = _pesquisa_indexada(EMPRESA_PATH / "clientes.xlsx", q, ("business_name", "id", "contact_name"))
     return {"dados": rows, "total": len(rows)}
 
 
+TIPOS_MATERIAIS = ("materiais", "material")
+TIPOS_SUBEMPREITEIROS = ("subempreitadas", "subempreitada", "subempreiteiros")
+
+
+def _consulta_sqlite(filtros: dict):
+    """Consulta no espelho SQLite (sincronizado com o registo); None se não estiver disponível."""
+    if MOTOR_CUSTOS != "sqlite" or not XL_AVAILABLE:
+        return None
+    try:
+        if not custos_sqlite.sincronizar(CUSTOS_DB, "custos_registo", CUSTOS_REGISTO):
+            return None
+        return custos_sqlite.ConsultaSQL(CUSTOS_DB, "custos_registo", **filtros)
+    except (sqlite3.Error, OSError):
+        # Sem escrita na pasta de dados ou base corrompida: usa o store em memória
+        return None
+
+
+def _consultar_custos(q=None, text_cols: tuple = TEXTO_MATERIAIS, **filtros):
+    """
+    Aplica os filtros de custos (tipos, centro, capitulo, datas, valores, q).
+    Devolve uma consulta com totais() e linhas(apos, limite), por ordem do registo.
+    """
+    ql = (q.strip().lower()) if isinstance(q, str) and q.strip() else ""
+    consulta = _consulta_sqlite({**filtros, "q": ql or None, "text_cols": text_cols})
+    if consulta is not None:
+        return consulta
+    store = _custos_colunar()
+    mask = store.mascara(**filtros)
+    if ql:
+        indice = store.indices_texto.get(tuple(text_cols))
+        if indice is None:
+            indice = store.indices_texto.setdefault(
+                tuple(text_cols), indice_para(str(CUSTOS_REGISTO), text_cols, store.linhas)
+            )
+        ids = indice.procurar(ql)
+        sel = np.zeros(len(store), dtype=bool)
+        sel[ids] = True
+        mask &= sel
+    return ConsultaColunar(store, store.indices(mask))
+
+
+def _filtrar_custos(
+    q=None,
+    tipos=None,
+    centro=None,
+    data_inicio=None,
+    data_fim=None,
+    valor_min=None,
+    valor_max=None,
+    text_cols: tuple = TEXTO_MATERIAIS,
+):
+    """Filtros das listagens de base-dados (parâmetros de query normalizados)."""
+    return _consultar_custos(
+        q=q,
+        text_cols=text_cols,
+        tipos=tipos,
+        centro=_opt_str(centro),
+        data_inicio=_opt_str(data_inicio),
+        data_fim=_opt_str(data_fim),
+        valor_min=_opt_float(valor_min),
+        valor_max=_opt_float(valor_max),
+    )
+
+
+NDJSON = "application/x-ndjson"
+
+
+def _encode_cursor(pos: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"i": pos}).encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor) -> int | None:
+    """Posição (linha do registo) após a qual continuar; None se não houver cursor."""
+    c = _opt_str(cursor)
+    if not c:
+        return None
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(c + "=" * (-len(c) % 4)))["i"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(400, "cursor inválido")
+
+
+def _resposta_custos(
+    request: Request,
+    consulta,
+    limit: int | None,
+    cursor: str | None,
+    fallback_unit_price: bool = False,
+    anotar=None,
+):
+    """
+    Resposta das listagens de custos, ordenadas pela posição no registo.
+    total e soma_net_amount referem-se a todos os resultados (não só à página).
+    Com limit/cursor devolve next_cursor; com Accept: application/x-ndjson envia
+    uma linha JSON por registo e termina com uma linha {"resumo": {...}}.
+    """
+    total, soma = consulta.totais(fallback_unit_price=fallback_unit_price)
+    inicio = _decode_cursor(cursor)
+    next_cursor = None
+    if limit is not None:
+        pagina = list(consulta.linhas(inicio, limit + 1))
+        if len(pagina) > limit:
+            pagina = pagina[:limit]
+            next_cursor = _encode_cursor(pagina[-1][0])
+        linhas = pagina
+    else:
+        linhas = consulta.linhas(inicio)
+    resumo = {"total": total, "soma_net_amount": soma}
+    if limit is not None or inicio is not None:
+        resumo["next_cursor"] = next_cursor
+
+    if NDJSON in request.headers.get("accept", ""):
+        def _linhas():
+            for _, r in linhas:
+                if anotar:
+                    anotar(r)
+                yield json.dumps(jsonable_encoder(r), ensure_ascii=False) + "\n"
+            yield json.dumps({"resumo": resumo}, ensure_ascii=False) + "\n"
+        return StreamingResponse(_linhas(), media_type=NDJSON)
+
+    rows = [r for _, r in linhas]
+    if anotar:
+        for r in rows:
+            anotar(r)
+    return {"dados": rows, **resumo}
+
+
 @app.get("/api/base-dados/materiais")
 def base_dados_materiais(
+    request: Request,
     q: str | None = Query(None),
     centro: str | None = Query(None),
     data_inicio: str | None = Query(None),
     data_fim: str | None = Query(None),
     valor_min: float | None = Query(None),
     valor_max: float | None = Query(None),
+    limit: int | None = Query(None, ge=1),
+    cursor: str | None = Query(None),
 ):
-    rows = _load_custos_registo()
-    rows = [r for r in rows if (str(r.get("tipo_linha") or "").strip().lower() in ("materiais", "material"))]
-    centro_s = _opt_str(centro)
-    if centro_s:
-        rows = [r for r in rows if str(r.get("centro_custo_codigo") or "").strip() == centro_s]
-    rows = _apply_date_filters(rows, data_inicio, data_fim)
-    rows = _apply_value_filters(rows, valor_min, valor_max)
-    rows = _apply_text_filter(rows, q, ["supplier", "description", "document_no"])
-    return {"dados": rows, "total": len(rows), "soma_net_amount": sum(_to_float(r.get("net_amount")) for r in rows)}
+    consulta = _filtrar_custos(q, TIPOS_MATERIAIS, centro, data_inicio, data_fim, valor_min, valor_max)
+    return _resposta_custos(request, consulta, limit, cursor)
 
 
 @app.get("/api/base-dados/subempreiteiros")
 def base_dados_subempreiteiros(
+    request: Request,
     q: str | None = Query(None),
     centro: str | None = Query(None),
     data_inicio: str | None = Query(None),
     data_fim: str | None = Query(None),
     valor_min: float | None = Query(None),
     valor_max: float | None = Query(None),
+    limit: int | None = Query(None, ge=1),
+    cursor: str | None = Query(None),
 ):
-    rows = _load_custos_registo()
-    rows = [r for r in rows if (str(r.get("tipo_linha") or "").strip().lower() in ("subempreitadas", "subempreitada", "subempreiteiros"))]
+    consulta = _filtrar_custos(q, TIPOS_SUBEMPREITEIROS, centro, data_inicio, data_fim, valor_min, valor_max)
     clf = _load_classificacao_fornecedores()
-    for r in rows:
+
+    def _classificar(r: dict) -> None:
         r["tipo_classificado"] = clf.get(str(r.get("supplier") or ""), "")
-    centro_s = _opt_str(centro)
-    if centro_s:
-        rows = [r for r in rows if str(r.get("centro_custo_codigo") or "").strip() == centro_s]
-    rows = _apply_date_filters(rows, data_inicio, data_fim)
-    rows = _apply_value_filters(rows, valor_min, valor_max)
-    rows = _apply_text_filter(rows, q, ["supplier", "description", "document_no"])
-    return {"dados": rows, "total": len(rows), "soma_net_amount": sum(_to_float(r.get("net_amount")) for r in rows)}
+
+    return _resposta_custos(request, consulta, limit, cursor, anotar=_classificar)
 
 
 @app.get("/api/base-dados/custos")
 def base_dados_custos(
+    request: Request,
     q: str | None = Query(None),
     tipo: str | None = Query(None),
     centro: str | None = Query(None),
@@ -512,29 +875,26 @@ def base_dados_custos(
     data_fim: str | None = Query(None),
     valor_min: float | None = Query(None),
     valor_max: float | None = Query(None),
+    limit: int | None = Query(None, ge=1),
+    cursor: str | None = Query(None),
 ):
-    rows = _load_custos_registo()
+    tipos = None
     tipo_s = _opt_str(tipo)
     if tipo_s:
         t = tipo_s.lower()
         if t == "subempreitada":
             t = "subempreitadas"
-        rows = [r for r in rows if (str(r.get("tipo_linha") or "").strip().lower() == t)]
-    centro_s = _opt_str(centro)
-    if centro_s:
-        rows = [r for r in rows if str(r.get("centro_custo_codigo") or "").strip() == centro_s]
-    rows = _apply_date_filters(rows, data_inicio, data_fim)
-    rows = _apply_value_filters(rows, valor_min, valor_max)
-    rows = _apply_text_filter(rows, q, ["supplier", "description", "document_no", "centro_custo_codigo"])
-    soma = sum(_to_float(r.get("net_amount")) or _to_float(r.get("unit_price")) for r in rows)
-    return {"dados": rows, "total": len(rows), "soma_net_amount": soma}
+        tipos = (t,)
+    consulta = _filtrar_custos(
+        q, tipos, centro, data_inicio, data_fim, valor_min, valor_max,
+        text_cols=TEXTO_CUSTOS,
+    )
+    return _resposta_custos(request, consulta, limit, cursor, fallback_unit_price=True)
 
 
 @app.get("/api/base-dados/trabalhadores")
 def base_dados_trabalhadores(q: str | None = Query(None)):
-    path = DADOS_PATH / "trabalhadores.xlsx"
-    rows = _load_excel_as_dicts(path)
-    rows = _apply_text_filter(rows, q, ["codigo", "nome", "origem"])
+    rows = _pesquisa_indexada(DADOS_PATH / "trabalhadores.xlsx", q, ("codigo", "nome", "origem"))
     return {"dados": rows, "total": len(rows)}
 
 
@@ -546,6 +906,12 @@ def base_dados_capitulos(q: str | None = Query(None)):
     return {"dados": data, "total": len(data)}
 
 
+@app.get("/api/sistema/cache")
+def estatisticas_cache():
+    """Contadores do cache de ficheiros Excel (hits, misses, memória)."""
+    return CACHE.estatisticas()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
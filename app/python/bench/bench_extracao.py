@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Benchmark de extração de faturas: velocidade e exatidão de extrair_factura,
+extrair_dados_despesa (o _extrair_dados_ocr da API e dos emails) e do texto de PDFs/fotos,
+sobre um corpus anonimizado com o resultado esperado de cada documento.
+
+Corpus (por omissão bench/corpus_facturas/): <nome>.txt (texto já extraído), <nome>.pdf
+ou <nome>.jpg/.png, cada um com <nome>.json esperado no formato de FacturaExtraida.to_dict().
+Só os campos presentes no .json contam ("" ou null = o campo deve vir vazio); "linhas" compara
+os produtos por código + valor líquido; "dados" (opcional) compara extrair_dados_despesa.
+PDFs e fotos sem PyMuPDF/pytesseract (ou sem o binário do tesseract) ficam de fora
+(listados em "ignorados").
+
+Os PDFs digitais e a digitalização do corpus são sintéticos (dados fictícios), gerados a partir
+do .json esperado e das designações do .txt com --sintetico: <nome>_digital.pdf (texto embutido,
+tabela em colunas, 25 produtos por página) e <nome>_digitalizada.png (1.ª página em imagem).
+
+Etapas medidas por documento: pdf_texto, tabela_pdf (produtos pelas coordenadas,
+utils/tabela_pdf), ocr, parse (extrair_factura), dados
+(extrair_dados_despesa). parse e dados repetem --repeticoes vezes (mediana); PDF e OCR uma vez.
+O resultado vai para bench/resultados/extracao_<data>.json (ou --json) e, com --comparar,
+é comparado com uma corrida anterior.
+
+Uso:
+  python3 app/python/bench/bench_extracao.py
+  python3 app/python/bench/bench_extracao.py <pasta_corpus> --repeticoes 20
+  python3 app/python/bench/bench_extracao.py --comparar bench/resultados/extracao_20260301_101500.json
+  python3 app/python/bench/bench_extracao.py --sintetico   # (re)gera os PDFs e PNG do corpus
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from custos.extrair_factura import extrair_dados_despesa, extrair_factura
+from utils import ocr, tabela_pdf
+
+BENCH_DIR = Path(__file__).resolve().parent
+CORPUS_DEFAULT = BENCH_DIR / "corpus_facturas"
+RESULTADOS_DIR = BENCH_DIR / "resultados"
+EXT_TEXTO = (".txt",)
+EXT_PDF = (".pdf",)
+EXT_FOTO = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+ETAPAS = ("pdf_texto", "tabela_pdf", "ocr", "parse", "dados")
+# Campos escalares comparados (secção, campo) de FacturaExtraida.to_dict()
+CAMPOS = (
+    ("fornecedor", "nome"), ("fornecedor", "nif"),
+    ("cliente", "nome"), ("cliente", "nif"),
+    ("documento", "numero"), ("documento", "data"),
+    ("totais", "valor_liquido"), ("totais", "total_iva"), ("totais", "total_documento"),
+)
+CAMPOS_DADOS = ("supplier", "date", "net_amount", "tax_pct")
+# Documentos do corpus convertidos em PDF digital (e o 1.º também em imagem digitalizada)
+SINTETICOS = ("fatura_horizontal", "fatura_multipagina")
+PRODUTOS_POR_PAGINA = 25
+
+
+def _vazio(v) -> bool:
+    return v is None or (isinstance(v, str) and not v.strip())
+
+
+def _igual(esperado, obtido) -> bool:
+    if isinstance(esperado, (int, float)) and not isinstance(esperado, bool):
+        try:
+            return abs(float(obtido) - float(esperado)) < 0.01
+        except (TypeError, ValueError):
+            return False
+    return " ".join(str(obtido or "").upper().split()) == " ".join(str(esperado).upper().split())
+
+
+def _contar(esperado, obtido) -> tuple[int, int, int]:
+    """(verdadeiros positivos, falsos positivos, falsos negativos) de um campo."""
+    if _vazio(esperado):
+        return 0, 0 if _vazio(obtido) else 1, 0
+    if _vazio(obtido):
+        return 0, 0, 1
+    if _igual(esperado, obtido):
+        return 1, 0, 0
+    return 0, 1, 1
+
+
+def _chave_linha(ln: dict) -> tuple:
+    v = ln.get("valor_liquido")
+    return str(ln.get("codigo") or "").strip(), round(float(v), 2) if v is not None else None
+
+
+def _contar_linhas(esperadas: list, obtidas: list) -> tuple[int, int, int]:
+    esp = Counter(_chave_linha(ln) for ln in esperadas)
+    obt = Counter(_chave_linha(ln) for ln in obtidas)
+    tp = sum((esp & obt).values())
+    return tp, sum(obt.values()) - tp, sum(esp.values()) - tp
+
+
+def comparar(esperado: dict, factura: dict, dados: dict) -> dict:
+    """{campo: (tp, fp, fn)} dos campos presentes no esperado."""
+    out = {}
+    for seccao, campo in CAMPOS:
+        if campo in (esperado.get(seccao) or {}):
+            out[f"{seccao}.{campo}"] = _contar(esperado[seccao][campo], (factura.get(seccao) or {}).get(campo))
+    if "linhas" in esperado:
+        out["linhas"] = _contar_linhas(esperado["linhas"] or [], factura.get("linhas") or [])
+    for campo in CAMPOS_DADOS:
+        if campo in (esperado.get("dados") or {}):
+            out[f"dados.{campo}"] = _contar(esperado["dados"][campo], dados.get(campo))
+    return out
+
+
+def _cronometrar(funcao, *args, repeticoes: int = 1):
+    """(resultado, mediana dos tempos em segundos)."""
+    tempos = []
+    for _ in range(max(1, repeticoes)):
+        t0 = time.perf_counter()
+        r = funcao(*args)
+        tempos.append(time.perf_counter() - t0)
+    return r, statistics.median(tempos)
+
+
+def _percentil(valores: list[float], p: float) -> float:
+    ordenados = sorted(valores)
+    if not ordenados:
+        return 0.0
+    k = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[k]
+
+
+def _ratio(a: int, b: int):
+    return round(a / b, 4) if b else None
+
+
+def documentos(corpus: Path) -> list[tuple[Path, Path]]:
+    """(documento, .json esperado) do corpus, por nome."""
+    out = []
+    for path in sorted(corpus.iterdir()):
+        if path.suffix.lower() in EXT_TEXTO + EXT_PDF + EXT_FOTO:
+            esperado = path.with_suffix(".json")
+            if esperado.exists():
+                out.append((path, esperado))
+    return out
+
+
+def _designacoes(texto: str, codigos: list[str]) -> dict[str, str]:
+    """Designação de cada código no texto do corpus (na mesma linha ou na seguinte)."""
+    linhas = [ln.strip() for ln in texto.splitlines()]
+    out = {}
+    for i, ln in enumerate(linhas):
+        partes = ln.split(" ", 1)
+        if partes[0] in codigos and partes[0] not in out:
+            resto = partes[1] if len(partes) > 1 else (linhas[i + 1] if i + 1 < len(linhas) else "")
+            out[partes[0]] = resto.split(" UN ")[0].removesuffix(" UN").strip()
+    return out
+
+
+def _euros(v: float) -> str:
+    return f"{v:.2f}".replace(".", ",")
+
+
+def gerar_sinteticos(corpus: Path = CORPUS_DEFAULT) -> None:
+    """PDF digital (e PNG digitalizado do primeiro) de cada documento de SINTETICOS, com o .json esperado."""
+    import fitz
+
+    for i, nome in enumerate(SINTETICOS):
+        esperado = json.loads((corpus / f"{nome}.json").read_text(encoding="utf-8"))
+        produtos = esperado["linhas"]
+        designacoes = _designacoes(
+            (corpus / f"{nome}.txt").read_text(encoding="utf-8"), [ln["codigo"] for ln in produtos]
+        )
+        forn, cli, doc, tot = esperado["fornecedor"], esperado["cliente"], esperado["documento"], esperado["totais"]
+        data = "-".join(reversed(doc["data"].split("-")))
+        paginas = [produtos[k:k + PRODUTOS_POR_PAGINA] for k in range(0, len(produtos), PRODUTOS_POR_PAGINA)]
+        pdf = fitz.open()
+        for n, bloco in enumerate(paginas, 1):
+            pag = pdf.new_page(width=595, height=842)
+            y = 60
+            for texto in (
+                forn["nome"], f"Nº Contribuinte: {forn['nif']}", f"Cliente: {cli.get('nome') or ''}",
+                f"IVA-PT-{cli['nif']}", f"Fatura Nº {doc['numero']} {data}", f"Página {n}/{len(paginas)}",
+            ):
+                pag.insert_text((40, y), texto, fontsize=10)
+                y += 16
+            y += 14
+            colunas = ((40, "Código"), (120, "Designação"), (340, "Qtd."), (390, "Preço"), (450, "IVA"), (500, "Valor"))
+            for x, titulo in colunas:
+                pag.insert_text((x, y), titulo, fontsize=9)
+            y += 18
+            for ln in bloco:
+                valores = (
+                    ln["codigo"], designacoes.get(ln["codigo"], "ARTIGO"), f"{ln['quantidade']:g}",
+                    _euros(ln["preco_unitario"]), "23%", _euros(ln["valor_liquido"]),
+                )
+                for (x, _), texto in zip(colunas, valores):
+                    pag.insert_text((x, y), texto, fontsize=9)
+                y += 20
+            if n == len(paginas):
+                y += 14
+                for rotulo, v in (("Total Líquido", tot["valor_liquido"]), ("Total IVA", tot["total_iva"]),
+                                  ("Total Documento", tot["total_documento"])):
+                    pag.insert_text((340, y), f"{rotulo} {_euros(v)} EUR", fontsize=10)
+                    y += 16
+        # Gerado sempre igual (sem datas nem ids aleatórios) para não mudar no git a cada corrida
+        pdf.set_metadata({})
+        pdf.save(corpus / f"{nome}_digital.pdf", garbage=4, deflate=True, no_new_id=True)
+        (corpus / f"{nome}_digital.json").write_text(
+            json.dumps(esperado, ensure_ascii=False, indent=2) + "\n", encoding="utf-8"
+        )
+        if i == 0:
+            pdf[0].get_pixmap(dpi=150, colorspace=fitz.csGRAY).save(corpus / f"{nome}_digitalizada.png")
+            (corpus / f"{nome}_digitalizada.json").write_text(
+                json.dumps(esperado, ensure_ascii=False, indent=2) + "\n", encoding="utf-8"
+            )
+        pdf.close()
+        print(f"✅ {nome}: {len(paginas)} página(s) em {nome}_digital.pdf")
+
+
+def _tesseract_instalado() -> bool:
+    try:
+        ocr.pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def correr(corpus: Path, repeticoes: int = 5) -> dict:
+    motor = ocr.MotorOCR(workers=0)
+    tempos: dict[str, list[float]] = {e: [] for e in ETAPAS}
+    totais_doc: list[float] = []
+    contagem: dict[str, list[int]] = {}
+    por_documento = []
+    ignorados = []
+    for path, esperado_path in documentos(corpus):
+        ext = path.suffix.lower()
+        t_doc = {}
+        linhas = None
+        if ext in EXT_PDF:
+            if not ocr.PDF_AVAILABLE:
+                ignorados.append({"documento": path.name, "motivo": "PyMuPDF não instalado"})
+                continue
+            texto, t_doc["pdf_texto"] = _cronometrar(motor.texto_pdf, path)
+            linhas, t_doc["tabela_pdf"] = _cronometrar(tabela_pdf.linhas_pdf, path)
+        elif ext in EXT_FOTO:
+            if not ocr.OCR_AVAILABLE:
+                ignorados.append({"documento": path.name, "motivo": "pytesseract/Pillow não instalados"})
+                continue
+            if not _tesseract_instalado():
+                ignorados.append({"documento": path.name, "motivo": "binário do tesseract não instalado"})
+                continue
+            texto, t_doc["ocr"] = _cronometrar(motor.ocr_imagem, path)
+        else:
+            texto = path.read_text(encoding="utf-8")
+        factura, t_doc["parse"] = _cronometrar(extrair_factura, texto, "", linhas, repeticoes=repeticoes)
+        dados, t_doc["dados"] = _cronometrar(extrair_dados_despesa, texto, repeticoes=repeticoes)
+        for etapa, t in t_doc.items():
+            tempos[etapa].append(t)
+        totais_doc.append(sum(t_doc.values()))
+
+        esperado = json.loads(esperado_path.read_text(encoding="utf-8"))
+        campos = comparar(esperado, factura.to_dict(), dados)
+        for campo, c in campos.items():
+            acc = contagem.setdefault(campo, [0, 0, 0])
+            for k in range(3):
+                acc[k] += c[k]
+        por_documento.append({
+            "documento": path.name,
+            "linhas_texto": texto.count("\n") + 1,
+            "tempos_ms": {e: round(t * 1000, 3) for e, t in t_doc.items()},
+            "falhas": sorted(c for c, (tp, fp, fn) in campos.items() if fp or fn),
+        })
+
+    campos_out = {}
+    soma = [0, 0, 0]
+    for campo, (tp, fp, fn) in sorted(contagem.items()):
+        campos_out[campo] = {"tp": tp, "fp": fp, "fn": fn,
+                             "precisao": _ratio(tp, tp + fp), "recall": _ratio(tp, tp + fn)}
+        soma = [soma[0] + tp, soma[1] + fp, soma[2] + fn]
+    return {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "corpus": str(corpus),
+        "repeticoes": repeticoes,
+        "documentos": len(por_documento),
+        "ignorados": ignorados,
+        "docs_por_segundo": round(len(totais_doc) / sum(totais_doc), 2) if sum(totais_doc) else None,
+        "etapas": {
+            e: {"n": len(v), "p50_ms": round(_percentil(v, 50) * 1000, 3),
+                "p95_ms": round(_percentil(v, 95) * 1000, 3), "total_ms": round(sum(v) * 1000, 3)}
+            for e, v in tempos.items() if v
+        },
+        "campos": campos_out,
+        "global": {"tp": soma[0], "fp": soma[1], "fn": soma[2],
+                   "precisao": _ratio(soma[0], soma[0] + soma[1]), "recall": _ratio(soma[0], soma[0] + soma[2])},
+        "por_documento": por_documento,
+    }
+
+
+def _fmt(v, pct: bool = False) -> str:
+    if v is None:
+        return "-"
+    return f"{100 * v:.1f}%" if pct else f"{v:g}"
+
+
+def _delta(novo, antigo, pct: bool = False) -> str:
+    if novo is None or antigo is None:
+        return ""
+    d = novo - antigo
+    if abs(d) < 1e-9:
+        return ""
+    return f" ({'+' if d > 0 else ''}{100 * d:.1f} pp)" if pct else f" ({'+' if d > 0 else ''}{d:.3g})"
+
+
+def imprimir(r: dict, anterior: Optional[dict] = None) -> None:
+    ant = anterior or {}
+    print(f"{r['documentos']} documento(s), {len(r['ignorados'])} ignorado(s), repetições parse/dados: {r['repeticoes']}")
+    for ig in r["ignorados"]:
+        print(f"   ⚠️ {ig['documento']}: {ig['motivo']}")
+    print(f"docs/s: {_fmt(r['docs_por_segundo'])}{_delta(r['docs_por_segundo'], ant.get('docs_por_segundo'))}")
+    for etapa, e in r["etapas"].items():
+        a = ant.get("etapas", {}).get(etapa, {})
+        print(f"  {etapa:>10}: p50 {e['p50_ms']:.3f} ms{_delta(e['p50_ms'], a.get('p50_ms'))}, "
+              f"p95 {e['p95_ms']:.3f} ms{_delta(e['p95_ms'], a.get('p95_ms'))} ({e['n']} doc)")
+    print(f"{'campo':>26} {'precisão':>16} {'recall':>16}  tp/fp/fn")
+    for campo, c in list(r["campos"].items()) + [("(global)", r["global"])]:
+        a = ant.get("campos", {}).get(campo) or (ant.get("global") if campo == "(global)" else None) or {}
+        prec = _fmt(c["precisao"], True) + _delta(c["precisao"], a.get("precisao"), True)
+        rec = _fmt(c["recall"], True) + _delta(c["recall"], a.get("recall"), True)
+        print(f"{campo:>26} {prec:>16} {rec:>16}  {c['tp']}/{c['fp']}/{c['fn']}")
+    for d in r["por_documento"]:
+        if d["falhas"]:
+            print(f"   {d['documento']}: {', '.join(d['falhas'])}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Benchmark de extração de faturas")
+    ap.add_argument("corpus", nargs="?", default=str(CORPUS_DEFAULT))
+    ap.add_argument("--repeticoes", type=int, default=5)
+    ap.add_argument("--json", help="ficheiro de resultados (por omissão bench/resultados/extracao_<data>.json)")
+    ap.add_argument("--comparar", help="resultados de uma corrida anterior")
+    ap.add_argument("--sintetico", action="store_true", help="(re)gera os PDFs e a imagem sintéticos do corpus")
+    args = ap.parse_args()
+
+    if args.sintetico:
+        gerar_sinteticos(Path(args.corpus))
+        return
+
+    corpus = Path(args.corpus)
+    if not corpus.is_dir() or not documentos(corpus):
+        print(f"❌ Sem documentos com .json esperado em {corpus}")
+        sys.exit(1)
+    r = correr(corpus, args.repeticoes)
+    anterior = json.loads(Path(args.comparar).read_text(encoding="utf-8")) if args.comparar else None
+    imprimir(r, anterior)
+
+    saida = Path(args.json) if args.json else RESULTADOS_DIR / f"extracao_{datetime.now():%Y%m%d_%H%M%S}.json"
+    saida.parent.mkdir(parents=True, exist_ok=True)
+    saida.write_text(json.dumps(r, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✅ Resultados em {saida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark: leitor partilhado (read_only + iter_rows) vs. loader antigo (load_workbook + ws.cell),
+e leitura a partir do snapshot binário (.snapshots/*.pkl) depois de gerado.
+Gera workbooks sintéticos com o formato de custos_registo e mede o tempo de leitura de cada um.
+
+Uso:
+  python3 app/python/bench/bench_leitor_excel.py              # 10k, 100k, 500k linhas
+  python3 app/python/bench/bench_leitor_excel.py 10000 50000  # tamanhos à escolha
+  python3 app/python/bench/bench_leitor_excel.py --sem-antigo 500000
+"""
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from openpyxl import Workbook, load_workbook
+from utils.leitor_excel import ler_linhas
+
+COLUNAS = [
+    "line_id", "document_no", "date", "supplier", "description", "quantity",
+    "unit_price", "net_amount", "tax_pct", "tipo_linha", "centro_custo_codigo",
+    "capitulo_orcamento", "origem",
+]
+TAMANHOS_DEFAULT = (10_000, 100_000, 500_000)
+
+
+def _gerar(path: Path, n: int) -> None:
+    rnd = random.Random(n)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("custos_registo")
+    ws.append(COLUNAS)
+    for i in range(n):
+        v = round(rnd.uniform(1, 5000), 2)
+        ws.append([
+            str(i + 2), f"FC 2025/{i}", f"2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+            f"FORNECEDOR {rnd.randint(1, 300)} LDA", f"Material diverso {i}", 1, v, v, 23,
+            rnd.choice(("materiais", "subempreitadas", "mao_obra")),
+            rnd.choice(("25.113", "24.54", "99.990")), None, "compras",
+        ])
+    wb.save(path)
+
+
+def _loader_antigo(path: Path) -> list[dict]:
+    """Cópia do padrão anterior (_load_sheet / _load_custos_registo)."""
+    wb = load_workbook(path, data_only=True)
+    ws = wb.active
+    headers = [c.value for c in ws[1]]
+    return [
+        {h: ws.cell(r, i + 1).value for i, h in enumerate(headers) if h}
+        for r in range(2, ws.max_row + 1)
+    ]
+
+
+def _medir(fn, *args, **kwargs) -> tuple[float, int]:
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return time.perf_counter() - t0, len(out)
+
+
+def main() -> None:
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    sem_antigo = "--sem-antigo" in sys.argv
+    tamanhos = [int(a) for a in args] or list(TAMANHOS_DEFAULT)
+    print(f"{'linhas':>8} | {'antigo (s)':>10} | {'leitor (s)':>10} | {'projeção 3 col (s)':>18}"
+          f" | {'gera snapshot (s)':>17} | {'snapshot (s)':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in tamanhos:
+            path = Path(tmp) / f"registo_{n}.xlsx"
+            _gerar(path, n)
+            t_novo, n_novo = _medir(ler_linhas, path)
+            t_proj, _ = _medir(ler_linhas, path, colunas=["date", "net_amount", "centro_custo_codigo"])
+            # Mesmo ficheiro com nome de workbook gerido: 1ª leitura gera o snapshot, 2ª usa-o
+            gerido = Path(tmp) / str(n) / "custos_registo.xlsx"
+            gerido.parent.mkdir()
+            shutil.copy2(path, gerido)
+            t_gera, _ = _medir(ler_linhas, gerido)
+            t_snap, n_snap = _medir(ler_linhas, gerido)
+            t_antigo = None
+            if not sem_antigo:
+                t_antigo, n_antigo = _medir(_loader_antigo, path)
+                assert n_antigo == n
+            assert n_novo == n_snap == n
+            antigo = f"{t_antigo:>10.2f}" if t_antigo is not None else f"{'-':>10}"
+            print(f"{n:>8} | {antigo} | {t_novo:>10.2f} | {t_proj:>18.2f} | {t_gera:>17.2f} | {t_snap:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
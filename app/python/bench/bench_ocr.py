@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Benchmark do OCR de fotos de faturas: sem vs com pré-processamento (utils/ocr.preparar_imagem).
+Para cada imagem da pasta mede o tempo do OCR (uma de cada vez, sem pool) e, se houver
+gabarito, compara os campos extraídos por extrair_factura com os esperados.
+Mede também só a preparação da imagem (descodificação + pré-processamento, sem tesseract),
+que é o que corre mesmo sem o binário do tesseract instalado.
+
+Uso:
+  python3 app/python/bench/bench_ocr.py <pasta_fotos> [gabarito.json]
+  python3 app/python/bench/bench_ocr.py --sintetico <pasta> [n]   # gera n fotos de teste (e gabarito)
+
+gabarito.json (por nome de ficheiro; campos em falta não contam):
+  {"recibo1.jpg": {"nif": "500000000", "numero": "FT A/123", "data": "2025-01-31", "total": 12.30}}
+Sem gabarito usa <pasta_fotos>/gabarito.json se existir.
+As fotos sintéticas são o texto de bench/corpus_facturas desenhado numa folha sobre fundo
+escuro, rodada, com sombra e ruído, em JPEG de 12 MP como as de telemóvel.
+"""
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from custos.extrair_factura import extrair_factura
+from utils import ocr
+
+EXT_FOTO = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+
+def _campos(texto: str) -> dict:
+    f = extrair_factura(texto)
+    return {
+        "nif": f.fornecedor.nif,
+        "numero": f.documento.numero,
+        "data": f.documento.data,
+        "total": f.totais.total_documento,
+    }
+
+
+def _igual(esperado, obtido) -> bool:
+    if isinstance(esperado, (int, float)):
+        return obtido is not None and abs(float(obtido) - float(esperado)) < 0.01
+    return str(obtido or "").strip().upper() == str(esperado).strip().upper()
+
+
+CORPUS = Path(__file__).resolve().parent / "corpus_facturas"
+
+
+def gerar_sinteticas(pasta: Path, n: int = 5) -> None:
+    """Fotos de teste (JPEG 4000x3000) a partir dos textos do corpus, com gabarito.json."""
+    from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+    pasta.mkdir(parents=True, exist_ok=True)
+    textos = sorted(CORPUS.glob("*.txt"))
+    gabarito = {}
+    try:
+        fonte = ImageFont.load_default(size=42)
+    except TypeError:
+        fonte = ImageFont.load_default()
+    for i in range(n):
+        txt = textos[i % len(textos)]
+        rnd = random.Random(i)
+        folha = Image.new("L", (2100, 2970), 245)
+        d = ImageDraw.Draw(folha)
+        y = 80
+        for linha in txt.read_text(encoding="utf-8").splitlines()[:55]:
+            d.text((100, y), linha, fill=20, font=fonte)
+            y += 52
+        folha = folha.rotate(rnd.uniform(-4, 4), expand=True, fillcolor=60, resample=Image.BICUBIC)
+        foto = Image.new("L", (4000, 3000), 60)
+        folha.thumbnail((2800, 2900))
+        foto.paste(folha, ((4000 - folha.width) // 2, (3000 - folha.height) // 2))
+        sombra = Image.linear_gradient("L").resize(foto.size).point(lambda v: 255 - v // 4)
+        foto = Image.composite(foto, Image.new("L", foto.size, 0), sombra).filter(ImageFilter.GaussianBlur(1.2))
+        ruido = Image.effect_noise(foto.size, 12)
+        foto = Image.blend(foto, ruido, 0.08).convert("RGB")
+        nome = f"sintetica_{i:02d}_{txt.stem}.jpg"
+        foto.save(pasta / nome, quality=88)
+        esperado = json.loads(txt.with_suffix(".json").read_text(encoding="utf-8"))
+        gabarito[nome] = {
+            k: v for k, v in {
+                "nif": (esperado.get("fornecedor") or {}).get("nif"),
+                "numero": (esperado.get("documento") or {}).get("numero"),
+                "data": (esperado.get("documento") or {}).get("data"),
+                "total": (esperado.get("totais") or {}).get("total_documento"),
+            }.items() if v
+        }
+    (pasta / "gabarito.json").write_text(json.dumps(gabarito, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"✅ {n} foto(s) sintética(s) em {pasta}")
+
+
+def _tesseract_instalado() -> bool:
+    try:
+        ocr.pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+
+def preparar(fotos: list[Path], preprocessar: bool) -> dict:
+    """Só a imagem entregue ao tesseract: descodificação (+ pré-processamento)."""
+    from PIL import Image
+
+    tempos, pixeis = [], []
+    for foto in fotos:
+        t0 = time.perf_counter()
+        if preprocessar:
+            img = ocr.preparar_imagem(str(foto))
+        else:
+            img = Image.open(foto).convert("RGB")
+            img.load()
+        tempos.append(time.perf_counter() - t0)
+        pixeis.append(img.size[0] * img.size[1])
+    return {
+        "total_s": sum(tempos),
+        "mediana_s": statistics.median(tempos) if tempos else 0.0,
+        "mpx": statistics.median(pixeis) / 1e6 if pixeis else 0.0,
+    }
+
+
+def correr(fotos: list[Path], gabarito: dict, preprocessar: bool) -> dict:
+    motor = ocr.MotorOCR(workers=0)
+    tempos = []
+    certos = total = 0
+    falhas: dict[str, int] = {}
+    for foto in fotos:
+        t0 = time.perf_counter()
+        texto = motor.ocr_imagem(foto, preprocessar=preprocessar)
+        tempos.append(time.perf_counter() - t0)
+        esperado = gabarito.get(foto.name)
+        if not esperado:
+            continue
+        obtido = _campos(texto)
+        for campo, valor in esperado.items():
+            if campo not in obtido:
+                continue
+            total += 1
+            if _igual(valor, obtido[campo]):
+                certos += 1
+            else:
+                falhas[campo] = falhas.get(campo, 0) + 1
+    return {
+        "total_s": sum(tempos),
+        "mediana_s": statistics.median(tempos) if tempos else 0.0,
+        "max_s": max(tempos, default=0.0),
+        "campos_certos": certos,
+        "campos_total": total,
+        "falhas_por_campo": falhas,
+    }
+
+
+def main() -> None:
+    if len(sys.argv) >= 3 and sys.argv[1] == "--sintetico":
+        gerar_sinteticas(Path(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else 5)
+        return
+    if len(sys.argv) < 2:
+        print("Uso: python3 app/python/bench/bench_ocr.py <pasta_fotos> [gabarito.json]")
+        sys.exit(1)
+    if not ocr.OCR_AVAILABLE:
+        print("❌ pytesseract/Pillow não instalados")
+        sys.exit(1)
+    pasta = Path(sys.argv[1])
+    fotos = sorted(p for p in pasta.iterdir() if p.suffix.lower() in EXT_FOTO)
+    if not fotos:
+        print(f"❌ Sem imagens em {pasta}")
+        sys.exit(1)
+    gab_path = Path(sys.argv[2]) if len(sys.argv) > 2 else pasta / "gabarito.json"
+    gabarito = json.loads(gab_path.read_text(encoding="utf-8")) if gab_path.exists() else {}
+
+    print(f"{len(fotos)} imagem(ns), gabarito: {len(gabarito)} entrada(s)")
+    print("Preparação da imagem (sem tesseract):")
+    for nome, preprocessar in (("sem pré-processamento", False), ("com pré-processamento", True)):
+        r = preparar(fotos, preprocessar)
+        print(f"{nome:>22}: total {r['total_s']:.2f}s, mediana {r['mediana_s']:.3f}s, imagem {r['mpx']:.1f} MP")
+    if not _tesseract_instalado():
+        print("⚠️ Binário do tesseract não encontrado: sem tempos de OCR nem precisão")
+        return
+    print("OCR completo:")
+    for nome, preprocessar in (("sem pré-processamento", False), ("com pré-processamento", True)):
+        r = correr(fotos, gabarito, preprocessar)
+        linha = f"{nome:>22}: total {r['total_s']:.1f}s, mediana {r['mediana_s']:.2f}s, máx {r['max_s']:.2f}s"
+        if r["campos_total"]:
+            pct = 100 * r["campos_certos"] / r["campos_total"]
+            linha += f", campos certos {r['campos_certos']}/{r['campos_total']} ({pct:.0f}%)"
+            if r["falhas_por_campo"]:
+                linha += f", falhas {r['falhas_por_campo']}"
+        print(linha)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Verificação de utils/imap_anexos.esperar_idle contra um servidor IMAP local mínimo (só
+CAPABILITY, LOGIN, SELECT, NOOP, IDLE/DONE e LOGOUT), sem precisar de uma caixa real.
+
+Casos: EXISTS já em untagged_responses (resposta a um NOOP), EXISTS no mesmo pacote que o "+"
+(fica no buffer do imaplib, select() não o vê), EXISTS antes do "+", EXISTS a meio da espera,
+sem novidades (False ao fim do tempo e a ligação continua a funcionar) e BYE durante o IDLE.
+
+Uso:
+  python3 app/python/bench/verificar_imap_idle.py
+"""
+import imaplib
+import socketserver
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import imap_anexos
+
+ESPERA = 1.5  # segundos de IDLE em cada caso
+
+
+class _Servidor(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Sessao)
+        # O que o servidor faz no próximo IDLE: "antes" (EXISTS antes do "+"), "junto" (no mesmo
+        # pacote que o "+"), "depois" (EXISTS passados 0.3 s), "bye" ou "" (nada)
+        self.modo_idle = ""
+        self.exists_no_noop = False
+        self.idles = 0
+
+
+class _Sessao(socketserver.StreamRequestHandler):
+    def _enviar(self, dados: bytes) -> None:
+        self.wfile.write(dados)
+        self.wfile.flush()
+
+    def handle(self) -> None:
+        srv: _Servidor = self.server
+        self._enviar(b"* OK servidor de teste\r\n")
+        while True:
+            linha = self.rfile.readline()
+            if not linha:
+                return
+            tag, _, resto = linha.decode().strip().partition(" ")
+            cmd = resto.split(" ", 1)[0].upper()
+            if cmd == "CAPABILITY":
+                self._enviar(b"* CAPABILITY IMAP4rev1 IDLE\r\n")
+            elif cmd == "SELECT":
+                self._enviar(b"* 3 EXISTS\r\n* 0 RECENT\r\n* OK [UIDVALIDITY 7] ok\r\n* OK [UIDNEXT 4] ok\r\n")
+            elif cmd == "NOOP" and srv.exists_no_noop:
+                srv.exists_no_noop = False
+                self._enviar(b"* 4 EXISTS\r\n")
+            elif cmd == "LOGOUT":
+                self._enviar(f"* BYE\r\n{tag} OK LOGOUT\r\n".encode())
+                return
+            elif cmd == "IDLE":
+                srv.idles += 1
+                modo, srv.modo_idle = srv.modo_idle, ""
+                if modo == "antes":
+                    self._enviar(b"* 4 EXISTS\r\n+ idling\r\n")
+                elif modo == "junto":
+                    self._enviar(b"+ idling\r\n* 4 EXISTS\r\n")
+                elif modo == "bye":
+                    self._enviar(b"+ idling\r\n* BYE a desligar\r\n")
+                    return
+                else:
+                    self._enviar(b"+ idling\r\n")
+                if modo == "depois":
+                    time.sleep(0.3)
+                    self._enviar(b"* 4 EXISTS\r\n")
+                if self.rfile.readline().strip().upper() != b"DONE":
+                    return
+            self._enviar(f"{tag} OK {cmd} concluido\r\n".encode())
+
+
+def _ligar(srv: _Servidor) -> imaplib.IMAP4:
+    mail = imaplib.IMAP4("127.0.0.1", srv.server_address[1])
+    mail.login("teste", "teste")
+    mail.select("INBOX")
+    imap_anexos.limpar_novidades(mail)
+    return mail
+
+
+def _caso(srv: _Servidor, nome: str, esperado, preparar=None, modo: str = "", idles: int = 1) -> bool:
+    mail = _ligar(srv)
+    try:
+        if preparar:
+            preparar(mail)
+        srv.modo_idle, srv.idles = modo, 0
+        t0 = time.monotonic()
+        try:
+            obtido = imap_anexos.esperar_idle(mail, ESPERA)
+        except imaplib.IMAP4.abort:
+            obtido = imaplib.IMAP4.abort
+        t = time.monotonic() - t0
+        # Depois de uma espera sem novidades a ligação tem de continuar utilizável
+        utilizavel = obtido is imaplib.IMAP4.abort or mail.noop()[0] == "OK"
+    finally:
+        try:
+            mail.logout()
+        except Exception:
+            pass
+    ok = obtido == esperado and srv.idles == idles and utilizavel and (esperado is not True or t < ESPERA / 2)
+    print(f"   {'✅' if ok else '❌'} {nome}: {getattr(obtido, '__name__', obtido)} em {t:.2f}s, {srv.idles} IDLE")
+    return ok
+
+
+def main() -> None:
+    srv = _Servidor()
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+
+    def _noop_com_exists(mail) -> None:
+        srv.exists_no_noop = True
+        mail.noop()
+
+    print("esperar_idle contra servidor IMAP local:")
+    resultados = [
+        _caso(srv, "EXISTS já recebido (resposta ao NOOP)", True, _noop_com_exists, idles=0),
+        _caso(srv, "EXISTS no mesmo pacote que o +", True, modo="junto"),
+        _caso(srv, "EXISTS antes do +", True, modo="antes"),
+        _caso(srv, "EXISTS a meio da espera", True, modo="depois"),
+        _caso(srv, "sem novidades", False),
+        _caso(srv, "BYE durante o IDLE", imaplib.IMAP4.abort, modo="bye"),
+    ]
+    srv.shutdown()
+    if all(resultados):
+        print("✅ Todos os casos passaram")
+    else:
+        print(f"❌ {resultados.count(False)} caso(s) falharam")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
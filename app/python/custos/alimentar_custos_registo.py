@@ -10,6 +10,9 @@ import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import diario_custos, rollup_custos
+from utils.escrita_excel import escritor, guardar_atomico
+from utils.leitor_excel import ler_linhas
 
 BASE_PATH = Path(os.getenv("GESTAO_BASE_PATH", "/home/bailan/empresa-gestao/GESTAO_EMPRESA"))
 DADOS_PATH = BASE_PATH / "03_CONTABILIDADE_ANALITICA" / "dados"
@@ -66,21 +69,12 @@ def _classificar_tipo(supplier: str, descricao: str, fornecedores: list, keyword
 
 
 def _load_sheet(path: Path) -> list[dict]:
-    if not path.exists():
-        return []
-    from openpyxl import load_workbook
-    wb = load_workbook(path, data_only=True)
-    ws = wb.active
-    headers = [c.value for c in ws[1]]
-    return [
-        {h: ws.cell(r, i + 1).value for i, h in enumerate(headers) if h}
-        for r in range(2, ws.max_row + 1)
-    ]
+    return ler_linhas(path)
 
 
 def _linhas_de_custos(fornecedores: list, keywords: list) -> list[dict]:
     rows = []
-    for r in _load_sheet(CUSTOS_LINHAS):
+    for r in diario_custos.ler_linhas(CUSTOS_LINHAS):
         cc = str(r.get("centro_custo_codigo") or "").strip()
         if not cc:
             continue
@@ -201,7 +195,11 @@ def main() -> None:
         for col, h in enumerate(COLUNAS, 1):
             ws.cell(r, col, value=row.get(h))
 
-    wb.save(CUSTOS_REGISTO)
+    with escritor(CUSTOS_REGISTO):
+        guardar_atomico(wb, CUSTOS_REGISTO)
+        # O registo foi regenerado a partir das fontes (inclui as facturas do email)
+        diario_custos.descartar(CUSTOS_REGISTO)
+        rollup_custos.guardar(CUSTOS_REGISTO, rollup_custos.calcular(todas))
     print(f"✅ {CUSTOS_REGISTO} ({len(todas)} linhas)")
     por_origem = {}
     for row in todas:
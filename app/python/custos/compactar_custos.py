@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Compacta os diários de custos_linhas e custos_registo (utils/diario_custos):
+as despesas registadas desde a última compactação passam para os .xlsx e os diários ficam vazios.
+Correr a pedido ou periodicamente, ex. cron:
+  */30 * * * * cd /path/to/app/python && python3 custos/compactar_custos.py
+"""
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import diario_custos, rollup_custos
+from utils.escrita_excel import escritor
+
+BASE_PATH = Path(os.getenv("GESTAO_BASE_PATH", "/home/bailan/empresa-gestao/GESTAO_EMPRESA"))
+DADOS_PATH = BASE_PATH / "03_CONTABILIDADE_ANALITICA" / "dados"
+CUSTOS_LINHAS = DADOS_PATH / "custos_linhas.xlsx"
+CUSTOS_REGISTO = DADOS_PATH / "custos_registo.xlsx"
+
+
+def main() -> None:
+    n = diario_custos.compactar(CUSTOS_LINHAS, diario_custos.COLUNAS_CUSTOS_LINHAS)
+    print(f"✅ {CUSTOS_LINHAS.name}: {n} linha(s) do diário")
+    with escritor(CUSTOS_REGISTO):
+        # O conteúdo não muda, só a assinatura: mantém o agregado por obra válido
+        obras = rollup_custos.carregar(CUSTOS_REGISTO)
+        n = diario_custos.compactar(CUSTOS_REGISTO)
+        if obras is not None:
+            rollup_custos.guardar(CUSTOS_REGISTO, obras)
+    print(f"✅ {CUSTOS_REGISTO.name}: {n} linha(s) do diário")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,15 @@ Cria a estrutura de trabalhadores e alocação diária.
 - alocacao_diaria.xlsx: data, trabalhador_codigo, centro_custo_codigo, horas, notas
 """
 import os
+import sys
 from pathlib import Path
 
-from openpyxl import Workbook, load_workbook
+from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.leitor_excel import ler_cabecalho, ler_linhas
+
 BASE_PATH = Path(os.getenv("GESTAO_BASE_PATH", "/home/bailan/empresa-gestao/GESTAO_EMPRESA"))
 DADOS_PATH = BASE_PATH / "03_CONTABILIDADE_ANALITICA" / "dados"
 CENTROS = BASE_PATH / "00_CONFIG" / "centros_custo.xlsx"
@@ -21,12 +25,13 @@ HEADER_FONT = Font(bold=True, color="FFFFFF")
 def _load_centros_codigos() -> list[str]:
     if not CENTROS.exists():
         return []
-    wb = load_workbook(CENTROS, data_only=True)
-    ws = wb.active
-    idx = next((i for i, c in enumerate(ws[1], 1) if c.value == "centro_custo_codigo"), None)
-    if not idx:
+    if "centro_custo_codigo" not in ler_cabecalho(CENTROS):
         return []
-    return [str(ws.cell(r, idx).value or "").strip() for r in range(2, ws.max_row + 1) if ws.cell(r, idx).value]
+    return [
+        str(r["centro_custo_codigo"]).strip()
+        for r in ler_linhas(CENTROS, colunas=["centro_custo_codigo"])
+        if r["centro_custo_codigo"]
+    ]
 
 
 def main() -> None:
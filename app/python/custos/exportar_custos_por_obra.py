@@ -5,11 +5,16 @@ com 5 abas: subempreitadas, materiais, mao_obra, equipamentos_maquinaria, custos
 Fonte: custos_registo (ou custos_linhas+alocacao se custos_registo não existir).
 """
 import os
+import sys
 from pathlib import Path
 
-from openpyxl import Workbook, load_workbook
+from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import diario_custos
+from utils.leitor_excel import ler_linhas
+
 BASE_PATH = Path(os.getenv("GESTAO_BASE_PATH", "/home/bailan/empresa-gestao/GESTAO_EMPRESA"))
 DADOS_PATH = BASE_PATH / "03_CONTABILIDADE_ANALITICA" / "dados"
 OBRAS_PATH = BASE_PATH / "03_CONTABILIDADE_ANALITICA" / "obras"
@@ -31,25 +36,17 @@ TIPOS = ("subempreitadas", "materiais", "mao_obra", "equipamentos_maquinaria", "
 
 
 def _load_sheet(path: Path) -> list[dict]:
-    if not path.exists():
-        return []
-    wb = load_workbook(path, data_only=True)
-    ws = wb.active
-    headers = [c.value for c in ws[1]]
-    return [
-        {h: ws.cell(r, i + 1).value for i, h in enumerate(headers) if h}
-        for r in range(2, ws.max_row + 1)
-    ]
+    return ler_linhas(path)
 
 
 def _load_custos_registo() -> list[dict]:
     """Carrega custos_registo ou fallback para custos_linhas+alocacao."""
-    if CUSTOS_REGISTO.exists():
-        rows = _load_sheet(CUSTOS_REGISTO)
+    if diario_custos.existe(CUSTOS_REGISTO):
+        rows = diario_custos.ler_linhas(CUSTOS_REGISTO)
         return [r for r in rows if (r.get("centro_custo_codigo") or "").strip()]
     # Fallback: custos_linhas + alocacao
     result = []
-    for r in _load_sheet(CUSTOS_LINHAS):
+    for r in diario_custos.ler_linhas(CUSTOS_LINHAS):
         cc = str(r.get("centro_custo_codigo") or "").strip()
         if not cc:
             continue
@@ -5,8 +5,10 @@ Produz um dicionário com: fornecedor, cliente, documento, linhas, totais.
 """
 import json
 import re
+from bisect import bisect_right
 from dataclasses import asdict, dataclass, field
 from pathlib import Path
+from itertools import accumulate
 from typing import Optional
 
 import sys
@@ -76,6 +78,44 @@ class FacturaExtraida:
         return d
 
 
+# --- Padrões (compilados uma vez) ---
+_RE_NIF_FORNECEDOR = re.compile(r"N[ºo°]\s*Contribuinte\s*[:\s]*(\d{9})", re.I)
+_RE_SEDE_LOJA = re.compile(r"(SEDE|LOJA):\s*$", re.I)
+_RE_FORMA_JURIDICA = re.compile(r"LDA|LDA\.|UNIPESSOAL|SA\b")
+_RE_IVA_OU_NIF_INICIO = re.compile(r"^IVA-|^\d{9}")
+_RE_NIF_CLIENTE = re.compile(r"IVA-?PT-?(\d{9})", re.I)
+_RE_DOCUMENTO = re.compile(
+    r"(?:Fatura|Factura|Recibo)[^\d]*N[ºo°]?\s*[\s:]*(.+?)(?:\s+(\d{2}[-/]\d{2}[-/]\d{2,4}))?$", re.I
+)
+_RE_VDI = re.compile(r"(VDI\s*\d+[/\-]\d+)", re.I)
+_RE_DATA = re.compile(r"(\d{1,2})[-/](\d{1,2})[-/](\d{2,4})")
+_RE_VALOR = re.compile(r"(\d+[,.]\d{2})")
+_RE_COMECA_DIGITO = re.compile(r"^\d")
+# Linhas de produto
+_RE_CODIGO_SO = re.compile(r"^(\d{6,15})\s*$")
+_RE_CODIGO_INICIO = re.compile(r"^(\d{6,15})\s+")
+_RE_TAXA_SO = re.compile(r"^(23|13|6)\s*%?\s*$")
+_RE_UNIDADE_SO = re.compile(r"^(UN|UND|LA|KG|M)\s*$", re.I)
+_RE_VALOR_SO = re.compile(r"^\d+[,.]\d{2}\s*$")
+_RE_UNIDADE_SEP = re.compile(r"\s+(UN|UND|LA|KG|M)\s+", re.I)
+_RE_TAXA_FIM = re.compile(r"\s*\d{1,2}\s*%?\s*$")
+_RE_TAXA = re.compile(r"\b(23|13|6)\s*%?")
+_RE_UNIDADE = re.compile(r"\b(UN|UND|LA|KG|M)\b", re.I)
+# Despesa simples (OCR de fotos)
+_RE_DESPESA_VALORES = (
+    re.compile(r"total[:\s]*(\d+[,.]\d{2})"),
+    re.compile(r"(\d+[,.]\d{2})\s*€"),
+    re.compile(r"iva[:\s]*(\d+[,.]?\d*)%?"),
+)
+
+# Palavras que indicam linhas que NÃO são produtos
+_EXCLUIR_DESIGNACAO = (
+    "DESIGNAÇÃO", "CÓDIGO", "P.P.", "TOTAL", "OBSERVAÇÕES", "ORIGINAL", "CÓPIA",
+    "FORMULÁRIO", "CAPITAL SOCIAL", "REG. CONSERV", "SOFTWARE", "PAGAMENTO", "IBAN",
+    "ATCUD", "RECEBIDO", "LÍQUIDO", "V.DESC", "% DESC", "ELABORADO POR",
+)
+
+
 def _parse_valor(s: str) -> Optional[float]:
     if not s:
         return None
@@ -88,7 +128,7 @@ def _parse_valor(s: str) -> Optional[float]:
 
 def _parse_data(s: str) -> str:
     """Converte dd-mm-yyyy ou dd/mm/yyyy para yyyy-mm-dd."""
-    m = re.search(r"(\d{1,2})[-/](\d{1,2})[-/](\d{2,4})", s)
+    m = _RE_DATA.search(s)
     if not m:
         return ""
     d, mo, y = m.groups()
@@ -96,165 +136,230 @@ def _parse_data(s: str) -> str:
     return f"{y}-{mo.zfill(2)}-{d.zfill(2)}"
 
 
-def extrair_factura(texto: str, origem: str = "") -> FacturaExtraida:
+# Marcadores de _Linhas: literais que uma linha tem de conter para ser candidata a cada campo
+# (True: sem distinguir maiúsculas, como os padrões re.I correspondentes)
+_MARCADORES: dict[str, tuple[tuple[str, ...], bool]] = {
+    "nif": (("contribuinte",), True),
+    "dois_pontos": ((":\n",), False),  # linha acaba em ":"
+    "vendedor": (("Vendedor",), False),
+    "forma_juridica": (("LDA", "SA", "UNIPESSOAL"), False),
+    "contribuinte": (("Contribuinte",), False),
+    "solid": (("SOLID PROJECTS",), False),
+    "churrasqueira": (("CHURRASQUEIRA",), False),
+    "iva": (("iva",), True),
+    "pt": (("pt",), True),
+    "documento": (("fatura", "factura", "recibo"), True),
+    "vdi": (("vdi",), True),
+    "data": (("-", "/"), False),
+    "totais": ((
+        "Total Documento", "Total documento", "Total Líquido", "Total Liquido", "Valor Ilíquido",
+        "Totais", "Total de IVA", "Total IVA", "Valor IVA",
+    ), False),
+    "iva_23": (("23%",), False),
+    "total": (("total",), True),
+    "euro": (("€",), False),
+}
+
+
+def _minusculas(texto: str) -> str:
     """
-    Analisa o texto extraído de uma factura e devolve estrutura organizada.
+    lower() com o mesmo comprimento, para pré-filtrar padrões re.I (que também igualam
+    "İ" e "ı" a "i" e "ſ" a "s").
     """
-    out = FacturaExtraida(origem=origem)
-    lines = [l.strip() for l in texto.splitlines() if l.strip()]
+    if texto.isascii():
+        return texto.lower()
+    return texto.replace("İ", "i").lower().replace("ı", "i").replace("ſ", "s")
+
+
+def _linhas_com(junto: str, inicios: list[int], literais: tuple[str, ...]) -> list[int]:
+    """Índices, por ordem, das linhas de junto (começadas em inicios) que contêm algum dos literais."""
+    achadas = set()
+    n = len(inicios)
+    for lit in literais:
+        pos = junto.find(lit)
+        while pos != -1:
+            i = bisect_right(inicios, pos) - 1
+            achadas.add(i)
+            pos = junto.find(lit, inicios[i + 1]) if i + 1 < n else -1
+    return sorted(achadas)
+
+
+class _Linhas:
+    """
+    Linhas não vazias do texto, classificadas uma vez: para cada marcador, os índices das
+    linhas onde aparece (pela ordem do texto), procurados no texto todo de uma vez (str.find).
+    Os extratores de cada campo só aplicam as expressões regulares a essas linhas, pela
+    mesma ordem, com o mesmo resultado que percorrer todas.
+    """
+
+    def __init__(self, texto: str):
+        self.linhas = linhas = [l.strip() for l in texto.splitlines() if l.strip()]
+        junto = "\n".join(linhas) + "\n"
+        junto_min = _minusculas(junto)
+        inicios = list(accumulate((len(l) + 1 for l in linhas[:-1]), initial=0)) if linhas else []
+        cand = {
+            nome: _linhas_com(junto_min if sem_maiusculas else junto, inicios, literais)
+            for nome, (literais, sem_maiusculas) in _MARCADORES.items()
+        }
+        cand["iva_pt"] = sorted(set(cand["iva"]).intersection(cand["pt"]))
+        cand["despesa"] = sorted(set(cand["total"]).union(cand["euro"], cand["iva"]))
+        # Todos os produtos começam por um código de 6-15 dígitos
+        cand["codigo"] = [i for i, l in enumerate(linhas) if l[:6].isdecimal()]
+        self.cand = cand
+
+    def de(self, marcador: str):
+        """(índice, linha) das linhas com o marcador."""
+        linhas = self.linhas
+        return ((i, linhas[i]) for i in self.cand[marcador])
 
+
+def _extrair_fornecedor(L: _Linhas, out: FacturaExtraida) -> None:
+    lines = L.linhas
     # NIF fornecedor: "Nº Contribuinte: 503238660" (está na área do vendedor)
-    nif_forn = None
-    for line in lines:
-        m = re.search(r"N[ºo°]\s*Contribuinte\s*[:\s]*(\d{9})", line, re.I)
+    for _, line in L.de("nif"):
+        m = _RE_NIF_FORNECEDOR.search(line)
         if m:
-            nif_forn = m.group(1)
-            out.fornecedor.nif = nif_forn
+            out.fornecedor.nif = m.group(1)
             break
 
-    # --- Fornecedor: nome antes de SEDE/LOJA, ou linha com "Vendedor" / estrutura típica
-    for i, line in enumerate(lines):
-        if re.search(r"(SEDE|LOJA):\s*$", line, re.I) and i >= 1:
+    # Nome antes de SEDE/LOJA, ou linha com "Vendedor" / estrutura típica
+    for i, line in L.de("dois_pontos"):
+        if i >= 1 and _RE_SEDE_LOJA.search(line):
             candidato = lines[i - 1].strip()
-            if len(candidato) > 15 and not re.match(r"^\d", candidato) and "E-mail" not in candidato:
+            if len(candidato) > 15 and not _RE_COMECA_DIGITO.match(candidato) and "E-mail" not in candidato:
                 out.fornecedor.nome = candidato[:200]
                 break
     if not out.fornecedor.nome:
-        for line in lines:
-            if "Vendedor" in line:
-                idx = lines.index(line)
-                if idx + 1 < len(lines):
-                    out.fornecedor.nome = lines[idx + 1].strip()[:200]
-                break
+        for i, _ in L.de("vendedor"):
+            if i + 1 < len(lines):
+                out.fornecedor.nome = lines[i + 1].strip()[:200]
+            break
     if not out.fornecedor.nome:
-        for line in lines:
-            if re.search(r"LDA|LDA\.|UNIPESSOAL|SA\b", line) and "SEDE" not in line and "LOJA" not in line:
+        for _, line in L.de("forma_juridica"):
+            if _RE_FORMA_JURIDICA.search(line) and "SEDE" not in line and "LOJA" not in line:
                 if "E-mail" not in line and "Cliente" not in line and len(line) > 20:
-                    if not re.match(r"^IVA-|^\d{9}", line):
+                    if not _RE_IVA_OU_NIF_INICIO.match(line):
                         out.fornecedor.nome = line[:200]
                         break
 
-    # --- Cliente: "Contribuinte" na secção cliente + linha seguinte, ou SOLID PROJECTS / CHURRASQUEIRA
-    for i, line in enumerate(lines):
-        if "Contribuinte" in line and i + 1 < len(lines):
+
+def _extrair_cliente(L: _Linhas, out: FacturaExtraida) -> None:
+    lines = L.linhas
+    # "Contribuinte" na secção cliente + linha seguinte, ou SOLID PROJECTS / CHURRASQUEIRA
+    for i, _ in L.de("contribuinte"):
+        if i + 1 < len(lines):
             seguinte = lines[i + 1].strip()
-            if not re.match(r"^IVA-|^\d{9}", seguinte) and len(seguinte) > 3:
+            if not _RE_IVA_OU_NIF_INICIO.match(seguinte) and len(seguinte) > 3:
                 out.cliente.nome = seguinte[:200]
                 break
     if not out.cliente.nome:
-        for line in lines:
-            if "SOLID PROJECTS" in line:
-                out.cliente.nome = line[:200]
-                break
+        for _, line in L.de("solid"):
+            out.cliente.nome = line[:200]
+            break
     if not out.cliente.nome:
-        for line in lines:
-            if "CHURRASQUEIRA" in line and "Contribuinte" not in line:
+        for _, line in L.de("churrasqueira"):
+            if "Contribuinte" not in line:
                 out.cliente.nome = line[:200]
                 break
 
     # NIF cliente: IVA-PT-515188166 (em linha separada ou junto a Cliente)
-    for line in lines:
-        m = re.search(r"IVA-?PT-?(\d{9})", line, re.I)
+    for _, line in L.de("iva_pt"):
+        m = _RE_NIF_CLIENTE.search(line)
         if m:
             out.cliente.nif = m.group(1)
             break
 
-    # --- Documento: Fatura-Recibo Nº VDI 2610/201
-    for line in lines:
-        m = re.search(r"(?:Fatura|Factura|Recibo)[^\d]*N[ºo°]?\s*[\s:]*(.+?)(?:\s+(\d{2}[-/]\d{2}[-/]\d{2,4}))?$", line, re.I)
+
+def _extrair_documento(L: _Linhas, out: FacturaExtraida) -> None:
+    # Fatura-Recibo Nº VDI 2610/201; sem esta linha, o primeiro "VDI nnn/nnn"
+    for _, line in L.de("documento"):
+        m = _RE_DOCUMENTO.search(line)
         if m:
             out.documento.numero = m.group(1).strip()[:80]
             if m.group(2):
                 out.documento.data = _parse_data(m.group(2))
             break
-        m = re.search(r"(VDI\s*\d+[/\-]\d+)", line, re.I)
-        if m and not out.documento.numero:
-            out.documento.numero = m.group(1)
+    else:
+        for _, line in L.de("vdi"):
+            m = _RE_VDI.search(line)
+            if m:
+                out.documento.numero = m.group(1)
+                break
 
     # Data: dd-mm-yyyy
     if not out.documento.data:
-        for line in lines:
+        for _, line in L.de("data"):
             d = _parse_data(line)
             if d and "2000" <= d[:4] <= "2030":
                 out.documento.data = d
                 break
 
-    # --- Totais: Total Documento EUR 189,97 | Total Líquido 154,45 | Total de IVA 35,52
-    for line in lines:
+
+def _extrair_totais(L: _Linhas, out: FacturaExtraida) -> None:
+    t = out.totais
+    # Total Documento EUR 271,46 | Total Líquido 220,70 (ou Valor Ilíquido) | Total de IVA 50,76
+    for _, line in L.de("totais"):
         if "Total Documento" in line or "Total documento" in line:
-            m = re.search(r"(\d+[,.]\d{2})\s*(?:EUR|€)?", line)
+            m = _RE_VALOR.search(line)  # 1º valor, seguido ou não de EUR/€
             if m:
-                out.totais.total_documento = _parse_valor(m.group(1))
-        if "Total L[ií]quido" in line or "Totais" in line:
-            m = re.search(r"(\d+[,.]\d{2})", line)
-            if m and out.totais.valor_liquido is None:
-                out.totais.valor_liquido = _parse_valor(m.group(1))
+                t.total_documento = _parse_valor(m.group(1))
+        if any(r in line for r in ("Total Líquido", "Total Liquido", "Valor Ilíquido", "Totais")):
+            m = _RE_VALOR.search(line)
+            if m and t.valor_liquido is None:
+                t.valor_liquido = _parse_valor(m.group(1))
         if "Total de IVA" in line or "Total IVA" in line or "Valor IVA" in line:
-            m = re.search(r"(\d+[,.]\d{2})", line)
+            m = _RE_VALOR.search(line)
             if m:
-                out.totais.total_iva = _parse_valor(m.group(1))
-
-    # Procurar IVA 23%: base 154,45 e valor IVA 35,52
-    for line in lines:
-        if "IVA 23%" in line or "23%" in line:
-            m = re.findall(r"(\d+[,.]\d{2})", line)
-            for v in m:
-                x = _parse_valor(v)
-                if x and 30 < x < 40 and out.totais.total_iva is None:
-                    out.totais.total_iva = x
-                if x and 150 < x < 170 and out.totais.valor_liquido is None:
-                    out.totais.valor_liquido = x
-    if out.totais.total_iva is None:
-        for line in lines:
-            if "35,52" in line or "35.52" in line:
-                m = re.search(r"(\d+[,.]\d{2})", line)
-                if m:
-                    out.totais.total_iva = _parse_valor(m.group(1))
-                    break
+                t.total_iva = _parse_valor(m.group(1))
+
+    # Sem rótulos: quadro de IVA "23% <base> <valor IVA>", o valor IVA é 23% da base
+    if t.total_iva is None or t.valor_liquido is None:
+        for _, line in L.de("iva_23"):
+            valores = [x for x in (_parse_valor(v) for v in _RE_VALOR.findall(line)) if x]
+            par = next(
+                ((b, i) for b, i in zip(valores, valores[1:]) if abs(b * 0.23 - i) <= 0.01 + b * 0.0005), None
+            )
+            if par:
+                if t.valor_liquido is None:
+                    t.valor_liquido = par[0]
+                if t.total_iva is None:
+                    t.total_iva = par[1]
+                break
 
-    # Fallback totais: procurar padrão Valor Ilíquido/154,45
-    for i, line in enumerate(lines):
-        if "154,45" in line or "Valor Ilíquido" in line:
-            m = re.search(r"(\d+[,.]\d{2})", line)
-            if m and out.totais.valor_liquido is None:
-                out.totais.valor_liquido = _parse_valor(m.group(1))
-        if "35,52" in line and "IVA" in line:
-            m = re.search(r"(\d+[,.]\d{2})", line)
-            if m and out.totais.total_iva is None:
-                out.totais.total_iva = _parse_valor(m.group(1))
-        if "189,97" in line:
-            m = re.search(r"(\d+[,.]\d{2})", line)
-            if m and out.totais.total_documento is None:
-                out.totais.total_documento = _parse_valor(m.group(1))
-
-    # Palavras que indicam linhas que NÃO são produtos
-    EXCLUIR = ("DESIGNAÇÃO", "CÓDIGO", "P.P.", "TOTAL", "OBSERVAÇÕES", "ORIGINAL", "CÓPIA",
-               "FORMULÁRIO", "CAPITAL SOCIAL", "REG. CONSERV", "SOFTWARE", "PAGAMENTO", "IBAN",
-               "ATCUD", "RECEBIDO", "LÍQUIDO", "V.DESC", "% DESC", "ELABORADO POR")
-
-    # Estratégia 1: PDF com layout vertical (código, IVA, designação, unidade, valores em linhas separadas)
+
+def _extrair_linhas(L: _Linhas, out: FacturaExtraida) -> None:
+    lines = L.linhas
     i = 0
-    while i < len(lines):
+    # Todos os produtos começam por um código de 6-15 dígitos: só essas linhas são analisadas
+    for idx in L.cand["codigo"]:
+        if idx < i:
+            continue  # já consumida por um produto em layout vertical
+        i = idx
         line = lines[i]
-        if re.match(r"^(\d{6,15})\s*$", line):  # linha só com código (6-15 dígitos)
+        # Estratégia 1: PDF com layout vertical (código, IVA, designação, unidade, valores em linhas separadas)
+        if _RE_CODIGO_SO.match(line):  # linha só com código (6-15 dígitos)
             codigo = line.strip()
             iva_pct, designacao, unidade, preco, qtd, valor_liq = None, "", "UN", None, 1.0, None
             j = i + 1
             nums = []
             for k in range(j, min(j + 12, len(lines))):
                 ln = lines[k]
-                if re.match(r"^\d{6,15}\s*$", ln) and k > j:  # próximo produto
+                # Os padrões só com código, taxa ou valor começam por dígito: testado antes da regex
+                digito = ln[:1].isdecimal()
+                if digito and k > j and _RE_CODIGO_SO.match(ln):  # próximo produto
                     break
-                if re.match(r"^(23|13|6)\s*%?\s*$", ln):
+                if ln[:1] in ("1", "2", "6") and _RE_TAXA_SO.match(ln):
                     iva_pct = parse_taxa_iva(ln.strip())
-                elif re.match(r"^(UN|UND|LA|KG|M)\s*$", ln, re.I):
+                elif not digito and _RE_UNIDADE_SO.match(ln):
                     unidade = ln.strip().upper()
-                elif re.match(r"^\d+[,.]\d{2}\s*$", ln):
+                elif digito and _RE_VALOR_SO.match(ln):
                     if len(nums) < 5:  # máx 5 valores por produto
                         nums.append(_parse_valor(ln))
-                elif len(ln) > 8 and not re.match(r"^\d", ln) and "€" not in ln:
-                    if not designacao and not any(x in ln.upper() for x in EXCLUIR):
-                        designacao = ln[:150]
+                elif len(ln) > 8 and not digito and "€" not in ln:
+                    if not designacao:
+                        up = ln.upper()
+                        if not any(x in up for x in _EXCLUIR_DESIGNACAO):
+                            designacao = ln[:150]
                 j = k + 1
             if designacao and len(nums) >= 2:
                 # Ordem típica: preço unit, valor IVA, preço c/IVA, qtd (último muitas vezes 1,00 ou 2,00)
@@ -274,32 +379,35 @@ def extrair_factura(texto: str, origem: str = "") -> FacturaExtraida:
             i = j
             continue
         # Estratégia 2: linha horizontal com código + designação + valores
-        cod_match = re.match(r"^(\d{6,15})\s+", line)
-        vals = re.findall(r"(\d+[,.]\d{2})", line)
-        if cod_match and len(vals) >= 2:
-            codigo = cod_match.group(1)
-            resto = line[len(codigo):].strip()
-            designacao = re.split(r"\s+(UN|UND|LA|KG|M)\s+", resto, 1, re.I)[0].strip()
-            designacao = re.sub(r"\s*\d{1,2}\s*%?\s*$", "", designacao).strip()
-            if len(designacao) >= 5:
-                iva_match = re.search(r"\b(23|13|6)\s*%?", resto)
-                iva_pct = parse_taxa_iva(iva_match.group(1)) if iva_match else None
-                un_match = re.search(r"\b(UN|UND|LA|KG|M)\b", resto, re.I)
-                unidade = un_match.group(1).upper() if un_match else "UN"
-                valor_liq = _parse_valor(vals[-1])
-                preco = _parse_valor(vals[0])
-                qtd = round(valor_liq / preco, 2) if valor_liq and preco and preco > 0 else 1.0
-                out.linhas.append(LinhaFactura(
-                    designacao=designacao[:150],
-                    codigo=codigo,
-                    quantidade=qtd,
-                    unidade=unidade,
-                    preco_unitario=preco,
-                    valor_liquido=valor_liq,
-                    iva_pct=iva_pct,
-                ))
+        cod_match = _RE_CODIGO_INICIO.match(line)
+        if cod_match:
+            vals = _RE_VALOR.findall(line)
+            if len(vals) >= 2:
+                codigo = cod_match.group(1)
+                resto = line[len(codigo):].strip()
+                designacao = _RE_UNIDADE_SEP.split(resto, 1)[0].strip()
+                designacao = _RE_TAXA_FIM.sub("", designacao).strip()
+                if len(designacao) >= 5:
+                    iva_match = _RE_TAXA.search(resto)
+                    iva_pct = parse_taxa_iva(iva_match.group(1)) if iva_match else None
+                    un_match = _RE_UNIDADE.search(resto)
+                    unidade = un_match.group(1).upper() if un_match else "UN"
+                    valor_liq = _parse_valor(vals[-1])
+                    preco = _parse_valor(vals[0])
+                    qtd = round(valor_liq / preco, 2) if valor_liq and preco and preco > 0 else 1.0
+                    out.linhas.append(LinhaFactura(
+                        designacao=designacao[:150],
+                        codigo=codigo,
+                        quantidade=qtd,
+                        unidade=unidade,
+                        preco_unitario=preco,
+                        valor_liquido=valor_liq,
+                        iva_pct=iva_pct,
+                    ))
         i += 1
 
+
+def _finalizar_linhas(out: FacturaExtraida) -> None:
     # Deduplicar linhas (PDF pode ter ORIGINAL + CÓPIA): manter primeira ocorrência por código
     vistos = set()
     unicas = []
@@ -319,9 +427,75 @@ def extrair_factura(texto: str, origem: str = "") -> FacturaExtraida:
             preco_unitario=out.totais.valor_liquido,
         ))
 
+
+def extrair_factura(texto: str, origem: str = "", linhas: Optional[list[dict]] = None) -> FacturaExtraida:
+    """
+    Analisa o texto extraído de uma factura e devolve estrutura organizada.
+    As linhas são classificadas uma vez (_Linhas) e cada extrator só vê as candidatas.
+    linhas: produtos já lidos da tabela do PDF (utils/tabela_pdf.linhas_pdf); se vier
+    alguma, substitui a procura de produtos no texto.
+    """
+    out = FacturaExtraida(origem=origem)
+    L = _Linhas(texto)
+    _extrair_fornecedor(L, out)
+    _extrair_cliente(L, out)
+    _extrair_documento(L, out)
+    _extrair_totais(L, out)
+    if linhas:
+        out.linhas = [LinhaFactura(**ln) for ln in linhas]
+    else:
+        _extrair_linhas(L, out)
+    _finalizar_linhas(out)
+    return out
+
+
+def extrair_dados_despesa(texto: str) -> dict:
+    """
+    Fornecedor, data, valor e IVA de uma despesa simples (texto OCR de fotos/recibos),
+    no formato das linhas de custos_linhas. Usado pela API e por processar_email_despesas.
+    """
+    out = {"supplier": "", "date": "", "net_amount": None, "tax_pct": None, "description": ""}
+    L = _Linhas(texto)
+    # Data (dd-mm-yyyy, dd/mm/yyyy, yyyy-mm-dd)
+    for _, line in L.de("data"):
+        m = _RE_DATA.search(line)
+        if m:
+            d, mo, y = m.groups()
+            out["date"] = f"20{y[-2:]}-{mo.zfill(2)}-{d.zfill(2)}" if len(y) == 2 else f"{y}-{mo.zfill(2)}-{d.zfill(2)}"
+            break
+    # Valores: Total, IVA
+    for _, line in L.de("despesa"):
+        low = line.lower()
+        for p in _RE_DESPESA_VALORES:
+            m = p.search(low)
+            if m:
+                v = m.group(1).replace(",", ".")
+                try:
+                    n = float(v)
+                    if "iva" in low or "%" in line:
+                        out["tax_pct"] = parse_taxa_iva(v)
+                    elif out["net_amount"] is None and n > 0:
+                        out["net_amount"] = n
+                except ValueError:
+                    pass
+    # Primeira linha costuma ser fornecedor
+    if L.linhas:
+        out["supplier"] = L.linhas[0][:100]
     return out
 
 
+def factura_de_dict(d: dict) -> FacturaExtraida:
+    """Inverso de FacturaExtraida.to_dict (ex: factura lida de facturas_extraidas/*.json)."""
+    return FacturaExtraida(
+        fornecedor=Fornecedor(**d.get("fornecedor", {})),
+        cliente=Cliente(**d.get("cliente", {})),
+        documento=Documento(**d.get("documento", {})),
+        linhas=[LinhaFactura(**l) for l in d.get("linhas", [])],
+        totais=Totais(**d.get("totais", {})),
+        origem=d.get("origem", ""),
+    )
+
+
 def guardar_factura_json(factura: FacturaExtraida, path: Path) -> None:
     with open(path, "w", encoding="utf-8") as f:
         json.dump(factura.to_dict(), f, ensure_ascii=False, indent=2)
@@ -379,9 +553,10 @@ if __name__ == "__main__":
         print("Uso: python extrair_factura.py <caminho_pdf>")
         sys.exit(1)
     from processar_email_despesas import _extrair_texto_pdf
+    from utils.tabela_pdf import linhas_pdf
     pdf_path = Path(sys.argv[1])
     texto = _extrair_texto_pdf(pdf_path)
-    f = extrair_factura(texto, origem=str(pdf_path.name))
+    f = extrair_factura(texto, origem=str(pdf_path.name), linhas=linhas_pdf(pdf_path))
     out_dir = Path(__file__).resolve().parent.parent.parent.parent / "03_CONTABILIDADE_ANALITICA" / "dados" / "facturas_extraidas"
     out_dir.mkdir(parents=True, exist_ok=True)
     base = out_dir / (pdf_path.stem + "_extraida")
@@ -10,9 +10,11 @@ import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils.escrita_excel import escritor, guardar_atomico
+from utils.leitor_excel import ler_tabela
 from utils.taxas_iva import parse_taxa_iva
 
-from openpyxl import Workbook, load_workbook
+from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill
 
 BASE_PATH = Path(os.getenv("GESTAO_BASE_PATH", "/home/bailan/empresa-gestao/GESTAO_EMPRESA"))
@@ -63,14 +65,7 @@ def _classificar_linha(
 
 
 def _load_sheet(wb_path: Path, sheet_name: str | None = None) -> tuple[list[str], list[dict]]:
-    wb = load_workbook(wb_path, data_only=True)
-    ws = wb.active if sheet_name is None else wb[sheet_name]
-    headers = [c.value for c in ws[1]]
-    rows = []
-    for r in range(2, ws.max_row + 1):
-        row = {h: ws.cell(r, i + 1).value for i, h in enumerate(headers) if h}
-        rows.append(row)
-    return headers, rows
+    return ler_tabela(wb_path, folha=sheet_name)
 
 
 def main() -> None:
@@ -82,7 +77,7 @@ def main() -> None:
 
     existentes: dict[str, str] = {}
     if CUSTOS_LINHAS.exists():
-        _, ex_rows = _load_sheet(CUSTOS_LINHAS)
+        _, ex_rows = ler_tabela(CUSTOS_LINHAS, colunas=["line_id", "centro_custo_codigo"])
         for r in ex_rows:
             lid = str(r.get("line_id", ""))
             cc = r.get("centro_custo_codigo")
@@ -128,7 +123,9 @@ def main() -> None:
     for r, row in enumerate(out_rows, 2):
         for col, h in enumerate(headers_out, 1):
             ws.cell(row=r, column=col, value=row.get(h))
-    wb.save(CUSTOS_LINHAS)
+    # Despesas registadas por foto/email continuam no diário, por cima do novo .xlsx
+    with escritor(CUSTOS_LINHAS):
+        guardar_atomico(wb, CUSTOS_LINHAS)
     print(f"✅ custos_linhas: {CUSTOS_LINHAS} ({len(out_rows)} linhas)")
     print("   Preencha 'centro_custo_codigo' e execute exportar_custos_por_obra.py")
 
@@ -11,6 +11,8 @@ import sys
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import diario_custos
+from utils.escrita_excel import escritor, guardar_atomico
 
 BASE_PATH = Path(os.getenv("GESTAO_BASE_PATH", "/home/bailan/empresa-gestao/GESTAO_EMPRESA"))
 DADOS_PATH = BASE_PATH / "03_CONTABILIDADE_ANALITICA" / "dados"
@@ -45,17 +47,16 @@ def migrar_ficheiro(path: Path, col_centro: str = "centro_custo_codigo") -> tupl
     """Migra centros num ficheiro Excel. Retorna (alterados, nao_mapeados)."""
     if not path.exists():
         return 0, []
-    from openpyxl import load_workbook
-    wb = load_workbook(path)
-    ws = wb.active
-    headers = [c.value for c in ws[1]]
+    from utils.leitor_excel import ler_cabecalho, iter_linhas
+    headers = ler_cabecalho(path)
     idx = next((i for i, h in enumerate(headers, 1) if h == col_centro), None)
     if not idx:
         return 0, []
-    alterados = 0
+    # 1ª passagem em streaming: só abre o workbook para edição se houver algo a migrar
+    novos: dict[int, str] = {}
     nao_mapeados = []
-    for r in range(2, ws.max_row + 1):
-        val = _normalizar(ws.cell(r, idx).value)
+    for r, row in enumerate(iter_linhas(path, colunas=[col_centro]), 2):
+        val = _normalizar(row[col_centro])
         if not val or val in MAPEAMENTO.values():
             continue
         # Verificar se já está no formato novo (YY.NNN)
@@ -63,27 +64,35 @@ def migrar_ficheiro(path: Path, col_centro: str = "centro_custo_codigo") -> tupl
             continue
         novo = MAPEAMENTO.get(val) or MAPEAMENTO.get(val.lstrip("0")) or MAPEAMENTO.get(val.zfill(3))
         if novo:
-            ws.cell(r, idx).value = novo
-            alterados += 1
+            novos[r] = novo
         else:
             nao_mapeados.append(val)
-    wb.save(path)
-    return alterados, sorted(set(nao_mapeados))
+    if novos:
+        from openpyxl import load_workbook
+        wb = load_workbook(path)
+        ws = wb.active
+        for r, novo in novos.items():
+            ws.cell(r, idx).value = novo
+        guardar_atomico(wb, path)
+    return len(novos), sorted(set(nao_mapeados))
 
 
 def main():
     print("Migrar centros de custo antigos -> YY.NNN")
     print()
     tot = 0
-    for path, col in [(CUSTOS_LINHAS, "centro_custo_codigo"), (ALOCACAO_DIARIA, "centro_custo_codigo")]:
-        if path.exists():
-            n, nm = migrar_ficheiro(path, col)
-            tot += n
-            print(f"  {path.name}: {n} linha(s) atualizada(s)")
-            if nm:
-                print(f"    Sem mapeamento: {nm}")
-        else:
-            print(f"  {path.name}: (não existe)")
+    # Despesas ainda no diário passam primeiro para o .xlsx, para serem migradas também
+    with escritor(CUSTOS_LINHAS), escritor(ALOCACAO_DIARIA):
+        diario_custos.compactar(CUSTOS_LINHAS, diario_custos.COLUNAS_CUSTOS_LINHAS)
+        for path, col in [(CUSTOS_LINHAS, "centro_custo_codigo"), (ALOCACAO_DIARIA, "centro_custo_codigo")]:
+            if path.exists():
+                n, nm = migrar_ficheiro(path, col)
+                tot += n
+                print(f"  {path.name}: {n} linha(s) atualizada(s)")
+                if nm:
+                    print(f"    Sem mapeamento: {nm}")
+            else:
+                print(f"  {path.name}: (não existe)")
     print()
     print(f"✅ Total: {tot} centro(s) migrado(s)")
 
@@ -3,26 +3,54 @@
 Processa emails enviados para registardespesa@ennova.pt:
 - Assunto: centro de custo (ex: "001" ou "054 - Estoril 124")
 - Anexo: foto da fatura/recibo
+- Lê só o assunto e a estrutura de cada email (ENVELOPE + BODYSTRUCTURE) e descarrega apenas
+  os anexos de imagem/PDF (BODY.PEEK[parte]); ver utils/imap_anexos.py
 - Faz OCR, extrai dados, grava em custos_linhas.xlsx
+- Retoma pelo UID: ponto de retoma em dados/email_checkpoint.json e diário por email/anexo
+  na base de documentos (ver utils/ingestao_email.py); não depende da flag \\Seen
 - Opcional: executa exportar_custos_por_obra para gerar Excel por obra
 
+Uso:
+  python3 custos/processar_email_despesas.py            # uma passagem (cron)
+  python3 custos/processar_email_despesas.py --daemon   # ligação permanente com IMAP IDLE
+
 Variáveis de ambiente:
   EMAIL_IMAP_HOST=ennova.pt
   EMAIL_IMAP_PORT=993
   EMAIL_USER=registardespesa@ennova.pt
   EMAIL_PASSWORD=...
+  EMAIL_IMAP_SSL=1          (0: IMAP sem TLS, ex: servidor local de testes)
+  EMAIL_IDLE_SEGUNDOS=1500  EMAIL_POLL_SEGUNDOS=60   (modo --daemon)
   GESTAO_BASE_PATH=/path/to/GESTAO_EMPRESA
+  OCR_WORKERS=<núcleos>   OCR_TIMEOUT=120   (ver utils/ocr.py)
+  EMAIL_WORKERS=<OCR_WORKERS>   EMAIL_FILA=<2 x EMAIL_WORKERS>   (pipeline descarga -> OCR -> escrita)
+  EMAIL_LOTE=50             (emails por escrita em custos_registo)
+  EMAIL_MAX_TENTATIVAS=3    (passagens por um email com anexos que falham antes de desistir)
+  EMAIL_FACTURA_XLSX=1      (0: facturas_extraidas só em JSON, sem o .xlsx por factura)
 """
-import email
 import imaplib
 import os
+import queue
 import re
 import sys
-from email.header import decode_header
+import threading
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
-from utils.taxas_iva import parse_taxa_iva
+from utils import (
+    cache_documentos,
+    cache_excel,
+    diario_custos,
+    duplicados_facturas,
+    escrita_excel,
+    imap_anexos,
+    ingestao_email,
+    ocr,
+    rollup_custos,
+    tabela_pdf,
+)
 
 BASE_PATH = Path(os.getenv("GESTAO_BASE_PATH", "/home/bailan/empresa-gestao/GESTAO_EMPRESA"))
 DADOS_PATH = BASE_PATH / "03_CONTABILIDADE_ANALITICA" / "dados"
@@ -31,17 +59,18 @@ CUSTOS_LINHAS = DADOS_PATH / "custos_linhas.xlsx"
 CUSTOS_REGISTO = DADOS_PATH / "custos_registo.xlsx"
 UPLOADS_PATH = DADOS_PATH / "uploads"
 UPLOADS_PATH.mkdir(parents=True, exist_ok=True)
+FACTURAS_EXTRAIDAS = DADOS_PATH / "facturas_extraidas"
+DOCUMENTOS = cache_documentos.CacheDocumentos(DADOS_PATH / cache_documentos.NOME_DB)
+INDICE_DUPLICADOS = duplicados_facturas.IndiceDuplicados(
+    DADOS_PATH / cache_documentos.NOME_DB, FACTURAS_EXTRAIDAS, CUSTOS_REGISTO
+)
+REGISTO_INGESTAO = ingestao_email.RegistoIngestao(
+    DADOS_PATH / cache_documentos.NOME_DB, DADOS_PATH / ingestao_email.NOME_CHECKPOINT
+)
 
 try:
-    import pytesseract
-    from PIL import Image
-    OCR_AVAILABLE = True
-except ImportError:
-    OCR_AVAILABLE = False
-
-try:
-    from openpyxl import Workbook, load_workbook
-    from openpyxl.styles import Font, PatternFill
+    import openpyxl  # noqa: F401
+    from utils.leitor_excel import ler_cabecalho, ler_linhas, nomes_folhas
     XL_AVAILABLE = True
 except ImportError:
     XL_AVAILABLE = False
@@ -50,26 +79,16 @@ except ImportError:
 IMAGE_EXT = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tiff"}
 PDF_EXT = {".pdf"}
 ANEXO_EXT = IMAGE_EXT | PDF_EXT
-
-try:
-    import fitz  # PyMuPDF
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
-
-
-def _decode_header_value(header_val):
-    if header_val is None:
-        return ""
-    if isinstance(header_val, str):
-        return header_val.strip()
-    parts = []
-    for part, charset in decode_header(header_val):
-        if isinstance(part, bytes):
-            parts.append(part.decode(charset or "utf-8", errors="replace"))
-        else:
-            parts.append(str(part))
-    return " ".join(parts).strip()
+# Modo --daemon: IDLE renovado antes dos 29 min do RFC 2177; NOOP se o servidor não tiver IDLE
+EMAIL_IDLE_SEGUNDOS = float(os.getenv("EMAIL_IDLE_SEGUNDOS", "1500"))
+EMAIL_POLL_SEGUNDOS = float(os.getenv("EMAIL_POLL_SEGUNDOS", "60"))
+# Pipeline: threads de OCR/extração e emails em espera em cada fila
+EMAIL_WORKERS = max(1, int(os.getenv("EMAIL_WORKERS", str(max(1, ocr.OCR_WORKERS)))))
+EMAIL_FILA = max(1, int(os.getenv("EMAIL_FILA", str(2 * EMAIL_WORKERS))))
+# Emails gravados de uma vez pelo escritor (uma entrada no diário de custos_registo por lote)
+EMAIL_LOTE = max(1, int(os.getenv("EMAIL_LOTE", "50")))
+# Passagens por um email com anexos que falham antes de desistir dele (estado "erro")
+EMAIL_MAX_TENTATIVAS = max(1, int(os.getenv("EMAIL_MAX_TENTATIVAS", "3")))
 
 
 def _extrair_centro_assunto(assunto: str, centros_validos: set[str]) -> str | None:
@@ -125,105 +144,44 @@ def _carregar_centros_validos() -> set[str]:
     if not path.exists() or not XL_AVAILABLE:
         return set()
     try:
-        wb = load_workbook(path, data_only=True)
-        for ws in wb.worksheets:
-            idx = next((i for i, c in enumerate(ws[1], 1) if c.value == "centro_custo_codigo"), None)
-            if idx:
-                return {str(ws.cell(r, idx).value).strip() for r in range(2, ws.max_row + 1) if ws.cell(r, idx).value}
+        for folha in nomes_folhas(path):
+            if "centro_custo_codigo" in ler_cabecalho(path, folha):
+                return {
+                    str(r["centro_custo_codigo"]).strip()
+                    for r in ler_linhas(path, colunas=["centro_custo_codigo"], folha=folha)
+                    if r["centro_custo_codigo"]
+                }
         return set()
     except Exception:
         return set()
 
 
 def _ocr_image(img_path: Path) -> str:
-    if not OCR_AVAILABLE:
-        return ""
-    try:
-        img = Image.open(img_path)
-        if img.mode != "RGB":
-            img = img.convert("RGB")
-        return pytesseract.image_to_string(img, lang="por+eng")
-    except Exception as e:
-        return f"[OCR erro: {e}]"
+    return ocr.ocr_imagem(img_path)
 
 
 def _extrair_texto_pdf(pdf_path: Path) -> str:
     """
-    Extrai texto do PDF: primeiro tenta texto embutido (PDF digital).
-    Se pouco texto, converte páginas a imagem e faz OCR (PDF digitalizado).
+    Extrai texto do PDF página a página: texto embutido nas páginas digitais,
+    OCR em paralelo só das páginas digitalizadas.
     """
-    if not PDF_AVAILABLE:
-        return ""
-    try:
-        doc = fitz.open(pdf_path)
-        texto = ""
-        for i in range(len(doc)):
-            texto += doc[i].get_text()
-        doc.close()
-        # Se tem texto suficiente, usar direto
-        if len(texto.strip()) >= 50:
-            return texto
-        # PDF digitalizado: converter páginas a imagem e OCR
-        if not OCR_AVAILABLE:
-            return texto or "[PDF sem texto embutido; instale pytesseract para OCR]"
-        doc = fitz.open(pdf_path)
-        partes = []
-        for i in range(len(doc)):
-            page = doc[i]
-            pix = page.get_pixmap(dpi=150)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            partes.append(pytesseract.image_to_string(img, lang="por+eng"))
-        doc.close()
-        return "\n".join(partes)
-    except Exception as e:
-        return f"[PDF erro: {e}]"
+    return ocr.texto_pdf(pdf_path)
 
 
 def _extrair_dados_ocr(texto: str) -> dict:
-    out = {"supplier": "", "date": "", "net_amount": None, "tax_pct": None, "description": ""}
-    lines = [l.strip() for l in texto.splitlines() if l.strip()]
-    for line in lines:
-        m = re.search(r"(\d{1,2})[-/](\d{1,2})[-/](\d{2,4})", line)
-        if m and not out["date"]:
-            d, mo, y = m.groups()
-            out["date"] = f"20{y[-2:]}-{mo.zfill(2)}-{d.zfill(2)}" if len(y) == 2 else f"{y}-{mo.zfill(2)}-{d.zfill(2)}"
-        for p in [r"total[:\s]*(\d+[,.]\d{2})", r"(\d+[,.]\d{2})\s*€", r"iva[:\s]*(\d+[,.]?\d*)%?"]:
-            m = re.search(p, line.lower())
-            if m:
-                v = m.group(1).replace(",", ".")
-                try:
-                    n = float(v)
-                    if "iva" in line.lower() or "%" in line:
-                        out["tax_pct"] = parse_taxa_iva(v)
-                    elif out["net_amount"] is None and n > 0:
-                        out["net_amount"] = n
-                except ValueError:
-                    pass
-    if lines and not out["supplier"]:
-        out["supplier"] = lines[0][:100]
-    return out
+    """Fornecedor, data, valor e IVA do texto OCR (mesmo motor que extrair_factura)."""
+    from custos.extrair_factura import extrair_dados_despesa
+    return extrair_dados_despesa(texto)
 
 
 def _append_custo(centro: str, dados: dict, origem: str = "email") -> None:
+    """Acrescenta a despesa ao diário de custos_linhas (compactado para o .xlsx mais tarde)."""
     if not XL_AVAILABLE:
         return
-    if not CUSTOS_LINHAS.exists():
-        DADOS_PATH.mkdir(parents=True, exist_ok=True)
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "custos_linhas"
-        headers = ["line_id", "document_id", "document_no", "date", "supplier", "description",
-                   "quantity", "unit_price", "net_amount", "tax_pct", "tipo_linha", "centro_custo_codigo"]
-        for c, h in enumerate(headers, 1):
-            cell = ws.cell(1, c, h)
-            cell.fill = PatternFill("solid", fgColor="1F2937")
-            cell.font = Font(bold=True, color="FFFFFF")
-        wb.save(CUSTOS_LINHAS)
-    wb = load_workbook(CUSTOS_LINHAS)
-    ws = wb.active
-    next_row = ws.max_row + 1
-    row_data = {
-        "line_id": f"email_{next_row}",
+    DADOS_PATH.mkdir(parents=True, exist_ok=True)
+    n = escrita_excel.proximo_id(CUSTOS_LINHAS, lambda: diario_custos.ler_linhas(CUSTOS_LINHAS))
+    diario_custos.acrescentar(CUSTOS_LINHAS, [{
+        "line_id": f"email_{n}",
         "document_id": "",
         "document_no": origem,
         "date": dados.get("date"),
@@ -235,12 +193,7 @@ def _append_custo(centro: str, dados: dict, origem: str = "email") -> None:
         "tax_pct": dados.get("tax_pct"),
         "tipo_linha": "materiais",
         "centro_custo_codigo": centro,
-    }
-    headers = [c.value for c in ws[1]]
-    for col, h in enumerate(headers, 1):
-        if h in row_data:
-            ws.cell(row=next_row, column=col, value=row_data[h])
-    wb.save(CUSTOS_LINHAS)
+    }])
 
 
 CUSTOS_REGISTO_COLUNAS = [
@@ -250,23 +203,34 @@ CUSTOS_REGISTO_COLUNAS = [
 ]
 
 
-def _append_factura_to_custos_registo(factura, centro: str, base_name: str) -> None:
-    """Insere linhas da factura extraída em custos_registo.xlsx."""
-    if not XL_AVAILABLE:
-        return
+def _ler_classificacao(path: Path, coluna: str) -> list[tuple[str, str]]:
+    """Pares (chave, tipo) em minúsculas de um CSV de classificação (coluna = fornecedor/keyword)."""
     import csv
-    fornecedores, keywords = [], []
-    for path, kc, tc in [
-        (CONFIG_PATH / "classificacao_fornecedores.csv", "fornecedor", "tipo"),
-        (CONFIG_PATH / "classificacao_keywords.csv", "keyword", "tipo"),
-    ]:
-        if path.exists():
-            with open(path, encoding="utf-8") as f:
-                for row in csv.DictReader(f):
-                    k = (row.get(kc) or "").strip().lower()
-                    v = (row.get(tc) or "").strip().lower()
-                    if k and v:
-                        (fornecedores if kc == "fornecedor" else keywords).append((k, v))
+    out = []
+    if path.exists():
+        with open(path, encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                k = (row.get(coluna) or "").strip().lower()
+                v = (row.get("tipo") or "").strip().lower()
+                if k and v:
+                    out.append((k, v))
+    return out
+
+
+def _classificacao() -> tuple[list, list]:
+    """(fornecedores, keywords) dos CSVs de config, relidos só quando mudam (utils/cache_excel)."""
+    return tuple(
+        cache_excel.CACHE.obter(path, lambda p, c=coluna: _ler_classificacao(p, c), tipo="classificacao")
+        for path, coluna in (
+            (CONFIG_PATH / "classificacao_fornecedores.csv", "fornecedor"),
+            (CONFIG_PATH / "classificacao_keywords.csv", "keyword"),
+        )
+    )
+
+
+def _linhas_custos_registo(factura, centro: str, base_name: str) -> list[dict]:
+    """Linhas de custos_registo de uma factura extraída (tipo pelos CSVs de classificação)."""
+    fornecedores, keywords = _classificacao()
     sup = (factura.fornecedor.nome or "").lower()
     def _tipo(desc):
         desc = (desc or "").lower()
@@ -278,23 +242,11 @@ def _append_factura_to_custos_registo(factura, centro: str, base_name: str) -> N
                 return t
         return "materiais"
 
-    DADOS_PATH.mkdir(parents=True, exist_ok=True)
-    if not CUSTOS_REGISTO.exists():
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "custos_registo"
-        for c, h in enumerate(CUSTOS_REGISTO_COLUNAS, 1):
-            cell = ws.cell(1, c, h)
-            cell.fill = PatternFill("solid", fgColor="1F2937")
-            cell.font = Font(bold=True, color="FFFFFF")
-        wb.save(CUSTOS_REGISTO)
-    wb = load_workbook(CUSTOS_REGISTO)
-    ws = wb.active
     doc_no = factura.documento.numero
     doc_date = factura.documento.data
     fornecedor = factura.fornecedor.nome
+    novas = []
     for i, ln in enumerate(factura.linhas):
-        row = ws.max_row + 1
         tipo = _tipo(ln.designacao)
         line_id = f"email_{base_name}_{i+1}"
         vals = [
@@ -302,107 +254,439 @@ def _append_factura_to_custos_registo(factura, centro: str, base_name: str) -> N
             ln.quantidade, ln.preco_unitario, ln.valor_liquido, ln.iva_pct,
             tipo, centro, "", "email",
         ]
-        for col, v in enumerate(vals, 1):
-            ws.cell(row, col, value=v)
-    wb.save(CUSTOS_REGISTO)
+        novas.append(dict(zip(CUSTOS_REGISTO_COLUNAS, vals)))
+    return novas
 
 
-def processar_email() -> int:
+def _gravar_custos_registo(novas: list[dict]) -> None:
+    """Uma só escrita no diário de custos_registo (e no agregado por obra) para todas as linhas."""
+    if not XL_AVAILABLE or not novas:
+        return
+    DADOS_PATH.mkdir(parents=True, exist_ok=True)
+    with escrita_excel.escritor(CUSTOS_REGISTO):
+        assinatura_anterior = diario_custos.assinatura(CUSTOS_REGISTO)
+        diario_custos.acrescentar(CUSTOS_REGISTO, novas)
+        # Atualiza o agregado por obra sem recalcular o registo inteiro
+        rollup_custos.adicionar(CUSTOS_REGISTO, novas, assinatura_anterior)
+
+
+@dataclass
+class AnexoExtraido:
+    """Resultado da etapa de OCR/extração de um anexo, à espera do escritor."""
+    nome: str
+    centro: str
+    sha: str
+    caminho: Path
+    texto: str
+    factura: object  # custos.extrair_factura.Factura
+    ficheiro_extraido: str  # já gravado em facturas_extraidas (cache), ou ""
+
+
+def _duplicado_conteudo(fname: str, sha: str) -> bool:
+    """Mesmo conteúdo já registado (pela app ou noutro email): avisa e devolve True."""
+    anterior = DOCUMENTOS.registado(sha)
+    if anterior is None:
+        return False
+    DOCUMENTOS.contar_repeticao(sha)
+    print(
+        f"  ⚠️ Duplicado provável (não gravado): {fname} já registado em "
+        f"{anterior['registado_em']} ({anterior['origem']}, centro {anterior['centro_custo_codigo']})"
+    )
+    return True
+
+
+def _analisar_anexo(fname: str, payload: bytes, centro: str) -> Optional[AnexoExtraido]:
     """
-    Conecta ao IMAP, processa emails não lidos, extrai anexos de imagem,
-    faz OCR e grava em custos_linhas. Marca emails como lidos.
-    Retorna o número de despesas processadas.
+    Etapa de CPU: guarda o anexo em uploads, OCR/texto e extração da factura (com cache por SHA-256).
+    Não escreve em facturas_extraidas nem em custos_registo. None se o conteúdo já estava registado.
     """
+    from custos.extrair_factura import extrair_factura, factura_de_dict
+
+    ext = Path(fname).suffix.lower()
+    sha = cache_documentos.sha256_bytes(payload)
+    if _duplicado_conteudo(fname, sha):
+        return None
+
+    save_path = DOCUMENTOS.ficheiro(sha)
+    if save_path is None:
+        save_path = UPLOADS_PATH / f"email_{os.urandom(6).hex()}{ext}"
+        save_path.write_bytes(payload)
+        DOCUMENTOS.guardar_ficheiro(sha, save_path)
+
+    doc = DOCUMENTOS.obter(sha)
+    if doc and doc["texto"]:
+        texto = doc["texto"]
+    else:
+        if ext in IMAGE_EXT:
+            texto = _ocr_image(save_path)
+        elif ext in PDF_EXT:
+            texto = _extrair_texto_pdf(save_path)
+        else:
+            texto = ""
+        DOCUMENTOS.guardar_texto(sha, texto)
+
+    extracao = doc["extracao"] if doc else None
+    if extracao and extracao.get("factura"):
+        factura = factura_de_dict(extracao["factura"])
+    else:
+        # PDF digital: produtos lidos da tabela pelas coordenadas das palavras
+        linhas = tabela_pdf.linhas_pdf(save_path) if ext in PDF_EXT else None
+        factura = extrair_factura(texto, origem=f"email:{fname}|centro:{centro}", linhas=linhas)
+        if cache_documentos.texto_valido(texto):
+            DOCUMENTOS.guardar_extracao(
+                sha, {"dados": _extrair_dados_ocr(texto), "factura": factura.to_dict()}
+            )
+
+    return AnexoExtraido(
+        nome=fname, centro=centro, sha=sha, caminho=save_path, texto=texto, factura=factura,
+        ficheiro_extraido=(doc["ficheiro_extraido"] or "") if doc else "",
+    )
+
+
+class LoteRegisto:
+    """
+    Anexos de um lote de emails gravados de uma vez (etapa de escrita). gravar(): primeiro
+    os .json em facturas_extraidas, depois uma só entrada no diário de custos_registo para todas
+    as linhas; confirmar() (logo a seguir, na mesma transação que o diário de ingestão): anexos
+    registados e índice de duplicados. O .xlsx de cada factura (EMAIL_FACTURA_XLSX) fica para
+    artefactos(), fora do caminho crítico: depois de os emails do lote seguirem para ser marcados
+    como lidos.
+
+    Se a execução parar entre o diário e a confirmação, o anexo fica com o .json registado mas
+    não como registado: na tentativa seguinte reutiliza o mesmo nome (e os mesmos line_id) e as
+    linhas que já estão em custos_registo não são acrescentadas outra vez.
+    """
+
+    def __init__(self):
+        self.anexos: list[tuple[AnexoExtraido, str]] = []  # (anexo, base_name)
+        self.linhas: list[dict] = []
+        self._chaves: dict[str, str] = {}  # chave de duplicado -> anexo do lote que a tem
+        self._shas: set[str] = set()
+        self._xlsx: list[tuple] = []  # (sha, factura, path)
+
+    def acrescentar(self, anexo: AnexoExtraido) -> bool:
+        """Junta o anexo ao lote; False se for duplicado (já registado ou repetido no próprio lote)."""
+        fname, factura = anexo.nome, anexo.factura
+        # Outra vez aqui: duas cópias do mesmo conteúdo podem ter sido analisadas em paralelo
+        if anexo.sha in self._shas:
+            print(f"  ⚠️ Duplicado provável (não gravado): {fname} (mesmo conteúdo no mesmo lote)")
+            return False
+        if _duplicado_conteudo(fname, anexo.sha):
+            return False
+
+        # Mesma fatura já gravada com outro conteúdo (ex: foto na app e PDF por email)
+        dados = factura.to_dict()
+        igual = INDICE_DUPLICADOS.procurar(dados)
+        if igual is not None:
+            print(
+                f"  ⚠️ Duplicado provável (não gravado): {fname} = {igual['fonte']}:{igual['ref']} "
+                f"({igual['criterio']}: {igual['numero']} {igual['data']} {igual['total']})"
+            )
+            return False
+        chaves = [c for c, _ in duplicados_facturas.chaves(dados)]
+        repetido = next((self._chaves[c] for c in chaves if c in self._chaves), None)
+        if repetido is not None:
+            print(f"  ⚠️ Duplicado provável (não gravado): {fname} = {repetido} (no mesmo lote)")
+            return False
+
+        if anexo.ficheiro_extraido:
+            base_name = Path(anexo.ficheiro_extraido).stem
+        else:
+            base_name = anexo.caminho.stem
+        self.anexos.append((anexo, base_name))
+        self.linhas.extend(_linhas_custos_registo(factura, anexo.centro, base_name))
+        self._shas.add(anexo.sha)
+        self._chaves.update((c, fname) for c in chaves)
+        return True
+
+    def gravar(self) -> int:
+        """Grava os .json e as linhas do lote em custos_registo; devolve o número de anexos gravados."""
+        from custos.extrair_factura import guardar_factura_json
+
+        novos = [(anexo, base_name) for anexo, base_name in self.anexos if not anexo.ficheiro_extraido]
+        if novos:
+            FACTURAS_EXTRAIDAS.mkdir(parents=True, exist_ok=True)
+            for anexo, base_name in novos:
+                guardar_factura_json(anexo.factura, FACTURAS_EXTRAIDAS / f"{base_name}.json")
+            # A partir daqui uma nova tentativa reutiliza estes nomes (e os line_id das linhas)
+            with cache_documentos.transacao(DOCUMENTOS.db_path):
+                for anexo, base_name in novos:
+                    DOCUMENTOS.guardar_ficheiro_extraido(anexo.sha, f"{base_name}.json")
+
+        linhas = self.linhas
+        if XL_AVAILABLE and len(novos) < len(self.anexos):
+            # Anexos de uma tentativa interrompida depois do diário: não repetir as linhas
+            existentes = {r.get("line_id") for r in diario_custos.ler_linhas(CUSTOS_REGISTO)}
+            linhas = [r for r in linhas if r["line_id"] not in existentes]
+        # Inserir linhas em custos_registo (todas as do lote numa escrita)
+        _gravar_custos_registo(linhas)
+
+        # Opcional: append a custos_linhas (legado)
+        if os.getenv("APPEND_CUSTOS", "0") == "1":
+            for anexo, _ in self.anexos:
+                factura = anexo.factura
+                dados = _extrair_dados_ocr(anexo.texto)
+                dados["description"] = factura.documento.numero or anexo.nome
+                dados["supplier"] = factura.fornecedor.nome or dados.get("supplier")
+                dados["date"] = factura.documento.data or dados.get("date")
+                dados["net_amount"] = factura.totais.valor_liquido or factura.totais.total_documento
+                dados["tax_pct"] = factura.linhas[0].iva_pct if factura.linhas else dados.get("tax_pct")
+                _append_custo(anexo.centro, dados, origem=f"email:{anexo.nome}")
+        return len(self.anexos)
+
+    def confirmar(self) -> None:
+        """Anexos registados e no índice de duplicados (quem chama abre a transação, ver _etapa_escrita)."""
+        xlsx = os.getenv("EMAIL_FACTURA_XLSX", "1") != "0"
+        for anexo, base_name in self.anexos:
+            INDICE_DUPLICADOS.registar(anexo.factura.to_dict(), base_name, anexo.centro)
+            DOCUMENTOS.marcar_registado(anexo.sha, f"email:{anexo.nome}", anexo.centro)
+            if xlsx and not anexo.ficheiro_extraido.endswith(".xlsx"):
+                self._xlsx.append((anexo.sha, anexo.factura, FACTURAS_EXTRAIDAS / f"{base_name}.xlsx"))
+            print(f"  ✅ Processado: centro={anexo.centro} | {anexo.nome} -> facturas_extraidas + custos_registo")
+
+    def artefactos(self) -> None:
+        """Excel de cada factura em facturas_extraidas (fora do caminho crítico; erros só avisam)."""
+        from custos.extrair_factura import guardar_factura_excel
+
+        for sha, factura, path in self._xlsx:
+            try:
+                guardar_factura_excel(factura, path)
+            except Exception as e:
+                print(f"  Aviso: {path.name}: {e}")
+                continue
+            DOCUMENTOS.guardar_ficheiro_extraido(sha, path.name)
+        self._xlsx = []
+
+
+def _ligar() -> imaplib.IMAP4:
+    """Ligação autenticada à INBOX (EMAIL_IMAP_SSL=0: IMAP sem TLS, ex: servidor local de testes)."""
     host = os.getenv("EMAIL_IMAP_HOST", "ennova.pt")
     port = int(os.getenv("EMAIL_IMAP_PORT", "993"))
     user = os.getenv("EMAIL_USER", "registardespesa@ennova.pt")
     password = os.getenv("EMAIL_PASSWORD", "")
-    if not password:
-        print("AVISO: EMAIL_PASSWORD não definido. Use variável de ambiente.")
-        return 0
+    if os.getenv("EMAIL_IMAP_SSL", "1") == "0":
+        mail = imaplib.IMAP4(host, port)
+    else:
+        mail = imaplib.IMAP4_SSL(host, port)
+    mail.login(user, password)
+    mail.select("INBOX")
+    return mail
 
-    centros = _carregar_centros_validos()
-    processados = 0
 
+def _etapa_extracao(fila_entrada: queue.Queue, fila_escrita: queue.Queue) -> None:
+    """
+    Worker de OCR/extração: (uid, centro, [(parte, nome, bytes)]) -> (uid, [(parte, nome, AnexoExtraido
+    ou None se o conteúdo já estava registado)], falhas). Um anexo que falha não impede os outros.
+    """
+    while True:
+        item = fila_entrada.get()
+        if item is None:
+            return
+        uid, centro, anexos = item
+        resultados, falhas = [], 0
+        for parte, nome, dados in anexos:
+            try:
+                resultados.append((parte, nome, _analisar_anexo(nome, dados, centro)))
+            except Exception as e:
+                print(f"  ❌ Erro a extrair {nome} (email {uid}): {e}")
+                falhas += 1
+        fila_escrita.put((uid, resultados, falhas))
+
+
+def _etapa_escrita(
+    fila_escrita: queue.Queue, lidos: queue.Queue, total: list[int], uidvalidity: int
+) -> None:
+    """
+    Escritor único. Junta num LoteRegisto os emails da execução (até EMAIL_LOTE), grava-os
+    de uma vez, regista cada anexo no diário de ingestão e só então entrega os emails completos
+    em lidos (a thread IMAP marca \\Seen e avança o ponto de retoma). Se a execução parar a
+    meio, o texto e a extração dos anexos já estão na cache de documentos: repetir o lote não
+    repete o OCR.
+    """
+    fim = False
+    while not fim:
+        itens = []
+        while len(itens) < EMAIL_LOTE:
+            item = fila_escrita.get()
+            if item is None:
+                fim = True
+                break
+            itens.append(item)
+
+        lote = LoteRegisto()
+        estados = []  # (uid, [(parte, nome, sha, estado)], falhas)
+        try:
+            for uid, resultados, falhas in itens:
+                partes = []
+                for parte, nome, anexo in resultados:
+                    gravado = anexo is not None and lote.acrescentar(anexo)
+                    partes.append((parte, nome, anexo.sha if anexo else "", "gravado" if gravado else "duplicado"))
+                estados.append((uid, partes, falhas))
+            n = lote.gravar()
+            # Logo a seguir ao diário e de uma vez: registados, índice de duplicados e diário de ingestão
+            with cache_documentos.transacao(
+                DOCUMENTOS.db_path, duplicados_facturas.ESQUEMA, ingestao_email.ESQUEMA
+            ):
+                lote.confirmar()
+                for uid, partes, falhas in estados:
+                    REGISTO_INGESTAO.marcar_anexos(uidvalidity, uid, partes)
+                    # Com falhas fica por concluir: na próxima execução só os anexos que falharam
+                    REGISTO_INGESTAO.marcar_email(uidvalidity, uid, "incompleto" if falhas else "concluido")
+            total[0] += n
+        except Exception as e:
+            print(f"  ❌ Erro a gravar emails {', '.join(str(i[0]) for i in itens)}: {e}")
+            continue
+        for uid, _, falhas in estados:
+            if not falhas:
+                lidos.put(uid)
+        lote.artefactos()
+
+
+def _marcar_lidos(mail: imaplib.IMAP4, lidos: queue.Queue) -> list[int]:
+    """Marca \\Seen os emails já gravados pelo escritor (só a thread IMAP usa a ligação). Devolve os UIDs."""
+    uids = []
     try:
-        mail = imaplib.IMAP4_SSL(host, port)
-        mail.login(user, password)
-        mail.select("INBOX")
-        typ, data = mail.search(None, "UNSEEN")
-        if typ != "OK" or not data[0]:
-            mail.logout()
-            return 0
-
-        for num in data[0].split():
-            typ, msg_data = mail.fetch(num, "(RFC822)")
-            if typ != "OK":
-                continue
-            raw = msg_data[0][1]
-            msg = email.message_from_bytes(raw)
-            assunto = _decode_header_value(msg.get("Subject", ""))
+        while True:
+            uids.append(lidos.get_nowait())
+    except queue.Empty:
+        pass
+    if uids:
+        mail.uid("STORE", ",".join(map(str, uids)), "+FLAGS", "\\Seen")
+    return uids
+
+
+def _estado_caixa(mail: imaplib.IMAP4) -> tuple[int, int]:
+    """
+    (UIDVALIDITY, UIDNEXT) da INBOX, das respostas ao SELECT (STATUS não deve ser usado na
+    caixa selecionada). Numa ligação longa o UIDNEXT pode estar desatualizado: só serve de
+    limite inferior para o ponto de retoma.
+    """
+    valores = {}
+    for chave in ("UIDVALIDITY", "UIDNEXT"):
+        data = mail.untagged_responses.get(chave) or [None]
+        try:
+            valores[chave] = int(data[-1])
+        except (TypeError, ValueError):
+            valores[chave] = 0
+    if not valores["UIDVALIDITY"]:
+        raise imaplib.IMAP4.error("SELECT sem UIDVALIDITY")
+    return valores["UIDVALIDITY"], valores["UIDNEXT"]
+
 
-            centro = _extrair_centro_assunto(assunto, centros)
+def _processar_caixa(mail: imaplib.IMAP4, centros: set[str]) -> int:
+    """
+    Processa os emails novos da INBOX já selecionada; devolve o número de despesas gravadas.
+
+    Novos = UID acima do ponto de retoma (UID SEARCH UID n+1:*, utils/ingestao_email); sem ponto
+    de retoma para esta UIDVALIDITY, os não lidos. Emails já concluídos no diário de ingestão são
+    saltados e, dos interrompidos, só se descarregam os anexos que faltam. Um email com anexos
+    que continuam a falhar é desistido ao fim de EMAIL_MAX_TENTATIVAS passagens (estado "erro",
+    fica por ler) e deixa de segurar o ponto de retoma.
+
+    Em pipeline: esta thread descarrega os anexos (e é a única a usar a ligação IMAP),
+    EMAIL_WORKERS threads fazem OCR/extração (o OCR corre no pool de processos de utils/ocr)
+    e um único escritor grava. As filas são limitadas (EMAIL_FILA emails em espera em cada),
+    por isso a memória não cresce com o atraso da caixa. Cada email só é marcado \\Seen (e o
+    ponto de retoma só passa por ele) depois de todos os seus anexos estarem gravados.
+    """
+    # Os EXISTS recebidos até aqui ficam cobertos pela procura abaixo; os seguintes acordam o IDLE
+    imap_anexos.limpar_novidades(mail)
+    uidvalidity, uidnext = _estado_caixa(mail)
+    ultimo = REGISTO_INGESTAO.ultimo_uid(uidvalidity)
+    if ultimo is None:
+        typ, data = mail.uid("SEARCH", None, "UNSEEN")
+        limite = max(0, uidnext - 1)
+    else:
+        typ, data = mail.uid("SEARCH", None, f"UID {ultimo + 1}:*")
+        limite = ultimo
+    uids = [int(u) for u in (data[0] or b"").split()] if typ == "OK" and data else []
+    if ultimo is not None:
+        uids = [u for u in uids if u > ultimo]  # n:* devolve sempre o último, mesmo abaixo de n
+    avanco = ingestao_email.AvancoUIDs(uids, max([limite, *uids]))
+    feitos = REGISTO_INGESTAO.feitos(uidvalidity, uids)
+    avanco.feito(feitos)
+    por_fazer = [str(u).encode() for u in uids if u not in feitos]
+
+    fila_extracao: queue.Queue = queue.Queue(EMAIL_FILA)
+    fila_escrita: queue.Queue = queue.Queue(EMAIL_FILA)
+    lidos: queue.Queue = queue.Queue()
+    total = [0]
+    extratores = [
+        threading.Thread(target=_etapa_extracao, args=(fila_extracao, fila_escrita), name=f"extracao-{i}", daemon=True)
+        for i in range(EMAIL_WORKERS)
+    ]
+    escritor = threading.Thread(
+        target=_etapa_escrita, args=(fila_escrita, lidos, total, uidvalidity), name="escritor", daemon=True
+    )
+    for t in extratores + [escritor]:
+        t.start()
+
+    gravado = [ultimo]
+
+    def _concluidos(uids_feitos) -> None:
+        avanco.feito(uids_feitos)
+        if avanco.ponto() != gravado[0]:
+            gravado[0] = avanco.ponto()
+            REGISTO_INGESTAO.guardar_ponto(uidvalidity, gravado[0])
+
+    try:
+        # Assunto e estrutura de todas as mensagens num só pedido; o corpo só das que interessam
+        for msg in imap_anexos.mensagens(mail, por_fazer, ANEXO_EXT):
+            _concluidos(_marcar_lidos(mail, lidos))
+            centro = _extrair_centro_assunto(msg.assunto, centros)
             if not centro:
-                print(f"  Ignorado (assunto sem centro válido): {assunto[:60]}")
+                # Fica por ler (ninguém o tratou); o ponto de retoma e o diário não o repetem
+                print(f"  Ignorado (assunto sem centro válido): {msg.assunto[:60]}")
+                REGISTO_INGESTAO.marcar_email(uidvalidity, msg.uid, "ignorado", msg.assunto)
+                _concluidos([msg.uid])
                 continue
 
-            # Procurar anexos (imagem ou PDF)
-            for part in msg.walk():
-                if part.get_content_maintype() == "multipart":
-                    continue
-                fname = part.get_filename()
-                if not fname:
-                    continue
-                fname = _decode_header_value(fname)
-                ext = Path(fname).suffix.lower()
-                if ext not in ANEXO_EXT:
-                    continue
-
-                payload = part.get_payload(decode=True)
-                if not payload:
-                    continue
-
-                save_path = UPLOADS_PATH / f"email_{os.urandom(6).hex()}{ext}"
-                save_path.write_bytes(payload)
-
-                if ext in IMAGE_EXT:
-                    texto = _ocr_image(save_path)
-                elif ext in PDF_EXT:
-                    texto = _extrair_texto_pdf(save_path)
-                else:
-                    texto = ""
-
-                # Extrair factura completa para ficheiro organizado
-                from custos.extrair_factura import (
-                    extrair_factura,
-                    guardar_factura_json,
-                    guardar_factura_excel,
-                )
-                factura = extrair_factura(texto, origem=f"email:{fname}|centro:{centro}")
-                factura_extras_dir = DADOS_PATH / "facturas_extraidas"
-                factura_extras_dir.mkdir(parents=True, exist_ok=True)
-                base_name = save_path.stem
-                guardar_factura_json(factura, factura_extras_dir / f"{base_name}.json")
-                guardar_factura_excel(factura, factura_extras_dir / f"{base_name}.xlsx")
-
-                # Inserir linhas em custos_registo
-                _append_factura_to_custos_registo(factura, centro, base_name)
-
-                # Opcional: append a custos_linhas (legado)
-                if os.getenv("APPEND_CUSTOS", "0") == "1":
-                    dados = _extrair_dados_ocr(texto)
-                    dados["description"] = factura.documento.numero or fname
-                    dados["supplier"] = factura.fornecedor.nome or dados.get("supplier")
-                    dados["date"] = factura.documento.data or dados.get("date")
-                    dados["net_amount"] = factura.totais.valor_liquido or factura.totais.total_documento
-                    dados["tax_pct"] = factura.linhas[0].iva_pct if factura.linhas else dados.get("tax_pct")
-                    _append_custo(centro, dados, origem=f"email:{fname}")
-
-                processados += 1
-                print(f"  ✅ Processado: centro={centro} | {fname} -> facturas_extraidas + custos_registo")
-
-            mail.store(num, "+FLAGS", "\\Seen")
+            tentativa = REGISTO_INGESTAO.nova_tentativa(uidvalidity, msg.uid, msg.assunto, centro)
+            if tentativa > EMAIL_MAX_TENTATIVAS:
+                # Não segura mais o ponto de retoma; fica por ler na caixa para ser visto à mão
+                print(f"  ❌ Desistido ao fim de {EMAIL_MAX_TENTATIVAS} tentativas: {msg.assunto[:60]} (UID {msg.uid})")
+                REGISTO_INGESTAO.marcar_email(uidvalidity, msg.uid, "erro")
+                _concluidos([msg.uid])
+                continue
+
+            # Só as partes com extensão em ANEXO_EXT ainda não gravadas (BODY.PEEK: lida só depois de processada)
+            feitas = REGISTO_INGESTAO.partes_feitas(uidvalidity, msg.uid)
+            pendentes = [a for a in msg.anexos if a.parte not in feitas]
+            conteudos = imap_anexos.descarregar(mail, msg.uid, pendentes)
+            anexos = [(a.parte, a.nome, conteudos[a.parte]) for a in pendentes if conteudos.get(a.parte)]
+            if not anexos:
+                mail.uid("STORE", str(msg.uid), "+FLAGS", "\\Seen")
+                REGISTO_INGESTAO.marcar_email(uidvalidity, msg.uid, "concluido", msg.assunto, centro)
+                _concluidos([msg.uid])
+                continue
+            fila_extracao.put((msg.uid, centro, anexos))  # espera se a fila estiver cheia
+    finally:
+        # Também com a ligação perdida: o que já foi descarregado é gravado antes de sair
+        for _ in extratores:
+            fila_extracao.put(None)
+        for t in extratores:
+            t.join()
+        fila_escrita.put(None)
+        escritor.join()
+
+    _concluidos(_marcar_lidos(mail, lidos))
+    return total[0]
 
+
+def processar_email() -> int:
+    """
+    Conecta ao IMAP, processa os emails novos (desde o ponto de retoma), descarrega só os anexos de imagem/PDF
+    dos que têm centro no assunto, faz OCR e grava em custos_registo. Marca emails como lidos.
+    Retorna o número de despesas processadas.
+    """
+    if not os.getenv("EMAIL_PASSWORD", ""):
+        print("AVISO: EMAIL_PASSWORD não definido. Use variável de ambiente.")
+        return 0
+
+    processados = 0
+    try:
+        mail = _ligar()
+        processados = _processar_caixa(mail, _carregar_centros_validos())
         mail.logout()
     except imaplib.IMAP4.error as e:
         print(f"Erro IMAP: {e}")
@@ -413,12 +697,8 @@ def processar_email() -> int:
     return processados
 
 
-def main():
-    print("Processar emails de despesas (registardespesa@ennova.pt)...")
-    n = processar_email()
-    print(f"\n✅ {n} despesa(s) processada(s) -> facturas_extraidas + custos_registo.xlsx")
-
-    if n > 0 and os.getenv("EXPORTAR_POR_OBRA", "0") == "1":
+def _exportar_por_obra() -> None:
+    if os.getenv("EXPORTAR_POR_OBRA", "0") == "1":
         print("\nA executar exportar_custos_por_obra...")
         try:
             from custos.exportar_custos_por_obra import main as export_main
@@ -427,5 +707,68 @@ def main():
             print(f"  Aviso: {e}")
 
 
+def daemon(parar: Optional[threading.Event] = None) -> None:
+    """
+    Modo contínuo: mantém uma ligação autenticada e processa cada email quando chega.
+    Espera com IMAP IDLE (renovado a cada EMAIL_IDLE_SEGUNDOS) ou, se o servidor não o
+    suportar, com NOOP a cada EMAIL_POLL_SEGUNDOS. Ligação perdida ou outro erro: volta a
+    ligar com espera crescente (1s, 2s, 4s... até 5 min). parar (testes/serviço) termina o ciclo.
+    """
+    parar = parar or threading.Event()
+    if not os.getenv("EMAIL_PASSWORD", ""):
+        print("AVISO: EMAIL_PASSWORD não definido. Use variável de ambiente.")
+        return
+    espera = 1.0
+    while not parar.is_set():
+        mail = None
+        try:
+            mail = _ligar()
+            idle = "IDLE" in mail.capabilities
+            print(f"Ligado ({'IDLE' if idle else f'NOOP a cada {EMAIL_POLL_SEGUNDOS:.0f}s'})")
+            espera = 1.0
+            while not parar.is_set():
+                n = _processar_caixa(mail, _carregar_centros_validos())
+                if n:
+                    print(f"✅ {n} despesa(s) processada(s)")
+                    _exportar_por_obra()
+                if idle:
+                    imap_anexos.esperar_idle(mail, EMAIL_IDLE_SEGUNDOS)
+                else:
+                    parar.wait(EMAIL_POLL_SEGUNDOS)
+                    mail.noop()
+        except (imaplib.IMAP4.abort, OSError) as e:
+            print(f"⚠️ Ligação IMAP perdida ({e}); nova tentativa em {espera:.0f}s")
+        except imaplib.IMAP4.error as e:
+            print(f"❌ Erro IMAP: {e}; nova tentativa em {espera:.0f}s")
+        except Exception as e:
+            # Um erro inesperado (disco, Excel, base de documentos) não pode parar o serviço
+            print(f"❌ Erro: {e!r}; nova tentativa em {espera:.0f}s")
+        finally:
+            if mail is not None:
+                try:
+                    mail.logout()
+                except Exception:
+                    pass
+        if parar.wait(espera):
+            break
+        espera = min(espera * 2, 300.0)
+
+
+def main():
+    if "--daemon" in sys.argv[1:]:
+        print("Processar emails de despesas (registardespesa@ennova.pt) em modo contínuo...")
+        try:
+            daemon()
+        except KeyboardInterrupt:
+            pass
+        return
+    print("Processar emails de despesas (registardespesa@ennova.pt)...")
+    n = processar_email()
+    print(f"\n✅ {n} despesa(s) processada(s) -> facturas_extraidas + custos_registo.xlsx")
+
+    if n > 0:
+        _exportar_por_obra()
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Reconstrói o índice de faturas repetidas (utils/duplicados_facturas) a partir de
+facturas_extraidas e custos_registo e lista as faturas já gravadas mais de uma vez:
+mesmo fornecedor (NIF ou nome) + número de documento, ou + data + total.
+
+Uso: python3 custos/procurar_duplicados.py [--json]
+"""
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import cache_documentos, duplicados_facturas
+
+BASE_PATH = Path(os.getenv("GESTAO_BASE_PATH", "/home/bailan/empresa-gestao/GESTAO_EMPRESA"))
+DADOS_PATH = BASE_PATH / "03_CONTABILIDADE_ANALITICA" / "dados"
+CUSTOS_REGISTO = DADOS_PATH / "custos_registo.xlsx"
+FACTURAS_EXTRAIDAS = DADOS_PATH / "facturas_extraidas"
+
+
+def main() -> None:
+    indice = duplicados_facturas.IndiceDuplicados(
+        DADOS_PATH / cache_documentos.NOME_DB, FACTURAS_EXTRAIDAS, CUSTOS_REGISTO
+    )
+    n = indice.reconstruir()
+    grupos = indice.duplicados()
+    if "--json" in sys.argv[1:]:
+        print(json.dumps(grupos, ensure_ascii=False, indent=2))
+        return
+    print(f"Indexadas: {n[duplicados_facturas.FONTE_FACTURAS]} fatura(s) extraída(s), "
+          f"{n[duplicados_facturas.FONTE_REGISTO]} documento(s) de custos_registo")
+    for g in grupos:
+        print(f"\n⚠️ {g['criterio']}: {g['chave']}")
+        for d in g["documentos"]:
+            print(f"   {d['fonte']}:{d['ref']} | {d['numero']} | {d['data']} | {d['total']} | centro {d['centro_custo_codigo']}")
+    print(f"\n{len(grupos)} grupo(s) de faturas repetidas")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Cache de documentos recebidos (fotos e anexos) pelo SHA-256 do conteúdo, em SQLite (WAL),
+partilhada pela API e por processar_email_despesas.
+Para cada conteúdo guarda o texto do OCR, o resultado da extração e, depois de gravada
+a despesa, onde e quando foi registada. Um ficheiro com o mesmo conteúdo é respondido
+daqui sem OCR nem extração e assinalado como duplicado provável.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+NOME_DB = "documentos.sqlite3"
+
+_local = threading.local()
+
+
+def sha256_bytes(conteudo: bytes) -> str:
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def texto_valido(texto: str) -> bool:
+    """Mensagens de erro/aviso do OCR ("[OCR erro: ...]", "[PDF erro: ...]") não são guardadas."""
+    t = (texto or "").strip()
+    return bool(t) and not (t.startswith("[") and t.endswith("]") and "\n" not in t)
+
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS documentos (
+    sha256 TEXT PRIMARY KEY, texto TEXT, extracao TEXT, ficheiro TEXT,
+    ficheiro_extraido TEXT, origem TEXT, centro_custo_codigo TEXT,
+    registado_em TEXT, repeticoes INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def ligar(db_path: Path, esquema: str = ESQUEMA) -> sqlite3.Connection:
+    """
+    Ligação por thread à base de documentos (WAL, linhas como sqlite3.Row).
+    esquema (CREATE ... IF NOT EXISTS) corre uma vez por ligação.
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    entrada = conns.get(str(db_path))
+    if entrada is None:
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        entrada = conns[str(db_path)] = (conn, set())
+    conn, esquemas = entrada
+    if esquema not in esquemas:
+        conn.executescript(esquema)
+        esquemas.add(esquema)
+    return conn
+
+
+@contextmanager
+def transacao(db_path: Path, *esquemas: str):
+    """
+    Escritas desta thread na base de documentos (documentos, índice de duplicados, diário de
+    ingestão: todos usam a mesma ligação) numa só transação. esquemas: os das outras tabelas
+    usadas lá dentro, criados antes (executescript faria COMMIT a meio).
+    """
+    for esquema in (ESQUEMA, *esquemas):
+        conn = ligar(db_path, esquema)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+class CacheDocumentos:
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+
+    def _ligar(self) -> sqlite3.Connection:
+        return ligar(self.db_path)
+
+    def obter(self, sha: str) -> Optional[dict]:
+        row = self._ligar().execute("SELECT * FROM documentos WHERE sha256 = ?", (sha,)).fetchone()
+        if row is None:
+            return None
+        doc = dict(row)
+        doc["extracao"] = json.loads(doc["extracao"]) if doc["extracao"] else None
+        return doc
+
+    def _atualizar(self, sha: str, **campos) -> None:
+        colunas = list(campos)
+        self._ligar().execute(
+            f"INSERT INTO documentos (sha256, {', '.join(colunas)}) VALUES (?{', ?' * len(colunas)}) "
+            f"ON CONFLICT(sha256) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in colunas)}",
+            (sha, *campos.values()),
+        )
+
+    def guardar_ficheiro(self, sha: str, ficheiro: Path) -> None:
+        self._atualizar(sha, ficheiro=str(ficheiro))
+
+    def ficheiro(self, sha: str) -> Optional[Path]:
+        """Cópia já guardada deste conteúdo (ex: em uploads), se ainda existir."""
+        doc = self.obter(sha)
+        if doc and doc["ficheiro"] and Path(doc["ficheiro"]).exists():
+            return Path(doc["ficheiro"])
+        return None
+
+    def guardar_texto(self, sha: str, texto: str) -> None:
+        if texto_valido(texto):
+            self._atualizar(sha, texto=texto)
+
+    def guardar_extracao(self, sha: str, extracao: dict) -> None:
+        self._atualizar(sha, extracao=json.dumps(extracao, ensure_ascii=False, default=str))
+
+    def guardar_ficheiro_extraido(self, sha: str, nome: str) -> None:
+        """Ficheiro da factura em facturas_extraidas (não é gravado outra vez para este conteúdo)."""
+        self._atualizar(sha, ficheiro_extraido=nome)
+
+    def marcar_registado(self, sha: str, origem: str, centro: str) -> None:
+        """Depois de a despesa estar gravada: as próximas cópias são duplicados prováveis."""
+        self._atualizar(
+            sha, origem=origem, centro_custo_codigo=centro,
+            registado_em=datetime.now().isoformat(timespec="seconds"),
+        )
+
+    def registado(self, sha: str) -> Optional[dict]:
+        """Documento já registado com este conteúdo, ou None."""
+        doc = self.obter(sha)
+        if doc is None or not doc["registado_em"]:
+            return None
+        return doc
+
+    def contar_repeticao(self, sha: str) -> None:
+        """Mais uma cópia recusada como duplicado deste conteúdo (quem responde o duplicado chama)."""
+        self._ligar().execute("UPDATE documentos SET repeticoes = repeticoes + 1 WHERE sha256 = ?", (sha,))
+
+
+def registo_anterior(doc: dict) -> dict:
+    """Resumo do registo anterior para as respostas/avisos de duplicado."""
+    return {
+        "origem": doc.get("origem"),
+        "centro_custo_codigo": doc.get("centro_custo_codigo"),
+        "registado_em": doc.get("registado_em"),
+        "ficheiro_extraido": doc.get("ficheiro_extraido"),
+    }
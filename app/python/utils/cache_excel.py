@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Cache em memória de ficheiros Excel já interpretados (partilhado pelo processo).
+Cada entrada é identificada pelo caminho + tipo de carregamento e validada pela
+assinatura do ficheiro em disco (mtime, tamanho): só volta a ler quando o ficheiro muda.
+Orçamento de memória limitado (GESTAO_CACHE_MB), com remoção LRU.
+"""
+import os
+import sys
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Iterable, Optional
+
+LIMITE_BYTES_DEFAULT = int(float(os.getenv("GESTAO_CACHE_MB", "256")) * 1024 * 1024)
+
+
+def assinatura_ficheiro(path: Path) -> Optional[tuple[int, int]]:
+    """(mtime_ns, tamanho) do ficheiro ou None se não existir."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def estimar_bytes(valor: Any) -> int:
+    """
+    Estimativa grosseira da memória ocupada por um dataset.
+    Objetos com tamanho_estimado() (ex: stores colunares) dão a sua própria estimativa;
+    listas de dicts/tuplos são amostradas para não percorrer tudo.
+    """
+    if hasattr(valor, "tamanho_estimado"):
+        return int(valor.tamanho_estimado())
+    if isinstance(valor, (list, tuple)):
+        if not valor:
+            return sys.getsizeof(valor)
+        amostra = valor[:: max(1, len(valor) // 50)][:50]
+        media = sum(_bytes_linha(x) for x in amostra) / len(amostra)
+        return int(sys.getsizeof(valor) + media * len(valor))
+    return _bytes_linha(valor)
+
+
+def _bytes_linha(linha: Any) -> int:
+    if isinstance(linha, dict):
+        return sys.getsizeof(linha) + sum(sys.getsizeof(v) for v in linha.values())
+    if isinstance(linha, (list, tuple)):
+        return sys.getsizeof(linha) + sum(sys.getsizeof(v) for v in linha)
+    return sys.getsizeof(linha)
+
+
+class _Entrada:
+    __slots__ = ("assinatura", "valor", "tamanho")
+
+    def __init__(self, assinatura, valor, tamanho: int):
+        self.assinatura = assinatura
+        self.valor = valor
+        self.tamanho = tamanho
+
+
+class CacheDatasets:
+    """Cache LRU de datasets, invalidado pela assinatura dos ficheiros de origem."""
+
+    def __init__(self, limite_bytes: int = LIMITE_BYTES_DEFAULT):
+        self.limite_bytes = limite_bytes
+        self._entradas: "OrderedDict[tuple, _Entrada]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.removidas = 0
+
+    def obter(
+        self,
+        path: Path,
+        carregar: Callable[[Path], Any],
+        tipo: str = "linhas",
+        dependencias: Iterable[Path] = (),
+    ) -> Any:
+        """
+        Devolve o dataset de path já interpretado, chamando carregar(path) só se
+        path (ou alguma dependência) mudou desde a última leitura.
+        """
+        path = Path(path)
+        deps = tuple(Path(d) for d in dependencias)
+        chave = (str(path), tipo)
+        # Assinatura antes de ler: se o ficheiro mudar durante a leitura, a próxima chamada relê
+        assinatura = (assinatura_ficheiro(path),) + tuple(assinatura_ficheiro(d) for d in deps)
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada.assinatura == assinatura:
+                self._entradas.move_to_end(chave)
+                self.hits += 1
+                return entrada.valor
+            self.misses += 1
+        valor = carregar(path)
+        tamanho = estimar_bytes(valor)
+        with self._lock:
+            self._remover(chave)
+            if tamanho <= self.limite_bytes:
+                self._entradas[chave] = _Entrada(assinatura, valor, tamanho)
+                self._bytes += tamanho
+                while self._bytes > self.limite_bytes and self._entradas:
+                    antiga = next(iter(self._entradas))
+                    self._remover(antiga)
+                    self.removidas += 1
+        return valor
+
+    def _remover(self, chave: tuple) -> None:
+        entrada = self._entradas.pop(chave, None)
+        if entrada is not None:
+            self._bytes -= entrada.tamanho
+
+    def invalidar(self, path: Optional[Path] = None) -> None:
+        """Remove as entradas de path (ou todas, se path for None)."""
+        with self._lock:
+            if path is None:
+                self._entradas.clear()
+                self._bytes = 0
+                return
+            for chave in [k for k in self._entradas if k[0] == str(path)]:
+                self._remover(chave)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "limite_bytes": self.limite_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "removidas": self.removidas,
+            }
+
+
+# Instância partilhada pelo processo
+CACHE = CacheDatasets()
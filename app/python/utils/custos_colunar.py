@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Store colunar (NumPy) de custos_registo para filtros vetorizados.
+- date -> ordinal (date.toordinal(); 0 = sem data)
+- net_amount / unit_price -> float64 (mesma conversão que _to_float da API)
+- tipo_linha, centro_custo_codigo, capitulo_orcamento -> categóricos (códigos int32 + dicionário)
+Cada combinação de filtros é uma máscara booleana; as linhas originais só são
+materializadas para os índices selecionados.
+"""
+import re
+from datetime import date, datetime
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+_RE_DATA = re.compile(r"^\s*(\d{4})(?:-(\d{1,2})(?:-(\d{1,2}))?)?")
+
+
+def _to_float(v) -> float:
+    if v is None:
+        return 0.0
+    try:
+        return float(str(v).replace(",", "."))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def data_ordinal(v, fim: bool = False) -> int:
+    """
+    Converte data (date/datetime ou texto yyyy-mm-dd, yyyy-mm, yyyy) em ordinal.
+    Datas parciais valem o primeiro dia do período (ou o último, com fim=True).
+    Devolve 0 se não for possível interpretar.
+    """
+    if isinstance(v, datetime):
+        return v.date().toordinal()
+    if isinstance(v, date):
+        return v.toordinal()
+    m = _RE_DATA.match(str(v or ""))
+    if not m:
+        return 0
+    y, mo, d = m.groups()
+    try:
+        if d:
+            return date(int(y), int(mo), int(d)).toordinal()
+        if mo:
+            if not fim:
+                return date(int(y), int(mo), 1).toordinal()
+            seguinte = date(int(y) + (int(mo) == 12), int(mo) % 12 + 1, 1)
+            return seguinte.toordinal() - 1
+        return date(int(y), 12, 31).toordinal() if fim else date(int(y), 1, 1).toordinal()
+    except ValueError:
+        return 0
+
+
+class Categorica:
+    """Coluna de texto codificada por dicionário (valor normalizado -> código)."""
+
+    __slots__ = ("codigos", "valores", "_indice")
+
+    def __init__(self, valores: Iterable[str]):
+        self._indice: dict[str, int] = {}
+        self.valores: list[str] = []
+        codigos = []
+        for v in valores:
+            c = self._indice.get(v)
+            if c is None:
+                c = self._indice[v] = len(self.valores)
+                self.valores.append(v)
+            codigos.append(c)
+        self.codigos = np.array(codigos, dtype=np.int32)
+
+    def mascara(self, aceites: Iterable[str]) -> np.ndarray:
+        cods = [self._indice[v] for v in aceites if v in self._indice]
+        if not cods:
+            return np.zeros(len(self.codigos), dtype=bool)
+        if len(cods) == 1:
+            return self.codigos == cods[0]
+        return np.isin(self.codigos, cods)
+
+
+class CustosColunar:
+    """Vista colunar imutável sobre as linhas de custos_registo."""
+
+    def __init__(self, linhas: list[dict]):
+        self.linhas = linhas
+        self.data = np.array([data_ordinal(r.get("date")) for r in linhas], dtype=np.int32)
+        self.net_amount = np.array([_to_float(r.get("net_amount")) for r in linhas], dtype=np.float64)
+        self.unit_price = np.array([_to_float(r.get("unit_price")) for r in linhas], dtype=np.float64)
+        self.tipo = Categorica(str(r.get("tipo_linha") or "").strip().lower() for r in linhas)
+        self.centro = Categorica(str(r.get("centro_custo_codigo") or "").strip() for r in linhas)
+        self.capitulo = Categorica(str(r.get("capitulo_orcamento") or "").strip() for r in linhas)
+        # Índices de trigramas (utils/indice_texto) por colunas, na mesma entrada do cache
+        self.indices_texto: dict[tuple, object] = {}
+
+    def __len__(self) -> int:
+        return len(self.linhas)
+
+    def tamanho_estimado(self) -> int:
+        """Memória própria (as linhas são partilhadas com o cache de linhas)."""
+        arrays = (self.data, self.net_amount, self.unit_price,
+                  self.tipo.codigos, self.centro.codigos, self.capitulo.codigos)
+        return sum(a.nbytes for a in arrays) + 64 * (
+            len(self.tipo.valores) + len(self.centro.valores) + len(self.capitulo.valores)
+        ) + sum(i.tamanho_estimado() for i in self.indices_texto.values())
+
+    def mascara(
+        self,
+        tipos: Optional[Iterable[str]] = None,
+        centro: Optional[str] = None,
+        capitulo: Optional[str] = None,
+        data_inicio: Optional[str] = None,
+        data_fim: Optional[str] = None,
+        valor_min: Optional[float] = None,
+        valor_max: Optional[float] = None,
+    ) -> np.ndarray:
+        """Máscara booleana com todos os filtros aplicados (None = sem filtro)."""
+        m = np.ones(len(self.linhas), dtype=bool)
+        if tipos is not None:
+            m &= self.tipo.mascara(tipos)
+        if centro is not None:
+            m &= self.centro.mascara([centro])
+        if capitulo is not None:
+            m &= self.capitulo.mascara([capitulo])
+        if data_inicio:
+            o = data_ordinal(data_inicio)
+            if o:
+                m &= self.data >= o
+        if data_fim:
+            o = data_ordinal(data_fim, fim=True)
+            if o:
+                m &= self.data <= o
+        if valor_min is not None:
+            m &= self.net_amount >= valor_min
+        if valor_max is not None:
+            m &= self.net_amount <= valor_max
+        return m
+
+    def indices(self, mascara: np.ndarray) -> np.ndarray:
+        return np.flatnonzero(mascara)
+
+    def soma(self, indices: np.ndarray, fallback_unit_price: bool = False) -> float:
+        """Soma de net_amount (ou unit_price quando net_amount é 0, se pedido)."""
+        net = self.net_amount[indices]
+        if fallback_unit_price:
+            net = np.where(net != 0, net, self.unit_price[indices])
+        return float(net.sum())
+
+    def linhas_de(self, indices: np.ndarray) -> list[dict]:
+        """Cópias das linhas originais nos índices dados (por ordem)."""
+        linhas = self.linhas
+        return [dict(linhas[i]) for i in indices.tolist()]
+
+
+class ConsultaColunar:
+    """Resultado de uma máscara com a mesma interface de custos_sqlite.ConsultaSQL."""
+
+    def __init__(self, store: CustosColunar, indices: np.ndarray):
+        self.store = store
+        self.idx = indices
+
+    def totais(self, fallback_unit_price: bool = False) -> tuple[int, float]:
+        return len(self.idx), self.store.soma(self.idx, fallback_unit_price=fallback_unit_price)
+
+    def linhas(self, apos: Optional[int] = None, limite: Optional[int] = None) -> Iterator[tuple[int, dict]]:
+        idx = self.idx if apos is None else self.idx[self.idx > apos]
+        if limite is not None:
+            idx = idx[:limite]
+        linhas = self.store.linhas
+        for i in idx.tolist():
+            yield i, dict(linhas[i])
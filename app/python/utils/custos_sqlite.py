@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Espelho SQLite (modo WAL) de custos_registo e custos_linhas para consultas indexadas.
+O Excel continua a ser o formato para pessoas; cada tabela guarda a assinatura do .xlsx
+de origem e do seu diário (utils/diario_custos) e é sincronizada quando esta muda
+(só as linhas a partir da primeira diferença).
+
+Além das colunas originais, cada linha tem colunas derivadas para filtros:
+  _pos (posição no registo), _data (ordinal), _tipo, _centro, _capitulo (normalizados),
+  _valor/_unit (float como _to_float) e _l_<coluna> (texto em minúsculas para q=).
+Índices em _centro, _data, _tipo e supplier.
+
+Uso: python3 app/python/utils/custos_sqlite.py   (sincroniza as duas tabelas)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Sequence
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from utils import diario_custos
+from utils.custos_colunar import _to_float, data_ordinal
+
+NOME_DB = "custos.sqlite3"
+TABELAS = {"custos_registo": "custos_registo.xlsx", "custos_linhas": "custos_linhas.xlsx"}
+COLUNAS_TEXTO = ("supplier", "description", "document_no", "centro_custo_codigo")
+# Muda quando muda a forma de guardar os valores: força a ressincronização das tabelas existentes
+VERSAO_FORMATO = 2
+
+_local = threading.local()
+_sync_lock = threading.Lock()
+
+
+def _q(nome: str) -> str:
+    return '"' + str(nome).replace('"', '""') + '"'
+
+
+def ligar(db_path: Path) -> sqlite3.Connection:
+    """Ligação por thread (WAL: leitores não bloqueiam o escritor nem vice-versa)."""
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(str(db_path))
+    if conn is None:
+        # isolation_level=None: transações explícitas (BEGIN IMMEDIATE) na sincronização
+        conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS _fontes ("
+            "tabela TEXT PRIMARY KEY, fonte TEXT, cabecalho TEXT, n INTEGER)"
+        )
+        conns[str(db_path)] = conn
+    return conn
+
+
+def _hash_linha(valores: Sequence) -> int:
+    return int.from_bytes(hashlib.blake2b(repr(tuple(valores)).encode(), digest_size=8).digest(), "big", signed=True)
+
+
+def _valor_sql(v):
+    if v is None or isinstance(v, (int, float, str, bytes)):
+        return v
+    # datetime/date/time e outros: guardados como texto, no mesmo formato que a API devolvia
+    # ao serializar os datetime do .xlsx (isoformat: "YYYY-MM-DDTHH:MM:SS")
+    return v.isoformat() if hasattr(v, "isoformat") else str(v)
+
+
+def _derivadas(r: dict) -> tuple:
+    return (
+        data_ordinal(r.get("date")),
+        str(r.get("tipo_linha") or "").strip().lower(),
+        str(r.get("centro_custo_codigo") or "").strip(),
+        str(r.get("capitulo_orcamento") or "").strip(),
+        _to_float(r.get("net_amount")),
+        _to_float(r.get("unit_price")),
+    ) + tuple(str(r.get(c)).lower() if r.get(c) else "" for c in COLUNAS_TEXTO)
+
+
+_DERIVADAS = ("_data", "_tipo", "_centro", "_capitulo", "_valor", "_unit") + tuple(f"_l_{c}" for c in COLUNAS_TEXTO)
+
+
+def _criar_tabela(conn: sqlite3.Connection, tabela: str, colunas: list[str]) -> None:
+    conn.execute(f"DROP TABLE IF EXISTS {_q(tabela)}")
+    defs = ["_pos INTEGER PRIMARY KEY", "_h INTEGER"] + [_q(c) for c in colunas] + [
+        "_data INTEGER", "_tipo TEXT", "_centro TEXT", "_capitulo TEXT", "_valor REAL", "_unit REAL",
+    ] + [f"_l_{c} TEXT" for c in COLUNAS_TEXTO]
+    conn.execute(f"CREATE TABLE {_q(tabela)} ({', '.join(defs)})")
+    for nome, cols in (("centro", "_centro, _tipo"), ("data", "_data"), ("tipo", "_tipo")):
+        conn.execute(f"CREATE INDEX {_q(f'ix_{tabela}_{nome}')} ON {_q(tabela)} ({cols})")
+    if "supplier" in colunas:
+        conn.execute(f"CREATE INDEX {_q(f'ix_{tabela}_supplier')} ON {_q(tabela)} (supplier)")
+
+
+def sincronizar(db_path: Path, tabela: str, xlsx_path: Path) -> bool:
+    """
+    Garante que a tabela espelha o .xlsx + diário atuais. Devolve False se não existirem.
+    Se só mudaram (ou foram acrescentadas) linhas no fim, apenas essas são reescritas.
+    """
+    if not diario_custos.existe(xlsx_path):
+        return False
+    conn = ligar(db_path)
+    fonte = json.dumps([VERSAO_FORMATO, diario_custos.assinatura(xlsx_path)])
+    row = conn.execute("SELECT fonte FROM _fontes WHERE tabela = ?", (tabela,)).fetchone()
+    if row and row[0] == fonte:
+        return True
+    with _sync_lock:
+        cabecalho, linhas = diario_custos.ler_tabela_com_diario(xlsx_path)
+        colunas = list(dict.fromkeys(str(h) for h in cabecalho if h))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Outro processo pode ter sincronizado entretanto
+            row = conn.execute("SELECT fonte, cabecalho FROM _fontes WHERE tabela = ?", (tabela,)).fetchone()
+            if row and row[0] == fonte:
+                conn.execute("COMMIT")
+                return True
+            valores = [[_valor_sql(r.get(c)) for c in colunas] for r in (
+                {str(k): v for k, v in r.items()} for r in linhas
+            )]
+            hashes = [_hash_linha(v) for v in valores]
+            k = 0
+            if row and json.loads(row[1] or "[]") == colunas:
+                antigos = [h for (h,) in conn.execute(f"SELECT _h FROM {_q(tabela)} ORDER BY _pos")]
+                limite = min(len(antigos), len(hashes))
+                while k < limite and antigos[k] == hashes[k]:
+                    k += 1
+                conn.execute(f"DELETE FROM {_q(tabela)} WHERE _pos >= ?", (k,))
+            else:
+                _criar_tabela(conn, tabela, colunas)
+            nomes = ["_pos", "_h"] + [_q(c) for c in colunas] + list(_DERIVADAS)
+            sql = f"INSERT INTO {_q(tabela)} ({', '.join(nomes)}) VALUES ({', '.join('?' * len(nomes))})"
+            conn.executemany(sql, (
+                (i, hashes[i], *valores[i], *_derivadas(linhas[i])) for i in range(k, len(linhas))
+            ))
+            conn.execute(
+                "INSERT OR REPLACE INTO _fontes (tabela, fonte, cabecalho, n) VALUES (?, ?, ?, ?)",
+                (tabela, fonte, json.dumps(colunas), len(linhas)),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    return True
+
+
+def colunas_tabela(db_path: Path, tabela: str) -> list[str]:
+    row = ligar(db_path).execute("SELECT cabecalho FROM _fontes WHERE tabela = ?", (tabela,)).fetchone()
+    return json.loads(row[0]) if row else []
+
+
+def _where(
+    tipos: Optional[Iterable[str]] = None,
+    centro: Optional[str] = None,
+    capitulo: Optional[str] = None,
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    valor_min: Optional[float] = None,
+    valor_max: Optional[float] = None,
+    q: Optional[str] = None,
+    text_cols: Sequence[str] = (),
+) -> tuple[list[str], list]:
+    """Cláusulas WHERE parametrizadas equivalentes a CustosColunar.mascara + pesquisa q."""
+    conds, params = [], []
+    if tipos is not None:
+        tipos = list(tipos)
+        conds.append(f"_tipo IN ({', '.join('?' * len(tipos))})")
+        params.extend(tipos)
+    if centro is not None:
+        conds.append("_centro = ?")
+        params.append(centro)
+    if capitulo is not None:
+        conds.append("_capitulo = ?")
+        params.append(capitulo)
+    if data_inicio:
+        o = data_ordinal(data_inicio)
+        if o:
+            conds.append("_data >= ?")
+            params.append(o)
+    if data_fim:
+        o = data_ordinal(data_fim, fim=True)
+        if o:
+            conds.append("_data <= ?")
+            params.append(o)
+    if valor_min is not None:
+        conds.append("_valor >= ?")
+        params.append(valor_min)
+    if valor_max is not None:
+        conds.append("_valor <= ?")
+        params.append(valor_max)
+    if q:
+        cols = [c for c in text_cols if c in COLUNAS_TEXTO]
+        if cols:
+            conds.append("(" + " OR ".join(f"instr(_l_{c}, ?) > 0" for c in cols) + ")")
+            params.extend([q] * len(cols))
+        else:
+            conds.append("0")
+    return conds, params
+
+
+class ConsultaSQL:
+    """Consulta filtrada sobre uma tabela: totais agregados + linhas por ordem de _pos."""
+
+    def __init__(self, db_path: Path, tabela: str, **filtros):
+        self.db_path = db_path
+        self.tabela = tabela
+        self.colunas = colunas_tabela(db_path, tabela)
+        self._conds, self._params = _where(**filtros)
+
+    def _sql_where(self, extra: Sequence[str] = ()) -> str:
+        conds = list(self._conds) + list(extra)
+        return (" WHERE " + " AND ".join(conds)) if conds else ""
+
+    def totais(self, fallback_unit_price: bool = False) -> tuple[int, float]:
+        """(número de linhas, soma de net_amount — ou unit_price quando net_amount é 0, se pedido)."""
+        expr = "CASE WHEN _valor != 0 THEN _valor ELSE _unit END" if fallback_unit_price else "_valor"
+        n, soma = ligar(self.db_path).execute(
+            f"SELECT count(*), total({expr}) FROM {_q(self.tabela)}{self._sql_where()}", self._params
+        ).fetchone()
+        return n, soma
+
+    def linhas(self, apos: Optional[int] = None, limite: Optional[int] = None, lote: int = 1000) -> Iterator[tuple[int, dict]]:
+        """
+        (posição, linha) depois da posição apos, até limite linhas.
+        Lê em lotes por _pos (keyset), sem manter um cursor aberto entre lotes: o gerador
+        pode ser consumido noutra thread (ex: StreamingResponse).
+        """
+        colunas = self.colunas
+        sql = (
+            f"SELECT _pos, {', '.join(_q(c) for c in colunas) or 'NULL'} FROM {_q(self.tabela)}"
+            + self._sql_where(["_pos > ?"]) + " ORDER BY _pos LIMIT ?"
+        )
+        pos = -1 if apos is None else apos
+        restantes = limite
+        while restantes is None or restantes > 0:
+            n = lote if restantes is None else min(lote, restantes)
+            rows = ligar(self.db_path).execute(sql, [*self._params, pos, n]).fetchall()
+            for row in rows:
+                yield row[0], dict(zip(colunas, row[1:]))
+            if len(rows) < n:
+                return
+            pos = rows[-1][0]
+            if restantes is not None:
+                restantes -= len(rows)
+
+
+def main() -> None:
+    base = Path(os.getenv("GESTAO_BASE_PATH", "/home/bailan/empresa-gestao/GESTAO_EMPRESA"))
+    dados = base / "03_CONTABILIDADE_ANALITICA" / "dados"
+    db = dados / NOME_DB
+    for tabela, ficheiro in TABELAS.items():
+        if sincronizar(db, tabela, dados / ficheiro):
+            n = ligar(db).execute("SELECT n FROM _fontes WHERE tabela = ?", (tabela,)).fetchone()[0]
+            print(f"✅ {tabela}: {n} linhas em {db}")
+        else:
+            print(f"  {tabela}: {ficheiro} não existe")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Diário (JSONL, só acrescentos) das linhas novas de custos_linhas.xlsx e custos_registo.xlsx.
+Registar uma despesa acrescenta uma linha JSON ao diário (O(1), com fsync) em vez de
+reescrever o workbook inteiro. Os leitores juntam o diário às linhas do último .xlsx
+compactado; a compactação (custos/compactar_custos.py) passa o diário para o .xlsx
+e esvazia-o.
+
+O diário de X.xlsx é X.diario.jsonl na mesma pasta. Escritas e compactação são
+serializadas pelo lock de escrita do workbook (utils/escrita_excel), também entre processos.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Iterable, Optional
+
+from utils.cache_excel import assinatura_ficheiro
+from utils.escrita_excel import escritor, guardar_atomico
+from utils.leitor_excel import ler_tabela
+
+SUFIXO = ".diario.jsonl"
+
+# Cabeçalho de custos_linhas.xlsx quando é criado (registo por foto/email)
+COLUNAS_CUSTOS_LINHAS = [
+    "line_id", "document_id", "document_no", "date", "supplier", "description",
+    "quantity", "unit_price", "net_amount", "tax_pct", "tipo_linha", "centro_custo_codigo",
+]
+
+
+def caminho_diario(xlsx_path: Path) -> Path:
+    xlsx_path = Path(xlsx_path)
+    return xlsx_path.with_name(xlsx_path.stem + SUFIXO)
+
+
+def assinatura(xlsx_path: Path) -> list:
+    """Assinatura conjunta (.xlsx, diário): muda quando qualquer um dos dois muda."""
+    a = assinatura_ficheiro(xlsx_path)
+    d = assinatura_ficheiro(caminho_diario(xlsx_path))
+    return [list(a) if a else None, list(d) if d else None]
+
+
+def existe(xlsx_path: Path) -> bool:
+    return Path(xlsx_path).exists() or caminho_diario(xlsx_path).exists()
+
+
+def acrescentar(xlsx_path: Path, linhas: Iterable[dict]) -> None:
+    """
+    Acrescenta linhas ao diário de forma durável (uma única escrita + fsync). Se uma escrita
+    interrompida deixou a última linha a meio, as novas começam numa linha própria.
+    """
+    dados = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in linhas)
+    if not dados:
+        return
+    with escritor(xlsx_path):
+        fd = os.open(caminho_diario(xlsx_path), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fim = os.fstat(fd).st_size
+            if fim and os.pread(fd, 1, fim - 1) != b"\n":
+                dados = "\n" + dados
+            os.write(fd, dados.encode("utf-8"))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def ler_diario(xlsx_path: Path) -> list[dict]:
+    """Linhas do diário por ordem. Uma última linha incompleta (escrita interrompida) é ignorada."""
+    path = caminho_diario(xlsx_path)
+    try:
+        with open(path, encoding="utf-8") as f:
+            texto = f.read()
+    except OSError:
+        return []
+    out = []
+    # Só "\n": splitlines() também parte em U+2028, U+0085, ... que o json.dumps deixa no texto
+    for linha in texto.split("\n"):
+        if not linha.strip():
+            continue
+        try:
+            out.append(json.loads(linha))
+        except ValueError:
+            continue
+    return out
+
+
+def ler_tabela_com_diario(xlsx_path: Path) -> tuple[list, list[dict]]:
+    """
+    (cabeçalho, linhas) do .xlsx seguidas das linhas do diário.
+    Com .xlsx, as linhas do diário ficam só com as colunas do cabeçalho (como se tivessem sido
+    escritas no workbook); sem .xlsx, o cabeçalho é o das chaves das linhas do diário.
+    """
+    xlsx_path = Path(xlsx_path)
+    cabecalho, linhas = ler_tabela(xlsx_path) if xlsx_path.exists() else ([], [])
+    diario = ler_diario(xlsx_path)
+    if not diario:
+        return cabecalho, linhas
+    if not cabecalho:
+        cabecalho = list(dict.fromkeys(k for r in diario for k in r))
+    colunas = [h for h in cabecalho if h]
+    linhas.extend({h: r.get(h) for h in colunas} for r in diario)
+    return cabecalho, linhas
+
+
+def ler_linhas(xlsx_path: Path) -> list[dict]:
+    """Linhas do .xlsx + diário (ver ler_tabela_com_diario)."""
+    return ler_tabela_com_diario(xlsx_path)[1]
+
+
+def compactar(xlsx_path: Path, cabecalho_novo: Optional[list] = None) -> int:
+    """
+    Passa as linhas do diário para o .xlsx (criado se não existir, com cabecalho_novo ou
+    as chaves das linhas) e esvazia o diário. Linhas cujo line_id já esteja no .xlsx
+    (compactação anterior interrompida entre gravar e esvaziar) não são duplicadas.
+    Devolve o número de linhas acrescentadas ao .xlsx.
+    """
+    from openpyxl import Workbook, load_workbook
+    from openpyxl.styles import Font, PatternFill
+
+    xlsx_path = Path(xlsx_path)
+    with escritor(xlsx_path):
+        diario = ler_diario(xlsx_path)
+        if not diario:
+            return 0
+        if xlsx_path.exists():
+            wb = load_workbook(xlsx_path)
+            ws = wb.active
+            headers = [c.value for c in ws[1]]
+        else:
+            headers = list(cabecalho_novo or dict.fromkeys(k for r in diario for k in r))
+            wb = Workbook()
+            ws = wb.active
+            ws.title = xlsx_path.stem
+            for c, h in enumerate(headers, 1):
+                cell = ws.cell(1, c, h)
+                cell.fill = PatternFill("solid", fgColor="1F2937")
+                cell.font = Font(bold=True, color="FFFFFF")
+        existentes = set()
+        if "line_id" in headers:
+            col = headers.index("line_id") + 1
+            existentes = {
+                str(v) for (v,) in ws.iter_rows(min_row=2, min_col=col, max_col=col, values_only=True) if v
+            }
+        n = 0
+        next_row = ws.max_row + 1
+        for r in diario:
+            lid = r.get("line_id")
+            if lid and str(lid) in existentes:
+                continue
+            for col, h in enumerate(headers, 1):
+                if h in r:
+                    ws.cell(row=next_row, column=col, value=r[h])
+            next_row += 1
+            n += 1
+        guardar_atomico(wb, xlsx_path)
+        # Só depois de o .xlsx estar gravado
+        with open(caminho_diario(xlsx_path), "w"):
+            pass
+    return n
+
+
+def descartar(xlsx_path: Path) -> None:
+    """Esvazia o diário (ex: quando o .xlsx é regenerado a partir das fontes)."""
+    with escritor(xlsx_path):
+        if caminho_diario(xlsx_path).exists():
+            with open(caminho_diario(xlsx_path), "w"):
+                pass
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Índice de faturas repetidas com bytes diferentes (ex: a mesma fatura em foto e em PDF),
+sobre facturas_extraidas/*.json e custos_registo (.xlsx + diário), na base de documentos.
+
+Chaves de cada fatura (consulta por igualdade no índice, antes de gravar):
+  numero:     fornecedor + número do documento normalizado ("FT A/0123" = "fta 123")
+  data_total: fornecedor + data + total (número mal lido pelo OCR ou em falta)
+O fornecedor entra pelo NIF e pelo nome normalizado (custos_registo só tem o nome).
+
+custos_registo é reindexado quando o .xlsx muda (importações, compactação); as faturas
+novas são acrescentadas com registar() por quem as grava.
+"""
+import json
+import re
+import sqlite3
+import unicodedata
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from utils import diario_custos
+from utils.cache_documentos import ligar
+from utils.cache_excel import assinatura_ficheiro
+
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS chaves_factura (
+    chave TEXT NOT NULL, criterio TEXT NOT NULL, fonte TEXT NOT NULL, ref TEXT NOT NULL,
+    numero TEXT, data TEXT, total REAL, centro_custo_codigo TEXT,
+    PRIMARY KEY (chave, fonte, ref)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chaves_factura_ref ON chaves_factura (fonte, ref);
+CREATE TABLE IF NOT EXISTS indice_fontes (fonte TEXT PRIMARY KEY, assinatura TEXT);
+"""
+
+FONTE_FACTURAS = "facturas_extraidas"
+FONTE_REGISTO = "custos_registo"
+
+# Formas jurídicas ignoradas na comparação de nomes de fornecedores
+_FORMAS_JURIDICAS = {"LDA", "LIMITADA", "SA", "UNIPESSOAL", "SOCIEDADE", "COMERCIAL"}
+_RE_LINHA_EMAIL = re.compile(r"^email_(.+)_\d+$")
+
+
+def _ascii_maiusculas(s) -> str:
+    s = unicodedata.normalize("NFKD", str(s or ""))
+    return "".join(c for c in s if not unicodedata.combining(c)).upper()
+
+
+def normalizar_numero(numero) -> str:
+    """Série e números do documento sem separadores nem zeros à esquerda; "" se não tiver dígitos."""
+    partes = re.findall(r"[A-Z]+|\d+", _ascii_maiusculas(numero))
+    if not any(p.isdigit() for p in partes):
+        return ""
+    grupos: list[str] = []
+    for p in partes:
+        if p.isdigit():
+            grupos.append(str(int(p)))
+        elif grupos and not grupos[-1].isdigit():
+            grupos[-1] += p  # "FT A" = "FTA"
+        else:
+            grupos.append(p)
+    return "/".join(grupos)
+
+
+def normalizar_fornecedor(nome) -> str:
+    palavras = re.findall(r"[A-Z0-9]+", _ascii_maiusculas(nome))
+    nome = " ".join(p for p in palavras if p not in _FORMAS_JURIDICAS and len(p) > 1)
+    return nome if len(nome) >= 3 else ""
+
+
+def _data(valor) -> str:
+    return str(valor or "")[:10]
+
+
+def _totais(totais: dict) -> list[float]:
+    out = []
+    for k in ("valor_liquido", "total_documento"):
+        v = totais.get(k)
+        if isinstance(v, (int, float)) and v:
+            out.append(round(float(v), 2))
+    return list(dict.fromkeys(out))
+
+
+def chaves(factura: dict) -> list[tuple[str, str]]:
+    """(chave, critério) de uma fatura no formato de FacturaExtraida.to_dict()."""
+    forn = factura.get("fornecedor") or {}
+    doc = factura.get("documento") or {}
+    ids = []
+    nif = re.sub(r"\D", "", str(forn.get("nif") or ""))
+    if len(nif) == 9:
+        ids.append(f"nif:{nif}")
+    nome = normalizar_fornecedor(forn.get("nome"))
+    if nome:
+        ids.append(f"nome:{nome}")
+    numero = normalizar_numero(doc.get("numero"))
+    data = _data(doc.get("data"))
+    totais = _totais(factura.get("totais") or {})
+    out = []
+    for f in ids:
+        if numero:
+            out.append((f"{f}|n:{numero}", "numero"))
+        if data:
+            out.extend((f"{f}|d:{data}|t:{t:.2f}", "data_total") for t in totais)
+    return out
+
+
+def _facturas_registo(linhas: Iterable[dict]) -> Iterator[tuple[str, dict, str]]:
+    """(ref, fatura, centro) por documento de custos_registo (linhas agrupadas por fornecedor + número)."""
+    docs: dict[tuple, dict] = {}
+    for r in linhas:
+        numero = str(r.get("document_no") or "").strip()
+        if not numero or r.get("origem") == "alocacao":
+            continue
+        chave = (str(r.get("supplier") or "").strip(), numero)
+        d = docs.get(chave)
+        if d is None:
+            lid = str(r.get("line_id") or "")
+            m = _RE_LINHA_EMAIL.match(lid)
+            # Linhas vindas de email: a mesma ref que a fatura em facturas_extraidas
+            ref = m.group(1) if m else f"{chave[0]}|{numero}"
+            d = docs[chave] = {"ref": ref, "data": _data(r.get("date")), "total": 0.0,
+                               "centro": str(r.get("centro_custo_codigo") or "").strip()}
+        v = r.get("net_amount")
+        if isinstance(v, (int, float)):
+            d["total"] += v
+    for (fornecedor, numero), d in docs.items():
+        factura = {
+            "fornecedor": {"nome": fornecedor},
+            "documento": {"numero": numero, "data": d["data"]},
+            "totais": {"valor_liquido": d["total"]},
+        }
+        yield d["ref"], factura, d["centro"]
+
+
+class IndiceDuplicados:
+    def __init__(self, db_path: Path, facturas_dir: Path, custos_registo: Path):
+        self.db_path = Path(db_path)
+        self.facturas_dir = Path(facturas_dir)
+        self.custos_registo = Path(custos_registo)
+
+    def _ligar(self) -> sqlite3.Connection:
+        return ligar(self.db_path, ESQUEMA)
+
+    @staticmethod
+    def _inserir(conn: sqlite3.Connection, fonte: str, ref: str, factura: dict, centro: str) -> None:
+        doc = factura.get("documento") or {}
+        totais = _totais(factura.get("totais") or {})
+        conn.executemany(
+            "INSERT OR REPLACE INTO chaves_factura VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [
+                (chave, criterio, fonte, ref, doc.get("numero") or "", _data(doc.get("data")),
+                 totais[-1] if totais else None, centro or "")
+                for chave, criterio in chaves(factura)
+            ],
+        )
+
+    def _indexar_facturas(self, conn: sqlite3.Connection) -> int:
+        n = 0
+        for path in sorted(self.facturas_dir.glob("*.json")):
+            try:
+                factura = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            self._inserir(conn, FONTE_FACTURAS, path.stem, factura, factura.get("centro_custo_sugerido", ""))
+            n += 1
+        return n
+
+    def _indexar_registo(self, conn: sqlite3.Connection) -> int:
+        n = 0
+        if diario_custos.existe(self.custos_registo):
+            for ref, factura, centro in _facturas_registo(diario_custos.ler_linhas(self.custos_registo)):
+                self._inserir(conn, FONTE_REGISTO, ref, factura, centro)
+                n += 1
+        return n
+
+    def _marcar(self, conn: sqlite3.Connection, fonte: str, assinatura) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO indice_fontes VALUES (?, ?)", (fonte, json.dumps(assinatura))
+        )
+
+    def sincronizar(self) -> None:
+        """Indexa facturas_extraidas na 1ª utilização e custos_registo sempre que o .xlsx mudou."""
+        conn = self._ligar()
+        feitas = {r["fonte"]: r["assinatura"] for r in conn.execute("SELECT * FROM indice_fontes")}
+        assinatura = json.dumps(assinatura_ficheiro(self.custos_registo))
+        if FONTE_FACTURAS in feitas and feitas.get(FONTE_REGISTO) == assinatura:
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if FONTE_FACTURAS not in feitas:
+                self._indexar_facturas(conn)
+                self._marcar(conn, FONTE_FACTURAS, None)
+            if feitas.get(FONTE_REGISTO) != assinatura:
+                conn.execute("DELETE FROM chaves_factura WHERE fonte = ?", (FONTE_REGISTO,))
+                self._indexar_registo(conn)
+                self._marcar(conn, FONTE_REGISTO, assinatura_ficheiro(self.custos_registo))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def reconstruir(self) -> dict:
+        """Reindexa tudo de raiz; devolve o número de faturas por fonte."""
+        conn = self._ligar()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM chaves_factura")
+            conn.execute("DELETE FROM indice_fontes")
+            n_facturas = self._indexar_facturas(conn)
+            n_registo = self._indexar_registo(conn)
+            self._marcar(conn, FONTE_FACTURAS, None)
+            self._marcar(conn, FONTE_REGISTO, assinatura_ficheiro(self.custos_registo))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return {FONTE_FACTURAS: n_facturas, FONTE_REGISTO: n_registo}
+
+    def procurar(self, factura: dict) -> Optional[dict]:
+        """Fatura já indexada com o mesmo fornecedor + número (ou data + total), ou None."""
+        ch = [c for c, _ in chaves(factura)]
+        if not ch:
+            return None
+        self.sincronizar()
+        row = self._ligar().execute(
+            f"SELECT * FROM chaves_factura WHERE chave IN ({', '.join('?' * len(ch))}) "
+            "ORDER BY criterio = 'numero' DESC LIMIT 1",
+            ch,
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "criterio": row["criterio"],
+            "fonte": row["fonte"],
+            "ref": row["ref"],
+            "numero": row["numero"],
+            "data": row["data"],
+            "total": row["total"],
+            "centro_custo_codigo": row["centro_custo_codigo"],
+        }
+
+    def registar(self, factura: dict, ref: str, centro: str = "") -> None:
+        """Acrescenta ao índice uma fatura gravada em facturas_extraidas (ref = nome do .json sem extensão)."""
+        self._inserir(self._ligar(), FONTE_FACTURAS, ref, factura, centro)
+
+    def duplicados(self) -> list[dict]:
+        """
+        Grupos de documentos diferentes (ref) com uma chave em comum, já gravados.
+        Cada grupo aparece uma vez, pelo critério mais forte.
+        """
+        self.sincronizar()
+        por_chave: dict[str, list] = defaultdict(list)
+        criterio: dict[str, str] = {}
+        for r in self._ligar().execute(
+            "SELECT * FROM chaves_factura WHERE chave IN ("
+            "SELECT chave FROM chaves_factura GROUP BY chave HAVING COUNT(DISTINCT ref) > 1"
+            ") ORDER BY chave, fonte, ref"
+        ):
+            por_chave[r["chave"]].append(dict(r))
+            criterio[r["chave"]] = r["criterio"]
+        grupos: dict[frozenset, dict] = {}
+        for chave in sorted(por_chave, key=lambda c: criterio[c] != "numero"):
+            docs = {d["ref"]: d for d in por_chave[chave]}
+            refs = frozenset(docs)
+            if refs in grupos:
+                continue
+            grupos[refs] = {
+                "criterio": criterio[chave],
+                "chave": chave,
+                "documentos": [
+                    {k: d[k] for k in ("fonte", "ref", "numero", "data", "total", "centro_custo_codigo")}
+                    for d in docs.values()
+                ],
+            }
+        return list(grupos.values())
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Coordenação de escritas nos workbooks partilhados (custos_linhas, custos_registo).
+- Um escritor de cada vez por workbook: lock reentrante entre threads + flock entre
+  processos (API, processar_email_despesas, alimentar_custos_registo...), no ficheiro
+  .<nome>.lock ao lado do workbook.
+- Gravação atómica: o workbook é escrito num temporário na mesma pasta e renomeado
+  por cima do original (os leitores veem o ficheiro antigo ou o novo, nunca um zip a meio).
+  Os leitores não usam o lock.
+- line_id monotónicos por workbook (.<nome>.seq), que nunca se repetem.
+"""
+import os
+import re
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: só o lock entre threads do mesmo processo
+    fcntl = None
+
+
+class _Lock:
+    def __init__(self, path: Path):
+        self.path = path
+        self.rlock = threading.RLock()
+        self.nivel = 0
+        self.ficheiro = None
+
+
+_locks: dict[str, _Lock] = {}
+_locks_lock = threading.Lock()
+
+
+def _auxiliar(path: Path, extensao: str) -> Path:
+    path = Path(path)
+    return path.with_name(f".{path.name}.{extensao}")
+
+
+@contextmanager
+def escritor(path: Path):
+    """Exclusão mútua de escrita sobre o workbook path (threads e processos; reentrante)."""
+    chave = str(Path(path).resolve())
+    with _locks_lock:
+        lock = _locks.get(chave)
+        if lock is None:
+            lock = _locks[chave] = _Lock(_auxiliar(path, "lock"))
+    with lock.rlock:
+        if lock.nivel == 0 and fcntl is not None:
+            lock.path.parent.mkdir(parents=True, exist_ok=True)
+            lock.ficheiro = open(lock.path, "a")
+            fcntl.flock(lock.ficheiro, fcntl.LOCK_EX)
+        lock.nivel += 1
+        try:
+            yield
+        finally:
+            lock.nivel -= 1
+            if lock.nivel == 0 and lock.ficheiro is not None:
+                fcntl.flock(lock.ficheiro, fcntl.LOCK_UN)
+                lock.ficheiro.close()
+                lock.ficheiro = None
+
+
+def guardar_atomico(wb, path: Path) -> None:
+    """Grava o workbook openpyxl num temporário (com fsync) e substitui path de uma vez."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        wb.save(tmp)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+_RE_ID = re.compile(r"^(?:foto|email)_(\d+)$")
+
+
+def _maior_id(linhas: Iterable[dict]) -> int:
+    maior = 0
+    for r in linhas:
+        m = _RE_ID.match(str(r.get("line_id") or ""))
+        if m:
+            maior = max(maior, int(m.group(1)))
+    return maior
+
+
+def proximo_id(
+    path: Path,
+    linhas_existentes: Optional[Callable[[], Iterable[dict]]] = None,
+    quantidade: int = 1,
+) -> int:
+    """
+    Próximo número de line_id (foto_N / email_N) do workbook path, estritamente crescente.
+    Reserva quantidade números consecutivos e devolve o primeiro.
+    Na 1ª utilização a sequência começa acima do maior id já existente (linhas_existentes()).
+    """
+    seq = _auxiliar(path, "seq")
+    with escritor(path):
+        try:
+            atual = int(seq.read_text().strip() or 0)
+        except (OSError, ValueError):
+            atual = _maior_id(linhas_existentes()) if linhas_existentes else 0
+        tmp = seq.with_name(seq.name + ".tmp")
+        tmp.write_text(str(atual + max(1, quantidade)))
+        os.replace(tmp, seq)
+        return atual + 1
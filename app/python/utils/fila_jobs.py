@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Fila de jobs em memória com um pool de workers (threads), partilhada pelo processo.
+Cada job regista o estado (pendente -> a_processar -> concluido | erro), o resultado
+e o tempo gasto em cada etapa (ex: ocr, extracao, gravacao).
+Os jobs terminados são guardados até JOBS_RETIDOS; os mais antigos são descartados.
+Workers: GESTAO_JOBS_WORKERS (default 2).
+"""
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+WORKERS_DEFAULT = int(os.getenv("GESTAO_JOBS_WORKERS", "2"))
+JOBS_RETIDOS = 1000
+
+PENDENTE = "pendente"
+A_PROCESSAR = "a_processar"
+CONCLUIDO = "concluido"
+ERRO = "erro"
+
+
+class Job:
+    def __init__(self, tipo: str):
+        self.id = os.urandom(8).hex()
+        self.tipo = tipo
+        self.estado = PENDENTE
+        self.criado = time.time()
+        self.iniciado: Optional[float] = None
+        self.terminado: Optional[float] = None
+        self.etapas: dict[str, float] = {}
+        self.resultado: Any = None
+        self.erro: Optional[str] = None
+
+    @contextmanager
+    def etapa(self, nome: str):
+        """Mede a duração de uma etapa (segundos, acumulada se repetida)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.etapas[nome] = self.etapas.get(nome, 0.0) + time.perf_counter() - t0
+
+    def to_dict(self) -> dict:
+        out = {
+            "id": self.id,
+            "tipo": self.tipo,
+            "estado": self.estado,
+            "criado": self.criado,
+            "espera_s": round((self.iniciado or time.time()) - self.criado, 3),
+            "etapas_s": {k: round(v, 3) for k, v in self.etapas.items()},
+        }
+        if self.terminado is not None:
+            out["duracao_s"] = round(self.terminado - (self.iniciado or self.criado), 3)
+        if self.estado == CONCLUIDO:
+            out["resultado"] = self.resultado
+        if self.estado == ERRO:
+            out["erro"] = self.erro
+        return out
+
+
+class FilaJobs:
+    def __init__(self, workers: int = WORKERS_DEFAULT):
+        self.workers = max(1, workers)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._concluidos = 0
+        self._erros = 0
+        # Totais por etapa (soma de segundos, n) dos jobs terminados
+        self._etapas: dict[str, list] = {}
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="job")
+            return self._pool
+
+    def _registar(self, job: Job) -> None:
+        with self._lock:
+            self._jobs[job.id] = job
+            # Descarta os terminados mais antigos acima do limite (pendentes nunca são descartados)
+            excesso = len(self._jobs) - JOBS_RETIDOS
+            if excesso > 0:
+                for jid in [j.id for j in self._jobs.values() if j.terminado is not None][:excesso]:
+                    del self._jobs[jid]
+
+    def _correr(self, job: Job, funcao: Callable, args, kwargs) -> None:
+        job.estado = A_PROCESSAR
+        job.iniciado = time.time()
+        try:
+            job.resultado = funcao(job, *args, **kwargs)
+            job.estado = CONCLUIDO
+        except Exception as e:
+            job.erro = f"{type(e).__name__}: {e}"
+            job.estado = ERRO
+            traceback.print_exc()
+        finally:
+            job.terminado = time.time()
+            with self._lock:
+                if job.estado == CONCLUIDO:
+                    self._concluidos += 1
+                else:
+                    self._erros += 1
+                for nome, s in job.etapas.items():
+                    tot = self._etapas.setdefault(nome, [0.0, 0])
+                    tot[0] += s
+                    tot[1] += 1
+
+    def submeter(self, tipo: str, funcao: Callable, *args, **kwargs) -> Job:
+        """Põe funcao(job, *args, **kwargs) na fila; devolve o job (pendente)."""
+        job = Job(tipo)
+        self._registar(job)
+        self._executor().submit(self._correr, job, funcao, args, kwargs)
+        return job
+
+    def executar(self, tipo: str, funcao: Callable, *args, **kwargs) -> Job:
+        """Corre funcao(job, ...) na thread atual, com o mesmo registo de estado e tempos."""
+        job = Job(tipo)
+        self._registar(job)
+        self._correr(job, funcao, args, kwargs)
+        return job
+
+    def obter(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def estatisticas(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+            etapas = {
+                nome: {"n": n, "media_s": round(s / n, 3), "total_s": round(s, 3)}
+                for nome, (s, n) in self._etapas.items()
+            }
+            concluidos, erros = self._concluidos, self._erros
+        return {
+            "workers": self.workers,
+            "pendentes": sum(1 for j in jobs if j.estado == PENDENTE),
+            "a_processar": sum(1 for j in jobs if j.estado == A_PROCESSAR),
+            "concluidos": concluidos,
+            "erros": erros,
+            "etapas": etapas,
+        }
+
+
+FILA = FilaJobs()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Leitura seletiva de emails por IMAP: ENVELOPE + BODYSTRUCTURE primeiro (assunto e
+lista de partes, sem descarregar o corpo) e depois só as partes que interessam com
+BODY.PEEK[parte] (não marca a mensagem como lida).
+
+As respostas do imaplib são listas de bytes e tuplos (prefixo terminado em {n}, literal);
+_analisar() converte-as em listas aninhadas (átomos e strings como str, literais como bytes,
+NIL como None).
+
+esperar_idle() implementa IMAP IDLE (o imaplib desta versão do Python não o tem).
+"""
+import base64
+import binascii
+import imaplib
+import quopri
+import re
+import select
+import ssl
+import time
+from dataclasses import dataclass
+from email.header import decode_header, make_header
+from email.utils import collapse_rfc2231_value, decode_params, unquote
+from typing import Iterable, Iterator, Optional
+
+_RE_TOKEN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}\s*$|([^\s()"]+))')
+
+
+@dataclass
+class Anexo:
+    parte: str  # secção IMAP ("2", "1.2", ...)
+    nome: str
+    tipo: str  # ex: "application/pdf"
+    codificacao: str  # "BASE64", "QUOTED-PRINTABLE", "7BIT", ...
+    tamanho: int
+
+
+@dataclass
+class Mensagem:
+    uid: int
+    assunto: str
+    anexos: list[Anexo]
+
+
+def _tokens(data: Iterable) -> Iterator:
+    """Tokens de uma resposta do imaplib: "(", ")", str, bytes (literal) ou None (NIL)."""
+    for item in data:
+        if isinstance(item, tuple):
+            texto, literal = item[0], item[1]
+        else:
+            texto, literal = item, None
+        if texto is None:
+            continue
+        pos = 0
+        while pos < len(texto):
+            m = _RE_TOKEN.match(texto, pos)
+            if not m or m.end() == pos:
+                break
+            pos = m.end()
+            abre, fecha, quoted, tam_literal, atomo = m.groups()
+            if abre:
+                yield "("
+            elif fecha:
+                yield ")"
+            elif quoted is not None:
+                yield re.sub(rb"\\(.)", rb"\1", quoted).decode("utf-8", errors="replace")
+            elif tam_literal is not None:
+                yield literal if literal is not None else b""
+                literal = None
+            elif atomo is not None:
+                a = atomo.decode("ascii", errors="replace")
+                yield None if a.upper() == "NIL" else a
+
+
+def _analisar(data: Iterable) -> list:
+    """Resposta do imaplib -> lista de elementos de topo (listas aninhadas)."""
+    topo: list = []
+    pilha = [topo]
+    for t in _tokens(data):
+        if t == "(":
+            nova: list = []
+            pilha[-1].append(nova)
+            pilha.append(nova)
+        elif t == ")":
+            if len(pilha) > 1:
+                pilha.pop()
+        else:
+            pilha[-1].append(t)
+    return topo
+
+
+def _respostas_fetch(data: Iterable) -> Iterator[dict]:
+    """{ITEM: valor} de cada mensagem de uma resposta FETCH ("UID", "ENVELOPE", "BODY[2]", ...)."""
+    for el in _analisar(data):
+        if not isinstance(el, list):
+            continue  # número de sequência
+        itens = {}
+        i = 0
+        while i + 1 < len(el):
+            itens[str(el[i]).upper()] = el[i + 1]
+            i += 2
+        yield itens
+
+
+def _texto(v) -> str:
+    if v is None:
+        return ""
+    if isinstance(v, bytes):
+        v = v.decode("utf-8", errors="replace")
+    return str(v)
+
+
+def decodificar_cabecalho(valor) -> str:
+    """Assunto/nome de ficheiro com encoded-words (=?utf-8?...?=) em texto."""
+    valor = _texto(valor)
+    try:
+        return str(make_header(decode_header(valor))).strip()
+    except (ValueError, LookupError, binascii.Error):
+        return valor.strip()
+
+
+def _parametros(lista) -> dict:
+    """Parâmetros MIME ("NAME" "x.pdf" ...) -> dict em minúsculas, com RFC 2231 (filename*0*=...)."""
+    if not isinstance(lista, list):
+        return {}
+    pares = [(_texto(lista[i]).lower(), _texto(lista[i + 1])) for i in range(0, len(lista) - 1, 2)]
+    try:
+        pares = decode_params([("", "")] + pares)[1:]
+    except Exception:
+        pass
+    return {k: unquote(collapse_rfc2231_value(v)) for k, v in pares}
+
+
+def _nome_parte(corpo: list) -> str:
+    nome = _parametros(corpo[2] if len(corpo) > 2 else None).get("name", "")
+    # Content-Disposition: ("attachment" ("FILENAME" "x.pdf")) algures depois do tamanho
+    for ext in corpo[7:]:
+        if isinstance(ext, list) and len(ext) >= 2 and isinstance(ext[0], str) and isinstance(ext[1], (list, type(None))):
+            fn = _parametros(ext[1]).get("filename")
+            if fn:
+                nome = fn
+                break
+    return decodificar_cabecalho(nome)
+
+
+def partes(estrutura, prefixo: str = "") -> Iterator[Anexo]:
+    """
+    Partes (folhas) de um BODYSTRUCTURE, com o número de secção IMAP de cada uma. As partes
+    message/rfc822 não são folhas: devolve as partes da mensagem que vai lá dentro.
+    """
+    if not isinstance(estrutura, list) or not estrutura:
+        return
+    if isinstance(estrutura[0], list):
+        # multipart: (parte1)(parte2)... "MIXED" ...
+        n = 0
+        for sub in estrutura:
+            if not isinstance(sub, list):
+                break
+            n += 1
+            yield from partes(sub, f"{prefixo}.{n}" if prefixo else str(n))
+        return
+    tipo = f"{_texto(estrutura[0])}/{_texto(estrutura[1])}".lower()
+    if tipo == "message/rfc822" and len(estrutura) > 8 and isinstance(estrutura[8], list):
+        # Email reencaminhado como anexo: as partes da mensagem interior são "N.1", "N.2", ...
+        # (numa interior sem multipart, o corpo é "N.1")
+        interior, base = estrutura[8], prefixo or "1"
+        yield from partes(interior, base if interior and isinstance(interior[0], list) else f"{base}.1")
+        return
+    try:
+        tamanho = int(estrutura[6])
+    except (IndexError, TypeError, ValueError):
+        tamanho = 0
+    yield Anexo(
+        parte=prefixo or "1",
+        nome=_nome_parte(estrutura),
+        tipo=tipo,
+        codificacao=_texto(estrutura[5] if len(estrutura) > 5 else "").upper(),
+        tamanho=tamanho,
+    )
+
+
+def mensagens(mail, uids: list[bytes], extensoes: Optional[set[str]] = None) -> list[Mensagem]:
+    """Assunto e anexos (só os com extensão em extensoes, se dada) das mensagens, num único UID FETCH."""
+    if not uids:
+        return []
+    typ, data = mail.uid("FETCH", b",".join(uids), "(UID ENVELOPE BODYSTRUCTURE)")
+    if typ != "OK":
+        return []
+    out = []
+    for itens in _respostas_fetch(data):
+        try:
+            uid = int(itens["UID"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        envelope = itens.get("ENVELOPE") or []
+        assunto = decodificar_cabecalho(envelope[1] if len(envelope) > 1 else "")
+        anexos = [
+            a for a in partes(itens.get("BODYSTRUCTURE"))
+            if a.nome and (extensoes is None or _extensao(a.nome) in extensoes)
+        ]
+        out.append(Mensagem(uid=uid, assunto=assunto, anexos=anexos))
+    return out
+
+
+def _extensao(nome: str) -> str:
+    i = nome.rfind(".")
+    return nome[i:].lower() if i >= 0 else ""
+
+
+def _descodificar(conteudo: bytes, codificacao: str) -> bytes:
+    if codificacao == "BASE64":
+        return base64.b64decode(conteudo, validate=False)
+    if codificacao == "QUOTED-PRINTABLE":
+        return quopri.decodestring(conteudo)
+    return conteudo
+
+
+def descarregar(mail, uid: int, anexos: list[Anexo]) -> dict[str, bytes]:
+    """{parte: bytes descodificados} dos anexos, com BODY.PEEK (a mensagem fica por ler)."""
+    if not anexos:
+        return {}
+    pedido = " ".join(f"BODY.PEEK[{a.parte}]" for a in anexos)
+    typ, data = mail.uid("FETCH", str(uid), f"({pedido})")
+    if typ != "OK":
+        return {}
+    por_parte = {}
+    for itens in _respostas_fetch(data):
+        for a in anexos:
+            conteudo = itens.get(f"BODY[{a.parte}]")
+            if isinstance(conteudo, str):
+                conteudo = conteudo.encode("latin-1", errors="replace")
+            if conteudo:
+                try:
+                    por_parte[a.parte] = _descodificar(conteudo, a.codificacao)
+                except (ValueError, binascii.Error):
+                    continue
+    return por_parte
+
+
+def _novidade(linha: bytes) -> bool:
+    """Linha não marcada que anuncia mensagens novas ("* n EXISTS", "* n RECENT" com n > 0)."""
+    partes = linha.split()
+    if len(partes) < 3 or partes[0] != b"*" or not partes[1].isdigit():
+        return False
+    tipo = partes[2].upper()
+    return tipo == b"EXISTS" or (tipo == b"RECENT" and int(partes[1]) > 0)
+
+
+def limpar_novidades(mail) -> None:
+    """Esquece EXISTS/RECENT já recebidos (ex: os do SELECT), antes de procurar os emails novos."""
+    for chave in ("EXISTS", "RECENT"):
+        mail.untagged_responses.pop(chave, None)
+
+
+def _pendentes(mail) -> bool:
+    """True se recebemos EXISTS/RECENT (n > 0) depois do último limpar_novidades (e esquece-os)."""
+    exists = mail.untagged_responses.pop("EXISTS", None)
+    recent = mail.untagged_responses.pop("RECENT", None) or []
+    return bool(exists) or any(int(n or 0) > 0 for n in recent)
+
+
+def _ha_dados(mail, segundos: float) -> bool:
+    """
+    Há bytes por ler até segundos: primeiro no buffer do imaplib e no SSL (select() não os vê),
+    só depois select() no socket. Sem timeouts no socket (inutilizam o ficheiro do imaplib).
+    """
+    sock = mail.socket()
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+        return True
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        if mail.file.peek(1):
+            return True
+    except (BlockingIOError, ssl.SSLWantReadError):
+        pass
+    finally:
+        sock.settimeout(timeout)
+    return bool(select.select([sock], [], [], max(0.0, segundos))[0])
+
+
+def _linha(mail) -> bytes:
+    linha = mail.readline()
+    if not linha:
+        raise imaplib.IMAP4.abort("ligação fechada durante IDLE")
+    if linha.startswith(b"* BYE"):
+        raise imaplib.IMAP4.abort(linha.decode(errors="replace").strip())
+    return linha
+
+
+def esperar_idle(mail, segundos: float) -> bool:
+    """
+    IMAP IDLE (RFC 2177) até o servidor anunciar mensagens novas (EXISTS/RECENT) ou passarem
+    segundos. True se houve novidades. O servidor tem de anunciar IDLE em CAPABILITY.
+    Um EXISTS que chegou nas respostas de comandos anteriores (e está em untagged_responses)
+    conta logo, sem entrar em IDLE; quem chama deve limpar_novidades() antes de procurar emails.
+    Erros de rede sobem como imaplib.IMAP4.abort / OSError (quem chama volta a ligar).
+    """
+    if _pendentes(mail):
+        return True
+    limite = time.monotonic() + segundos
+    tag = mail._new_tag()
+    mail.send(tag + b" IDLE\r\n")
+    novidades = False
+    # Antes do "+" o servidor ainda pode enviar respostas não marcadas
+    while True:
+        linha = _linha(mail)
+        if linha.startswith(b"+"):
+            break
+        if linha.startswith(tag):
+            raise imaplib.IMAP4.abort(f"IDLE recusado: {linha!r}")
+        novidades = novidades or _novidade(linha)
+    # Tudo lido por mail.readline(): o que já está no buffer do imaplib também conta
+    while not novidades:
+        restante = limite - time.monotonic()
+        if restante <= 0 or not _ha_dados(mail, restante):
+            break
+        novidades = _novidade(_linha(mail))
+    mail.send(b"DONE\r\n")
+    while True:
+        linha = _linha(mail)
+        if linha.startswith(tag):
+            mail.tagged_commands.pop(tag, None)
+            if not linha[len(tag):].strip().upper().startswith(b"OK"):
+                raise imaplib.IMAP4.abort(linha.decode(errors="replace").strip())
+            return novidades
+        novidades = novidades or _novidade(linha)
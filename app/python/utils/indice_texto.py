@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Índice invertido de trigramas para a pesquisa textual (q=) da base de dados.
+Mantém a semântica de _apply_text_filter: uma linha corresponde se alguma das colunas
+(não vazias) contiver q como substring, sem distinguir maiúsculas/minúsculas.
+Os trigramas só reduzem os candidatos; cada candidato é confirmado por substring.
+Atualização incremental: ao recarregar o ficheiro, só as linhas a partir da primeira
+diferença são reindexadas (no caso típico, só as linhas acrescentadas no fim).
+
+O índice vive na mesma entrada do cache (utils/cache_excel) que as linhas de onde foi
+construído (LinhasComIndice, ou junto do store colunar): sai da memória com elas e conta
+para GESTAO_CACHE_MB. Aqui só fica uma referência fraca, para o próximo carregamento.
+"""
+import sys
+import threading
+import weakref
+from bisect import bisect_left
+from typing import Hashable, Sequence
+
+from utils.cache_excel import estimar_bytes
+
+
+def _trigramas(texto: str) -> set[str]:
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceTrigramas:
+    """Postings trigrama -> ids de linha (ordenados) sobre um conjunto fixo de colunas."""
+
+    def __init__(self, colunas: Sequence[str]):
+        self.colunas = tuple(colunas)
+        self._textos: list[tuple[str, ...]] = []
+        self._postings: dict[str, list[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._textos)
+
+    def _texto_linha(self, linha: dict) -> tuple[str, ...]:
+        return tuple(str(linha.get(c)).lower() if linha.get(c) else "" for c in self.colunas)
+
+    def atualizar(self, linhas: list[dict]) -> None:
+        """Sincroniza o índice com linhas, reindexando só a partir da primeira linha diferente."""
+        novos = [self._texto_linha(r) for r in linhas]
+        antigos = self._textos
+        k = 0
+        limite = min(len(antigos), len(novos))
+        while k < limite and antigos[k] == novos[k]:
+            k += 1
+        if k < len(antigos):
+            self._truncar(k)
+        postings = self._postings
+        for i in range(k, len(novos)):
+            tris: set[str] = set()
+            for t in novos[i]:
+                if len(t) >= 3:
+                    tris |= _trigramas(t)
+            for tri in tris:
+                lst = postings.get(tri)
+                if lst is None:
+                    postings[tri] = [i]
+                else:
+                    lst.append(i)
+        self._textos = novos
+
+    def copia(self) -> "IndiceTrigramas":
+        """Cópia para atualizar sem mexer no índice que leitores em curso ainda usam."""
+        novo = IndiceTrigramas(self.colunas)
+        novo._textos = self._textos
+        novo._postings = {tri: lst[:] for tri, lst in self._postings.items()}
+        return novo
+
+    def tamanho_estimado(self) -> int:
+        """Estimativa grosseira da memória (postings e textos normalizados)."""
+        ids = sum(len(lst) for lst in self._postings.values())
+        amostra = self._textos[:: max(1, len(self._textos) // 50)][:50]
+        por_texto = sum(sum(sys.getsizeof(c) for c in t) + sys.getsizeof(t) for t in amostra) / max(1, len(amostra))
+        return int(8 * ids + 120 * len(self._postings) + por_texto * len(self._textos))
+
+    def _truncar(self, k: int) -> None:
+        """Remove dos postings todos os ids >= k."""
+        vazios = []
+        for tri, lst in self._postings.items():
+            if lst[-1] >= k:
+                del lst[bisect_left(lst, k):]
+                if not lst:
+                    vazios.append(tri)
+        for tri in vazios:
+            del self._postings[tri]
+
+    def procurar(self, q: str) -> list[int]:
+        """Ids (ordenados) das linhas em que alguma coluna contém q (já normalizado em minúsculas)."""
+        textos = self._textos
+        if len(q) < 3:
+            return [i for i, t in enumerate(textos) if any(q in c for c in t)]
+        listas = []
+        for tri in _trigramas(q):
+            lst = self._postings.get(tri)
+            if not lst:
+                return []
+            listas.append(lst)
+        listas.sort(key=len)
+        candidatos = listas[0]
+        for lst in listas[1:]:
+            candidatos = [i for i in candidatos if _contem(lst, i)]
+            if not candidatos:
+                return []
+        return [i for i in candidatos if any(q in c for c in textos[i])]
+
+
+def _contem(lst: list[int], i: int) -> bool:
+    j = bisect_left(lst, i)
+    return j < len(lst) and lst[j] == i
+
+
+class LinhasComIndice:
+    """Linhas de um dataset e o seu índice numa só entrada do cache (removidos juntos)."""
+
+    __slots__ = ("linhas", "indice")
+
+    def __init__(self, linhas: list[dict], indice: IndiceTrigramas):
+        self.linhas = linhas
+        self.indice = indice
+
+    def tamanho_estimado(self) -> int:
+        return estimar_bytes(self.linhas) + self.indice.tamanho_estimado()
+
+
+# Último índice de cada (chave, colunas), só enquanto alguma entrada do cache o tiver
+_INDICES: "weakref.WeakValueDictionary[Hashable, IndiceTrigramas]" = weakref.WeakValueDictionary()
+_LOCK = threading.Lock()
+
+
+def indice_para(chave: Hashable, colunas: Sequence[str], linhas: list[dict]) -> IndiceTrigramas:
+    """
+    Índice de linhas para (chave, colunas), a chamar quando o dataset é carregado; quem chama
+    guarda-o junto das linhas em cache. Se o índice do carregamento anterior ainda estiver em
+    memória, parte de uma cópia dele e só reindexa as linhas que mudaram.
+    """
+    k = (chave, tuple(colunas))
+    with _LOCK:
+        anterior = _INDICES.get(k)
+    indice = anterior.copia() if anterior is not None else IndiceTrigramas(colunas)
+    indice.atualizar(linhas)
+    with _LOCK:
+        _INDICES[k] = indice
+    return indice
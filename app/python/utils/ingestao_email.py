@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Estado da leitura da caixa de despesas por UID, para retomar exatamente onde parou.
+
+Ponto de retoma (email_checkpoint.json em dados, escrita atómica): UIDVALIDITY da INBOX e
+último UID até ao qual tudo está tratado. A execução seguinte pede só UID SEARCH UID n+1:*,
+sem depender da flag \\Seen (um email aberto antes num cliente de correio não é saltado).
+Se o UIDVALIDITY mudar (caixa recriada), os UIDs antigos deixam de valer e recomeça-se
+pelos não lidos.
+
+Diário por email e por anexo (tabelas na base de documentos, utils/cache_documentos):
+emails já concluídos não voltam a ser descarregados e, num email interrompido a meio,
+só os anexos que faltam são processados. Cada passagem por um email conta uma tentativa; um
+email que continua a falhar passa a "erro" (nova_tentativa) e deixa de segurar o ponto de retoma.
+"""
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Optional
+
+from utils.cache_documentos import ligar
+
+NOME_CHECKPOINT = "email_checkpoint.json"
+
+# Estados do email: concluido (todos os anexos gravados ou duplicados), ignorado (sem centro),
+# incompleto (algum anexo falhou), erro (desistido ao fim de tentativas). Dos anexos: gravado, duplicado.
+ESQUEMA = """
+CREATE TABLE IF NOT EXISTS emails_ingeridos (
+    uidvalidity INTEGER NOT NULL, uid INTEGER NOT NULL, assunto TEXT, centro_custo_codigo TEXT,
+    estado TEXT NOT NULL, atualizado_em TEXT, tentativas INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (uidvalidity, uid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS anexos_ingeridos (
+    uidvalidity INTEGER NOT NULL, uid INTEGER NOT NULL, parte TEXT NOT NULL, nome TEXT,
+    sha256 TEXT, estado TEXT NOT NULL, atualizado_em TEXT,
+    PRIMARY KEY (uidvalidity, uid, parte)
+) WITHOUT ROWID;
+"""
+
+ESTADOS_FEITOS = ("concluido", "ignorado", "erro")
+
+
+def _agora() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class RegistoIngestao:
+    def __init__(self, db_path: Path, checkpoint_path: Path):
+        self.db_path = Path(db_path)
+        self.checkpoint_path = Path(checkpoint_path)
+
+    def _ligar(self):
+        return ligar(self.db_path, ESQUEMA)
+
+    # --- Ponto de retoma ---
+
+    def ultimo_uid(self, uidvalidity: int) -> Optional[int]:
+        """Último UID tratado nesta UIDVALIDITY, ou None (sem ponto de retoma ou caixa recriada)."""
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                dados = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if dados.get("uidvalidity") != uidvalidity:
+            return None
+        try:
+            return int(dados.get("ultimo_uid"))
+        except (TypeError, ValueError):
+            return None
+
+    def guardar_ponto(self, uidvalidity: int, ultimo_uid: int) -> None:
+        """Grava o ponto de retoma (escrita atómica)."""
+        self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.checkpoint_path.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {"uidvalidity": uidvalidity, "ultimo_uid": ultimo_uid, "atualizado_em": _agora()}, f
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+
+    # --- Diário ---
+
+    def feitos(self, uidvalidity: int, uids: Iterable[int]) -> set[int]:
+        """UIDs (de entre uids) já concluídos, ignorados ou desistidos (erro)."""
+        uids = list(uids)
+        out: set[int] = set()
+        for i in range(0, len(uids), 500):
+            bloco = uids[i:i + 500]
+            out.update(
+                r["uid"] for r in self._ligar().execute(
+                    f"SELECT uid FROM emails_ingeridos WHERE uidvalidity = ? AND uid IN ({', '.join('?' * len(bloco))}) "
+                    f"AND estado IN ({', '.join('?' * len(ESTADOS_FEITOS))})",
+                    (uidvalidity, *bloco, *ESTADOS_FEITOS),
+                )
+            )
+        return out
+
+    def partes_feitas(self, uidvalidity: int, uid: int) -> set[str]:
+        """Secções IMAP dos anexos deste email já gravados (ou duplicados)."""
+        return {
+            r["parte"] for r in self._ligar().execute(
+                "SELECT parte FROM anexos_ingeridos WHERE uidvalidity = ? AND uid = ?", (uidvalidity, uid)
+            )
+        }
+
+    def marcar_email(self, uidvalidity: int, uid: int, estado: str, assunto: str = "", centro: str = "") -> None:
+        """Estado do email (assunto e centro vazios mantêm os já registados)."""
+        self._ligar().execute(
+            "INSERT INTO emails_ingeridos VALUES (?, ?, ?, ?, ?, ?, 0) ON CONFLICT(uidvalidity, uid) DO UPDATE SET "
+            "assunto = COALESCE(NULLIF(excluded.assunto, ''), assunto), "
+            "centro_custo_codigo = COALESCE(NULLIF(excluded.centro_custo_codigo, ''), centro_custo_codigo), "
+            "estado = excluded.estado, atualizado_em = excluded.atualizado_em",
+            (uidvalidity, uid, assunto, centro, estado, _agora()),
+        )
+
+    def nova_tentativa(self, uidvalidity: int, uid: int, assunto: str = "", centro: str = "") -> int:
+        """Email a (re)começar: fica incompleto até o escritor o concluir; devolve o número desta tentativa."""
+        self.marcar_email(uidvalidity, uid, "incompleto", assunto, centro)
+        conn = self._ligar()
+        conn.execute(
+            "UPDATE emails_ingeridos SET tentativas = tentativas + 1 WHERE uidvalidity = ? AND uid = ?",
+            (uidvalidity, uid),
+        )
+        return conn.execute(
+            "SELECT tentativas FROM emails_ingeridos WHERE uidvalidity = ? AND uid = ?", (uidvalidity, uid)
+        ).fetchone()["tentativas"]
+
+    def marcar_anexos(self, uidvalidity: int, uid: int, anexos: Iterable[tuple[str, str, str, str]]) -> None:
+        """anexos: (parte, nome, sha256, estado)."""
+        agora = _agora()
+        self._ligar().executemany(
+            "INSERT OR REPLACE INTO anexos_ingeridos VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(uidvalidity, uid, parte, nome, sha, estado, agora) for parte, nome, sha, estado in anexos],
+        )
+
+
+class AvancoUIDs:
+    """
+    Último UID até ao qual todos os emails da execução estão feitos (acabam fora de ordem
+    no pipeline). Um email que falhou segura o ponto de retoma até ser tratado.
+    """
+
+    def __init__(self, uids: Iterable[int], limite: int):
+        self._pendentes = sorted(set(uids))
+        self._feitos: set[int] = set()
+        self._limite = limite  # ponto de retoma quando todos estiverem feitos
+
+    def feito(self, uids: Iterable[int]) -> None:
+        self._feitos.update(uids)
+
+    def ponto(self) -> int:
+        for uid in self._pendentes:
+            if uid not in self._feitos:
+                return uid - 1
+        return self._limite
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Leitor rápido de folhas Excel partilhado por scripts e API.
+Abre os ficheiros em modo read_only e percorre iter_rows(values_only=True) em streaming,
+em vez de carregar o workbook completo e ler célula a célula com ws.cell(r, c).
+Os workbooks geridos (ver snapshot_excel) são servidos pelo snapshot binário quando atualizado.
+1ª linha = cabeçalho; cada linha seguinte vira {cabeçalho: valor} (colunas sem cabeçalho ignoradas).
+"""
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Iterator, Optional, Sequence, Union
+
+from openpyxl import load_workbook
+
+from utils import snapshot_excel
+from utils.cache_excel import assinatura_ficheiro
+
+# Nome da folha, lista de nomes candidatos (usa a primeira que existir) ou None (folha ativa)
+Folha = Union[str, Sequence[str], None]
+
+
+@contextmanager
+def _abrir_folha(path: Path, folha: Folha = None):
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = None
+        if isinstance(folha, str):
+            ws = wb[folha] if folha in wb.sheetnames else None
+            if ws is None:
+                raise KeyError(f"Folha '{folha}' não existe em {Path(path).name}")
+        elif folha:
+            ws = next((wb[n] for n in folha if n in wb.sheetnames), None)
+        if ws is None:
+            ws = wb.active
+        # Dimensões gravadas por outras ferramentas nem sempre são fiáveis
+        ws.reset_dimensions()
+        yield ws
+    finally:
+        wb.close()
+
+
+def nomes_folhas(path: Path) -> list[str]:
+    wb = load_workbook(path, read_only=True)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+def ler_cabecalho(path: Path, folha: Folha = None) -> list:
+    """Valores da 1ª linha (cabeçalho) da folha."""
+    if snapshot_excel.gerido(path):
+        cab = snapshot_excel.obter_cabecalho(path, folha)
+        if cab is not None:
+            return list(cab)
+    with _abrir_folha(path, folha) as ws:
+        for row in ws.iter_rows(min_row=1, max_row=1, values_only=True):
+            return list(row)
+    return []
+
+
+def _ler_bruto(path: Path, folha: Folha = None) -> tuple[list, list[tuple]]:
+    """Cabeçalho e todas as linhas (tuplos) da folha, lidos do .xlsx."""
+    with _abrir_folha(path, folha) as ws:
+        rows = ws.iter_rows(values_only=True)
+        headers = list(next(rows, ()))
+        return headers, list(rows)
+
+
+def _fonte_linhas(path: Path, folha: Folha, limite: Optional[int]):
+    """
+    Contexto que devolve (cabeçalho, iterável de tuplos).
+    Workbooks geridos vêm do snapshot binário quando está atualizado; caso contrário
+    são lidos do .xlsx e o snapshot é regenerado (exceto em leituras parciais com limite).
+    """
+    if snapshot_excel.gerido(path):
+        snap = snapshot_excel.carregar(path, folha)
+        if snap is None and limite is None:
+            assinatura = assinatura_ficheiro(path)
+            snap = _ler_bruto(path, folha)
+            snapshot_excel.guardar(path, folha, snap[0], snap[1], assinatura)
+        if snap is not None:
+            return nullcontext(snap)
+    return _streaming(path, folha)
+
+
+@contextmanager
+def _streaming(path: Path, folha: Folha):
+    with _abrir_folha(path, folha) as ws:
+        rows = ws.iter_rows(values_only=True)
+        yield list(next(rows, ())), rows
+
+
+def iter_linhas(
+    path: Path,
+    colunas: Optional[Sequence[str]] = None,
+    limite: Optional[int] = None,
+    folha: Folha = None,
+    cabecalho: Optional[list] = None,
+) -> Iterator[dict]:
+    """
+    Percorre as linhas de dados como dicts.
+    colunas: projeção (só estas chaves; as que não existirem no cabeçalho são ignoradas).
+    limite: número máximo de linhas de dados.
+    cabecalho: lista a preencher com o cabeçalho lido (opcional).
+    """
+    with _fonte_linhas(path, folha, limite) as (headers, rows):
+        if cabecalho is not None:
+            cabecalho[:] = headers
+        pares = [(i, h) for i, h in enumerate(headers) if h]
+        if colunas is not None:
+            pedidas = set(colunas)
+            pares = [(i, h) for i, h in pares if h in pedidas]
+        if not pares:
+            return
+        n = 0
+        for row in rows:
+            if limite is not None and n >= limite:
+                break
+            largura = len(row)
+            yield {h: (row[i] if i < largura else None) for i, h in pares}
+            n += 1
+
+
+def ler_linhas(
+    path: Path,
+    colunas: Optional[Sequence[str]] = None,
+    limite: Optional[int] = None,
+    folha: Folha = None,
+) -> list[dict]:
+    """Lista de dicts da folha (ver iter_linhas). Devolve [] se o ficheiro não existir."""
+    if not Path(path).exists():
+        return []
+    return list(iter_linhas(path, colunas=colunas, limite=limite, folha=folha))
+
+
+def ler_tabela(
+    path: Path,
+    colunas: Optional[Sequence[str]] = None,
+    limite: Optional[int] = None,
+    folha: Folha = None,
+) -> tuple[list, list[dict]]:
+    """(cabeçalho, linhas) da folha."""
+    cabecalho: list = []
+    linhas = list(iter_linhas(path, colunas=colunas, limite=limite, folha=folha, cabecalho=cabecalho))
+    return cabecalho, linhas
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Serviço de OCR partilhado pela API e pelo processamento de emails.
+O tesseract corre num ProcessPoolExecutor com um worker por núcleo (OCR_WORKERS),
+com fila de submissão limitada (quem submete espera quando está cheia) e timeout
+por tarefa (OCR_TIMEOUT segundos: o tesseract é terminado e o resultado é um erro).
+Nos PDFs a decisão é por página: texto embutido onde existe, OCR só nas páginas
+digitalizadas, renderizadas e reconhecidas em paralelo, cada uma no seu worker.
+OCR_WORKERS=0 desativa o pool (OCR na thread de quem chama).
+
+Antes do tesseract as fotos são preparadas (OCR_PREPROCESSAR=0 desativa): JPEG descodificado
+já em escala reduzida (draft), orientação EXIF corrigida, redução até OCR_LADO_MAX píxeis
+(~300 DPI numa folha A4), cinzento, recorte ao documento e binarização adaptativa.
+Benchmark: bench/bench_ocr.py.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+try:
+    import pytesseract
+    from PIL import Image, ImageChops, ImageFilter, ImageOps
+    OCR_AVAILABLE = True
+except ImportError:
+    OCR_AVAILABLE = False
+
+try:
+    import fitz  # PyMuPDF
+    PDF_AVAILABLE = True
+except ImportError:
+    PDF_AVAILABLE = False
+
+LANG = "por+eng"
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "120"))
+# Tarefas submetidas e ainda não terminadas, no máximo
+OCR_MAX_PENDENTES = int(os.getenv("OCR_MAX_PENDENTES", str(max(1, OCR_WORKERS) * 4)))
+OCR_PREPROCESSAR = os.getenv("OCR_PREPROCESSAR", "1") != "0"
+# Lado maior da imagem entregue ao tesseract (3508 px = A4 a 300 DPI)
+OCR_LADO_MAX = int(os.getenv("OCR_LADO_MAX", "3508"))
+# Binarização: vizinhança (px) e quanto mais escuro que a média local um píxel tem de ser para ser tinta
+BIN_RAIO = 15
+BIN_DESVIO = 10
+PDF_DPI = 150
+# Abaixo deste número de caracteres de texto embutido, a página é tratada como digitalizada
+PDF_MIN_TEXTO = 50
+# O PyMuPDF não é thread-safe: no mesmo processo, todas as chamadas a fitz passam por aqui
+# (a API e os emails leem PDFs em várias threads; os workers do pool são processos à parte)
+PDF_LOCK = threading.Lock()
+
+
+# --- Pré-processamento ---
+
+def _limiar_otsu(img: "Image.Image") -> int:
+    """Limiar global de Otsu de uma imagem em cinzento (0-255)."""
+    hist = img.histogram()[:256]
+    total = sum(hist)
+    soma = sum(i * h for i, h in enumerate(hist))
+    soma_fundo = peso_fundo = 0
+    melhor, limiar = -1.0, 127
+    for i, h in enumerate(hist):
+        peso_fundo += h
+        if peso_fundo == 0:
+            continue
+        peso_frente = total - peso_fundo
+        if peso_frente == 0:
+            break
+        soma_fundo += i * h
+        m_fundo = soma_fundo / peso_fundo
+        m_frente = (soma - soma_fundo) / peso_frente
+        var = peso_fundo * peso_frente * (m_fundo - m_frente) ** 2
+        if var > melhor:
+            melhor, limiar = var, i
+    return limiar
+
+
+def _recortar_documento(img: "Image.Image") -> "Image.Image":
+    """
+    Recorta a zona clara (papel) quando a foto apanha fundo à volta.
+    Se a zona encontrada for pequena demais ou quase a imagem toda, fica como está.
+    """
+    escala = max(1, max(img.size) // 500)
+    pequena = img.reduce(escala).filter(ImageFilter.MedianFilter(5))
+    limiar = _limiar_otsu(pequena)
+    caixa = pequena.point(lambda v: 255 if v > limiar else 0).getbbox()
+    if not caixa:
+        return img
+    l, t, r, b = caixa
+    area = (r - l) * (b - t) / (pequena.width * pequena.height)
+    if area < 0.2 or area > 0.95:
+        return img
+    m = 2  # margem (px na escala reduzida)
+    return img.crop((
+        max(0, (l - m) * escala), max(0, (t - m) * escala),
+        min(img.width, (r + m) * escala), min(img.height, (b + m) * escala),
+    ))
+
+
+def _binarizar(img: "Image.Image") -> "Image.Image":
+    """Limiar adaptativo pela média local: tinta = píxeis BIN_DESVIO mais escuros que a vizinhança."""
+    media = img.filter(ImageFilter.BoxBlur(BIN_RAIO))
+    return ImageChops.subtract(media, img).point(lambda v: 0 if v > BIN_DESVIO else 255)
+
+
+def preparar_imagem(path: str, lado_max: int = OCR_LADO_MAX) -> "Image.Image":
+    """Foto -> imagem a preto e branco, direita, recortada e com no máximo lado_max píxeis."""
+    img = Image.open(path)
+    if img.format == "JPEG":
+        # Descodifica logo a 1/2, 1/4 ou 1/8 (sem passar pela resolução completa)
+        img.draft("L", (lado_max, lado_max))
+    img = ImageOps.exif_transpose(img)
+    img = img.convert("L")
+    if max(img.size) > lado_max:
+        img.thumbnail((lado_max, lado_max), Image.LANCZOS)
+    img = _recortar_documento(img)
+    return _binarizar(img)
+
+
+# --- Tarefas (correm nos processos do pool; funções de topo para serem picklable) ---
+
+def _ocr_imagem_tarefa(path: str, preprocessar: bool = OCR_PREPROCESSAR) -> str:
+    if preprocessar:
+        img = preparar_imagem(path)
+    else:
+        img = Image.open(path)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+    return pytesseract.image_to_string(img, lang=LANG, timeout=OCR_TIMEOUT)
+
+
+def _ocr_pagina_pdf_tarefa(path: str, pagina: int, dpi: int) -> str:
+    with PDF_LOCK:
+        doc = fitz.open(path)
+        try:
+            # Cinzento: 1/3 da memória de RGB e é o que o tesseract usa
+            pix = doc[pagina].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+            img = Image.frombytes("L", [pix.width, pix.height], pix.samples)
+            del pix
+        finally:
+            doc.close()
+    return pytesseract.image_to_string(img, lang=LANG, timeout=OCR_TIMEOUT)
+
+
+# --- Pool ---
+
+class MotorOCR:
+    def __init__(self, workers: int = OCR_WORKERS, max_pendentes: int = OCR_MAX_PENDENTES):
+        self.workers = workers
+        self._vagas = threading.BoundedSemaphore(max(1, max_pendentes))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _executor(self) -> Optional[ProcessPoolExecutor]:
+        if self.workers <= 0:
+            return None
+        with self._lock:
+            if self._pool is None:
+                # spawn: o processo que chama pode ter threads (uvicorn, fila de jobs)
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            return self._pool
+
+    def _reiniciar(self, pool: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def submeter(self, funcao: Callable, *args) -> Future:
+        """Submete uma tarefa ao pool; bloqueia enquanto houver OCR_MAX_PENDENTES por terminar."""
+        pool = self._executor()
+        if pool is None:
+            fut: Future = Future()
+            try:
+                fut.set_result(funcao(*args))
+            except Exception as e:
+                fut.set_exception(e)
+            return fut
+        self._vagas.acquire()
+        try:
+            fut = pool.submit(funcao, *args)
+        except BrokenProcessPool:
+            self._vagas.release()
+            self._reiniciar(pool)
+            return self.submeter(funcao, *args)
+        except BaseException:
+            self._vagas.release()
+            raise
+        fut.add_done_callback(lambda _: self._vagas.release())
+        return fut
+
+    def resultado(self, fut: Future, prefixo_erro: str = "OCR erro") -> str:
+        """Texto da tarefa, ou "[<prefixo_erro>: ...]" em caso de erro ou timeout."""
+        try:
+            # Sem timeout aqui: o relógio começaria quando quem chama começa a esperar, e as
+            # tarefas ainda na fila seriam dadas como expiradas. Cada tarefa já tem o limite do
+            # tesseract (OCR_TIMEOUT, contado desde que ela arranca) e um worker que morra
+            # chega como BrokenProcessPool.
+            return fut.result()
+        except BrokenProcessPool as e:
+            if self._pool is not None:
+                self._reiniciar(self._pool)
+            return f"[{prefixo_erro}: {e}]"
+        except Exception as e:
+            return f"[{prefixo_erro}: {e}]"
+
+    def ocr_imagem(self, img_path: Path, preprocessar: bool = OCR_PREPROCESSAR) -> str:
+        if not OCR_AVAILABLE:
+            return ""
+        return self.resultado(self.submeter(_ocr_imagem_tarefa, str(img_path), preprocessar))
+
+    def ocr_imagens(self, paths: Sequence[Path], preprocessar: bool = OCR_PREPROCESSAR) -> list[str]:
+        """OCR de várias imagens em paralelo (todas submetidas antes de esperar pela primeira)."""
+        if not OCR_AVAILABLE:
+            return ["" for _ in paths]
+        futs = [self.submeter(_ocr_imagem_tarefa, str(p), preprocessar) for p in paths]
+        return [self.resultado(f) for f in futs]
+
+    def texto_pdf(self, pdf_path: Path) -> str:
+        """
+        Texto do PDF, página a página: texto embutido nas páginas que o têm (PDF_MIN_TEXTO
+        caracteres ou mais) e OCR só das restantes (digitalizadas). O texto embutido de todas
+        as páginas é lido de uma vez (sob PDF_LOCK); as páginas sem texto vão depois para o pool,
+        cada uma renderizada no seu worker, e com OCR_MAX_PENDENTES em curso quem chama espera.
+        Uma página com algum texto embutido mas abaixo do limiar (ex: só a linha dos totais ou um
+        carimbo sobre a digitalização) também vai a OCR; o texto embutido fica se o OCR falhar
+        ou reconhecer menos texto do que ele.
+        """
+        if not PDF_AVAILABLE:
+            return ""
+        try:
+            with PDF_LOCK:
+                doc = fitz.open(pdf_path)
+                try:
+                    embutidos = [page.get_text() for page in doc]
+                finally:
+                    doc.close()
+            partes: list = []  # texto embutido (str) ou OCR pendente (Future, texto embutido)
+            for n, texto in enumerate(embutidos):
+                if len(texto.strip()) >= PDF_MIN_TEXTO or not OCR_AVAILABLE:
+                    partes.append(texto)
+                else:
+                    partes.append((self.submeter(_ocr_pagina_pdf_tarefa, str(pdf_path), n, PDF_DPI), texto))
+            if not OCR_AVAILABLE and len("".join(partes).strip()) < PDF_MIN_TEXTO:
+                return "".join(partes) or "[PDF sem texto embutido; instale pytesseract para OCR]"
+            out = []
+            for parte in partes:
+                if isinstance(parte, tuple):
+                    fut, embutido = parte
+                    texto = self.resultado(fut)
+                    if embutido.strip() and (
+                        texto.startswith("[OCR erro") or len(texto.strip()) < len(embutido.strip())
+                    ):
+                        texto = embutido
+                    parte = texto if texto.endswith("\n") else texto + "\n"
+                out.append(parte)
+            return "".join(out)
+        except Exception as e:
+            return f"[PDF erro: {e}]"
+
+
+MOTOR = MotorOCR()
+
+
+def ocr_imagem(img_path: Path) -> str:
+    """Texto reconhecido na imagem ("" sem pytesseract; "[OCR erro: ...]" em caso de falha)."""
+    return MOTOR.ocr_imagem(img_path)
+
+
+def ocr_imagens(paths: Sequence[Path]) -> list[str]:
+    return MOTOR.ocr_imagens(paths)
+
+
+def texto_pdf(pdf_path: Path) -> str:
+    return MOTOR.texto_pdf(pdf_path)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Agregado persistido de custos_registo por obra e tipo: (centro, tipo) -> soma, n, última data.
+Guardado em custos_rollup.json ao lado de custos_registo.xlsx, com a assinatura (mtime, tamanho)
+do registo e do seu diário (utils/diario_custos) a que corresponde. Se o registo for alterado
+por outra via (edição manual), a assinatura deixa de bater e o agregado é recalculado na próxima leitura.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Iterable, Optional
+
+from utils import diario_custos
+
+TIPOS_CUSTO = ("subempreitadas", "materiais", "mao_obra", "equipamentos_maquinaria", "custos_sede")
+NOME_FICHEIRO = "custos_rollup.json"
+
+
+def caminho_rollup(registo_path: Path) -> Path:
+    return Path(registo_path).with_name(NOME_FICHEIRO)
+
+
+def normalizar_tipo(tipo) -> str:
+    t = (tipo or "materiais").strip().lower()
+    if t == "subempreitada":
+        t = "subempreitadas"
+    return t if t in TIPOS_CUSTO else "materiais"
+
+
+def _valor(linha: dict) -> float:
+    val = linha.get("net_amount") or linha.get("unit_price") or 0
+    try:
+        return float(val) if val is not None else 0
+    except (TypeError, ValueError):
+        return 0
+
+
+def _somar(obras: dict, linhas: Iterable[dict]) -> dict:
+    for r in linhas:
+        cc = str(r.get("centro_custo_codigo") or "").strip()
+        if not cc:
+            continue
+        por_tipo = obras.setdefault(cc, {})
+        t = normalizar_tipo(r.get("tipo_linha"))
+        agg = por_tipo.setdefault(t, {"soma": 0, "n": 0, "ultima_data": ""})
+        agg["soma"] += _valor(r)
+        agg["n"] += 1
+        d = str(r.get("date") or "")[:10]
+        if d > agg["ultima_data"]:
+            agg["ultima_data"] = d
+    return obras
+
+
+def calcular(linhas: Iterable[dict]) -> dict:
+    """Agregado completo {centro: {tipo: {soma, n, ultima_data}}} a partir das linhas do registo."""
+    return _somar({}, linhas)
+
+
+def _ler(registo_path: Path) -> Optional[dict]:
+    path = caminho_rollup(registo_path)
+    if not path.exists():
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def carregar(registo_path: Path) -> Optional[dict]:
+    """Agregado persistido, ou None se não existir ou estiver desatualizado face ao registo."""
+    dados = _ler(registo_path)
+    if not dados or dados.get("fonte") != diario_custos.assinatura(registo_path):
+        return None
+    return dados.get("obras") or {}
+
+
+def guardar(registo_path: Path, obras: dict) -> None:
+    """Grava o agregado associado ao estado atual do registo (escrita atómica)."""
+    path = caminho_rollup(registo_path)
+    tmp = path.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"fonte": diario_custos.assinatura(registo_path), "obras": obras}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def adicionar(registo_path: Path, linhas: Iterable[dict], assinatura_anterior) -> bool:
+    """
+    Soma linhas acabadas de acrescentar ao registo, sem recalcular tudo.
+    assinatura_anterior é diario_custos.assinatura do registo antes da escrita: só se o agregado
+    correspondia a esse estado é que o incremento é válido. Caso contrário não faz nada
+    (o agregado fica desatualizado e é recalculado na próxima leitura). Devolve True se atualizou.
+    """
+    dados = _ler(registo_path)
+    if not dados or assinatura_anterior is None or dados.get("fonte") != assinatura_anterior:
+        return False
+    guardar(registo_path, _somar(dados.get("obras") or {}, linhas))
+    return True
+
+
+def listar_obras(obras: dict) -> list[dict]:
+    """Formato de /api/custos/obras: um registo por centro com total e soma por tipo."""
+    out = []
+    for cc, por_tipo in obras.items():
+        item = {"centro_custo_codigo": cc, "total": 0, **{t: 0 for t in TIPOS_CUSTO}}
+        for t, agg in por_tipo.items():
+            item[t] += agg["soma"]
+            item["total"] += agg["soma"]
+        out.append(item)
+    return out
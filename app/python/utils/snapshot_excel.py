@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Snapshots binários (pickle) dos workbooks geridos, ao lado do .xlsx em .snapshots/.
+O Excel continua a ser o formato editado por pessoas; os serviços leem o snapshot
+quando está atualizado (mesma assinatura mtime/tamanho do .xlsx) e evitam o parse do XML.
+Snapshot desatualizado ou inexistente -> o leitor volta ao .xlsx e regenera-o.
+Desativar com GESTAO_SNAPSHOTS=0.
+"""
+import fnmatch
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+from utils.cache_excel import assinatura_ficheiro
+
+VERSAO = 1
+PASTA = ".snapshots"
+ATIVO = os.getenv("GESTAO_SNAPSHOTS", "1") != "0"
+
+# Workbooks com snapshot (nome do ficheiro)
+GERIDOS = (
+    "custos_registo.xlsx",
+    "custos_linhas.xlsx",
+    "compras_*.xlsx",
+    "vendas_*.xlsx",
+    "fornecedores.xlsx",
+    "clientes.xlsx",
+    "centros_custo.xlsx",
+    "alocacao_diaria.xlsx",
+)
+
+
+def gerido(path: Path) -> bool:
+    nome = Path(path).name
+    return ATIVO and any(fnmatch.fnmatch(nome, p) for p in GERIDOS)
+
+
+def _chave_folha(folha: Union[str, Sequence[str], None]) -> str:
+    if folha is None:
+        return "_ativa"
+    if isinstance(folha, str):
+        return folha
+    return "|".join(folha)
+
+
+def caminho_snapshot(path: Path, folha=None) -> Path:
+    path = Path(path)
+    return path.parent / PASTA / f"{path.name}.{_chave_folha(folha)}.pkl"
+
+
+def _descartar(snap: Path) -> None:
+    """Apaga um snapshot ilegível (o leitor volta ao .xlsx e grava um novo)."""
+    try:
+        snap.unlink()
+    except OSError:
+        pass
+
+
+def _abrir(path: Path, folha):
+    """Ficheiro do snapshot posicionado após os metadados, se estiver atualizado; senão None."""
+    assinatura = assinatura_ficheiro(path)
+    if assinatura is None:
+        return None, None
+    snap = caminho_snapshot(path, folha)
+    try:
+        f = open(snap, "rb")
+    except OSError:
+        return None, None
+    try:
+        # 1º objeto: metadados (lidos sem desserializar as linhas)
+        meta = pickle.load(f)
+        if meta.get("versao") == VERSAO and tuple(meta.get("fonte") or ()) == assinatura:
+            if not isinstance(meta.get("cabecalho"), list):
+                raise TypeError("snapshot sem cabeçalho")
+            return f, meta
+    except Exception:
+        # Truncado, corrompido ou de outra versão do código: qualquer erro do unpickle
+        # (ValueError, KeyError, ImportError, ...) tem de cair no .xlsx, não no pedido
+        f.close()
+        _descartar(snap)
+        return None, None
+    f.close()
+    return None, None
+
+
+def obter_cabecalho(path: Path, folha=None) -> Optional[list]:
+    """Cabeçalho guardado no snapshot atualizado, ou None."""
+    f, meta = _abrir(path, folha)
+    if f is None:
+        return None
+    f.close()
+    return meta["cabecalho"]
+
+
+def carregar(path: Path, folha=None) -> Optional[tuple[list, list[tuple]]]:
+    """(cabeçalho, linhas) do snapshot se corresponder ao .xlsx atual; senão None."""
+    f, meta = _abrir(path, folha)
+    if f is None:
+        return None
+    try:
+        with f:
+            linhas = pickle.load(f)
+        if not isinstance(linhas, list):
+            raise TypeError(f"linhas do snapshot: {type(linhas).__name__}")
+    except Exception:
+        _descartar(caminho_snapshot(path, folha))
+        return None
+    return meta["cabecalho"], linhas
+
+
+def guardar(path: Path, folha, cabecalho: list, linhas: list[tuple], assinatura) -> None:
+    """
+    Grava o snapshot de forma atómica. assinatura deve ser a do .xlsx no momento
+    em que foi lido (se entretanto mudou, o snapshot nasce já desatualizado e é ignorado).
+    """
+    snap = caminho_snapshot(path, folha)
+    try:
+        snap.parent.mkdir(exist_ok=True)
+        # Temporário por thread: dois leitores que falham a cache ao mesmo tempo gravam ambos
+        tmp = snap.with_name(f"{snap.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                meta = {"versao": VERSAO, "fonte": assinatura, "cabecalho": list(cabecalho)}
+                pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(linhas, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, snap)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+    except OSError:
+        # Sem permissão de escrita (ex: volume só de leitura): continua a funcionar sem snapshot
+        pass
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Linhas de produto de faturas em PDF digital lidas pela posição das palavras (PyMuPDF
+get_text("words")), sem passar pelo texto corrido: encontra o cabeçalho da tabela
+(Código, Designação, Qtd, Preço, IVA, Líquido...), usa a posição de cada título como coluna
+e lê as linhas por baixo até aos totais. Linhas sem valores a seguir a um produto são a
+continuação da designação (produtos em várias linhas).
+
+Só se aplica quando todas as páginas têm texto embutido; caso contrário (ou sem tabela
+reconhecida) devolve [] e extrair_factura usa a heurística sobre o texto.
+"""
+import re
+import unicodedata
+from pathlib import Path
+from typing import Optional
+
+from utils.ocr import PDF_AVAILABLE, PDF_LOCK, PDF_MIN_TEXTO
+from utils.taxas_iva import parse_taxa_iva
+
+if PDF_AVAILABLE:
+    import fitz
+
+# Título da coluna (normalizado) -> campo de LinhaFactura; None = coluna lida mas ignorada
+_TITULOS = (
+    (re.compile(r"^(cod|ref|artigo$)"), "codigo"),
+    (re.compile(r"^(designacao|descricao|descr|produto)"), "designacao"),
+    (re.compile(r"^(unid|und?$|un\.)"), "unidade"),
+    (re.compile(r"^(qtd|qt\.?$|quant)"), "quantidade"),
+    (re.compile(r"^(preco|p\.? ?unit|pr\.? ?unit|valor unit)"), "preco_unitario"),
+    (re.compile(r"^(valor iva|v\.? ?iva)"), None),
+    (re.compile(r"^(% ?iva|iva|taxa|tx)"), "iva_pct"),
+    (re.compile(r"(desc|dto)"), None),
+    (re.compile(r"^(valor liquido|liquido|total|valor|montante|importancia|subtotal)"), "valor_liquido"),
+)
+# Fim da tabela
+_RE_FIM = re.compile(r"^(total|totais|taxas|valor iliquido|observacoes|resumo|transportar|a transportar)")
+_RE_CODIGO = re.compile(r"^\d{6,15}$")
+_RE_NUMERO = re.compile(r"^-?\d{1,3}(?:[ .]\d{3})*(?:,\d+)?$|^-?\d+(?:[.,]\d+)?$")
+
+
+def _normalizar(s: str) -> str:
+    if s.isascii():
+        return s.lower().strip(" :")
+    s = unicodedata.normalize("NFKD", s)
+    return "".join(c for c in s if not unicodedata.combining(c)).lower().strip(" :")
+
+
+def _campo_titulo(titulo: str) -> tuple[bool, Optional[str]]:
+    """(é título de coluna, campo)."""
+    t = _normalizar(titulo)
+    for padrao, campo in _TITULOS:
+        if padrao.search(t):
+            return True, campo
+    return False, None
+
+
+def _numero(s: str) -> Optional[float]:
+    s = s.strip().rstrip("%").strip()
+    if not _RE_NUMERO.match(s):
+        return None
+    if "," in s:
+        s = s.replace(".", "").replace(" ", "").replace(",", ".")
+    elif s.count(".") > 1 or re.search(r"\.\d{3}$", s):
+        s = s.replace(".", "")  # 1.500 = mil e quinhentos
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _linhas_visuais(palavras: list) -> list[list]:
+    """Palavras agrupadas por linha (base alinhada, com tolerância), de cima para baixo e da esquerda para a direita."""
+    out: list[list] = []
+    base = None
+    for w in sorted(palavras, key=lambda w: (w[3], w[0])):
+        y = w[3]
+        if base is not None and y - base <= max(2.0, 0.3 * (y - w[1])):
+            out[-1].append(w)
+        else:
+            out.append([w])
+            base = y
+    for l in out:
+        l.sort()
+    return out
+
+
+def _colunas(linha: list) -> Optional[list[dict]]:
+    """Colunas da tabela se a linha for um cabeçalho (títulos contíguos juntos: "% Desc.", "Preço Unit.")."""
+    if len(linha) < 3 or not (linha[0][4] == "%" or _campo_titulo(linha[0][4])[0]):
+        return None
+    titulos: list[list] = []
+    for w in linha:
+        espaco = 0.6 * (w[3] - w[1])
+        if titulos and w[0] - titulos[-1][2] <= espaco:
+            t = titulos[-1]
+            titulos[-1] = [t[0], t[1], w[2], w[3], f"{t[4]} {w[4]}"]
+        else:
+            titulos.append(list(w[:5]))
+    cols = []
+    for x0, _, x1, _, texto in titulos:
+        e_titulo, campo = _campo_titulo(texto)
+        if not e_titulo:
+            return None  # texto que não é título: não é o cabeçalho
+        cols.append({"x0": x0, "x1": x1, "campo": campo})
+    campos = {c["campo"] for c in cols}
+    if len(cols) < 3 or "designacao" not in campos or not campos & {"valor_liquido", "preco_unitario"}:
+        return None
+    return cols
+
+
+def _coluna_de(w, cols: list[dict]) -> dict:
+    """Coluna da palavra: a do título que mais se sobrepõe; sem sobreposição, a de limite direito mais próximo (números alinhados à direita)."""
+    melhor, sobre = None, 0.0
+    for c in cols:
+        s = min(w[2], c["x1"]) - max(w[0], c["x0"])
+        if s > sobre:
+            melhor, sobre = c, s
+    return melhor or min(cols, key=lambda c: abs(w[2] - c["x1"]))
+
+
+def _ler_tabela(linhas: list[list], cols: list[dict]) -> list[dict]:
+    idx_desig = next(i for i, c in enumerate(cols) if c["campo"] == "designacao")
+    # Designação: tudo o que acaba antes do título da coluna seguinte
+    limite_desig = cols[idx_desig + 1]["x0"] if idx_desig + 1 < len(cols) else float("inf")
+    x0_desig = cols[idx_desig - 1]["x1"] if idx_desig > 0 else float("-inf")
+    itens: list[dict] = []
+    altura = linhas[0][0][3] - linhas[0][0][1] if linhas and linhas[0] else 10.0
+    y_anterior = None
+    for linha in linhas:
+        if y_anterior is not None and linha[0][3] - y_anterior > 4 * max(altura, 6.0):
+            break  # espaço grande: acabou a tabela
+        if _RE_FIM.match(_normalizar(" ".join(w[4] for w in linha[:2]))):
+            break
+        y_anterior = linha[0][3]
+        campos: dict[str, list[str]] = {}
+        for n, w in enumerate(linha):
+            if n == 0 and _RE_CODIGO.match(w[4]) and w[2] <= limite_desig and any(c["campo"] == "codigo" for c in cols):
+                campos.setdefault("codigo", []).append(w[4])
+            elif w[0] > x0_desig - 1 and w[2] <= limite_desig:
+                campos.setdefault("designacao", []).append(w[4])
+            else:
+                campo = _coluna_de(w, cols)["campo"]
+                if campo:
+                    campos.setdefault(campo, []).append(w[4])
+        valores = {k: v for k, v in campos.items() if k not in ("designacao", "codigo")}
+        if not valores:
+            # Sem valores: continuação da designação do produto anterior
+            if itens and "designacao" in campos and "codigo" not in campos:
+                itens[-1]["designacao"] = f"{itens[-1]['designacao']} {' '.join(campos['designacao'])}"
+            continue
+        item = {
+            "designacao": " ".join(campos.get("designacao", [])),
+            "codigo": " ".join(campos.get("codigo", [])),
+            "unidade": " ".join(campos.get("unidade", [])).upper() or "UN",
+            "quantidade": _numero(" ".join(campos.get("quantidade", []))),
+            "preco_unitario": _numero(" ".join(campos.get("preco_unitario", []))),
+            "valor_liquido": _numero(" ".join(campos.get("valor_liquido", []))),
+            "iva_pct": parse_taxa_iva(" ".join(campos.get("iva_pct", []))) if "iva_pct" in campos else None,
+        }
+        if item["valor_liquido"] is None and item["preco_unitario"] is None:
+            continue
+        itens.append(item)
+    for item in itens:
+        qtd, preco, liq = item["quantidade"], item["preco_unitario"], item["valor_liquido"]
+        if qtd is None:
+            item["quantidade"] = round(liq / preco, 2) if liq and preco else 1.0
+        if liq is None and preco is not None:
+            item["valor_liquido"] = round(preco * item["quantidade"], 2)
+        item["designacao"] = item["designacao"][:150]
+    return [i for i in itens if i["designacao"]]
+
+
+def linhas_pagina(palavras: list) -> list[dict]:
+    """Produtos da tabela de uma página (palavras no formato de page.get_text("words"))."""
+    linhas = _linhas_visuais(palavras)
+    for n, linha in enumerate(linhas):
+        cols = _colunas(linha)
+        if cols:
+            return _ler_tabela(linhas[n + 1:], cols)
+    return []
+
+
+def linhas_pdf(pdf_path: Path) -> list[dict]:
+    """
+    Produtos (campos de LinhaFactura) das tabelas de todas as páginas, pela ordem.
+    [] se o PDF tiver páginas digitalizadas, não tiver tabela reconhecível ou PyMuPDF não estiver instalado.
+    """
+    if not PDF_AVAILABLE:
+        return []
+    try:
+        with PDF_LOCK:
+            doc = fitz.open(pdf_path)
+            try:
+                paginas = [page.get_text("words") for page in doc]
+            finally:
+                doc.close()
+    except Exception:
+        return []
+    if any(sum(len(w[4]) for w in palavras) < PDF_MIN_TEXTO for palavras in paginas):
+        return []  # página digitalizada
+    out: list[dict] = []
+    for palavras in paginas:
+        out.extend(linhas_pagina(palavras))
+    return out